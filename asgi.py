@@ -0,0 +1,63 @@
+"""
+ASGI entry point of asyncio engine, e.g. `uvicorn asgi:app`
+
+Updates are acknowledged immediately and processed in background tasks.
+"""
+import json
+
+from project.metrics import METRICS
+from project.settings import ASGI_WEBHOOK_PATH
+from watchdog_robot import WatchdogRobot
+
+robot = WatchdogRobot()
+robot.set_opts({'mode': 'production'})
+engine = robot.build_async_engine()
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def send_response(send, status, body):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'text/plain')],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def handle_lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await engine.start()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await engine.stop()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await handle_lifespan(receive, send)
+    elif scope['type'] == 'http':
+        if scope['method'] == 'GET' and scope['path'] == '/metrics':
+            await send_response(send, 200, METRICS.render().encode('utf-8'))
+            return
+        if scope['method'] != 'POST' or scope['path'] != ASGI_WEBHOOK_PATH:
+            await send_response(send, 404, b'Not Found')
+            return
+        try:
+            data = json.loads((await read_body(receive)).decode('utf-8'))
+        except ValueError:
+            await send_response(send, 400, b'Invalid JSON')
+            return
+        engine.spawn(engine.process_update_safe(data))
+        await send_response(send, 200, b'OK')
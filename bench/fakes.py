@@ -0,0 +1,217 @@
+"""
+Fake Bot API and in-memory database used by the benchmark.
+"""
+from collections import Counter
+from itertools import count
+import threading
+import time
+
+
+class FakeUser(object):
+    def __init__(self, user_id):
+        self.id = user_id
+
+
+class FakeChatMember(object):
+    def __init__(self, user_id):
+        self.user = FakeUser(user_id)
+
+
+class FakeMessage(object):
+    def __init__(self, message_id):
+        self.message_id = message_id
+
+
+class FakeBot(object):
+    """
+    Bot API stand-in which sleeps `latency` seconds on each call.
+
+    Admins of chat `chat_id` are users with ids `abs(chat_id) * 10 + N`
+    where N in range(admin_count).
+    """
+    def __init__(self, latency=0.0, admin_count=2):
+        self.latency = latency
+        self.admin_count = admin_count
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._message_ids = count(1)
+
+    def _call(self, method):
+        with self._lock:
+            self.calls[method] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_me(self):
+        self._call('getMe')
+        return FakeUser(1)
+
+    def get_chat_administrators(self, chat_id, **kwargs):
+        self._call('getChatAdministrators')
+        return [
+            FakeChatMember(abs(chat_id) * 10 + idx)
+            for idx in range(self.admin_count)
+        ]
+
+    def delete_message(self, chat_id, message_id, **kwargs):
+        self._call('deleteMessage')
+        return True
+
+    def delete_messages(self, chat_id, message_ids, **kwargs):
+        self._call('deleteMessages')
+        return True
+
+    def send_message(self, chat_id, text, **kwargs):
+        self._call('sendMessage')
+        return FakeMessage(next(self._message_ids))
+
+
+def match_query(doc, query):
+    for key, value in query.items():
+        if isinstance(value, dict) and '$exists' in value:
+            if (key in doc) != value['$exists']:
+                return False
+        elif doc.get(key) != value:
+            return False
+    return True
+
+
+def apply_update(doc, ops, inserted):
+    for op, fields in ops.items():
+        for key, value in fields.items():
+            path = key.split('.')
+            target = doc
+            for part in path[:-1]:
+                target = target.setdefault(part, {})
+            name = path[-1]
+            if op == '$set':
+                target[name] = value
+            elif op == '$setOnInsert':
+                if inserted:
+                    target[name] = value
+            elif op == '$inc':
+                target[name] = target.get(name, 0) + value
+            elif op == '$addToSet':
+                items = target.setdefault(name, [])
+                if isinstance(value, dict) and '$each' in value:
+                    values = value['$each']
+                else:
+                    values = [value]
+                items.extend(x for x in values if x not in items)
+            elif op == '$unset':
+                target.pop(name, None)
+
+
+class MemoryCollection(object):
+    """
+    Implements the subset of pymongo collection API used by the robot.
+    """
+    def __init__(self, name, database):
+        self.name = name
+        self.database = database
+        self.docs = {}
+        self._ids = count(1)
+        self._lock = threading.Lock()
+
+    def _count(self, method):
+        self.database.calls['%s.%s' % (self.name, method)] += 1
+
+    def _project(self, doc, projection):
+        if not projection:
+            return dict(doc)
+        ret = dict(
+            (key, doc[key]) for key, value in projection.items()
+            if value and key in doc
+        )
+        if projection.get('_id', 1) and '_id' in doc:
+            ret['_id'] = doc['_id']
+        return ret
+
+    def find(self, query=None, projection=None, **kwargs):
+        self._count('find')
+        with self._lock:
+            docs = list(self.docs.values())
+        return [
+            self._project(x, projection) for x in docs
+            if match_query(x, query or {})
+        ]
+
+    def find_one(self, query=None, projection=None, **kwargs):
+        self._count('find_one')
+        with self._lock:
+            docs = list(self.docs.values())
+        for doc in docs:
+            if match_query(doc, query or {}):
+                return self._project(doc, projection)
+        return None
+
+    def _upsert(self, query, ops, upsert):
+        with self._lock:
+            for doc in self.docs.values():
+                if match_query(doc, query):
+                    apply_update(doc, ops, False)
+                    return doc
+            if not upsert:
+                return None
+            doc = dict(query)
+            doc.setdefault('_id', next(self._ids))
+            apply_update(doc, ops, True)
+            self.docs[doc['_id']] = doc
+            return doc
+
+    def find_one_and_update(self, query, ops, upsert=False, **kwargs):
+        self._count('find_one_and_update')
+        return self._upsert(query, ops, upsert)
+
+    def update_one(self, query, ops, upsert=False):
+        self._count('update_one')
+        self._upsert(query, ops, upsert)
+
+    def insert_one(self, doc):
+        self._count('insert_one')
+        with self._lock:
+            doc.setdefault('_id', next(self._ids))
+            self.docs[doc['_id']] = doc
+
+    def insert_many(self, docs, ordered=True):
+        self._count('insert_many')
+        with self._lock:
+            for doc in docs:
+                doc.setdefault('_id', next(self._ids))
+                self.docs[doc['_id']] = doc
+
+    def bulk_write(self, ops, ordered=True):
+        self._count('bulk_write')
+        for op in ops:
+            doc = op._doc
+            if not all(x.startswith('$') for x in doc):
+                # ReplaceOne
+                doc = {'$set': doc}
+            self._upsert(op._filter, doc, op._upsert)
+
+    def create_index(self, *args, **kwargs):
+        self._count('create_index')
+
+    def index_information(self):
+        return {}
+
+    def count(self):
+        return len(self.docs)
+
+
+class MemoryDatabase(object):
+    def __init__(self):
+        self.calls = Counter()
+        self._collections = {}
+
+    def __getitem__(self, name):
+        try:
+            return self._collections[name]
+        except KeyError:
+            coll = self._collections[name] = MemoryCollection(name, self)
+            return coll
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
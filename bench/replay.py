@@ -0,0 +1,180 @@
+"""
+Replays Telegram updates through the robot's dispatcher with fake
+Bot API and in-memory database and reports throughput.
+
+    python -m bench.replay --profile raid --updates 10000
+    python -m bench.replay --profile raid --store sqlite
+    python -m bench.replay --input updates.jsonl
+    python -m bench.replay --profile media --save updates.jsonl
+
+Handler latency is the time `dispatcher.process_update` takes, total
+time also includes draining the action queue and the write buffer.
+"""
+from argparse import ArgumentParser
+import json
+import os
+import sys
+import tempfile
+import time
+
+from bench.fakes import FakeBot, MemoryDatabase
+from bench.traffic import (
+    PROFILES, generate, build_chat_config, get_chat_ids, get_raided_chat_ids,
+)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0
+    values = sorted(values)
+    idx = min(len(values) - 1, int(len(values) * pct / 100.0))
+    return values[idx]
+
+
+def load_updates(path):
+    with open(path) as inp:
+        for line in inp:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def build_store(name):
+    if name == 'mongomock':
+        import mongomock
+
+        return mongomock.MongoClient().db
+    if name == 'sqlite':
+        # Memory database is still used by deduplicator
+        import project.settings
+
+        project.settings.STORAGE = {
+            'backend': 'sqlite',
+            'options': {
+                'path': os.path.join(tempfile.mkdtemp(), 'watchdog.sqlite'),
+            },
+        }
+    return MemoryDatabase()
+
+
+def load_robot_module(store):
+    # Robot module connects to database on import
+    import project.database
+
+    project.database.connect_db = lambda: store
+    import watchdog_robot
+
+    return watchdog_robot
+
+
+def wait_queue_drained(queue, timeout=600):
+    started = time.time()
+    while queue.qsize() and time.time() - started < timeout:
+        time.sleep(0.01)
+
+
+def replay(updates, store, bot, config_rows=()):
+    from telegram import Update
+    from telegram.ext import Dispatcher
+
+    module = load_robot_module(store)
+    if config_rows:
+        module.STORAGE.import_records('config', config_rows)
+    robot = module.WatchdogRobot()
+    robot.bot_id = bot.get_me().id
+    bot.calls.clear()
+    module.ACTION_QUEUE.start()
+    module.STORAGE.start()
+    dispatcher = Dispatcher(bot, None, workers=0)
+    robot.register_handlers(dispatcher)
+
+    if hasattr(store, 'calls'):
+        store.calls.clear()
+    latencies = []
+    started = time.time()
+    for data in updates:
+        update = Update.de_json(data, bot)
+        handler_started = time.time()
+        dispatcher.process_update(update)
+        latencies.append(time.time() - handler_started)
+    handled = time.time()
+    wait_queue_drained(module.ACTION_QUEUE)
+    module.STORAGE.flush()
+    finished = time.time()
+
+    count = len(latencies) or 1
+    db_calls = sum(store.calls.values()) if hasattr(store, 'calls') else None
+    return {
+        'updates': len(latencies),
+        'updates_per_sec': len(latencies) / max(handled - started, 1e-9),
+        'total_time': finished - started,
+        'handler_p50_ms': percentile(latencies, 50) * 1000,
+        'handler_p99_ms': percentile(latencies, 99) * 1000,
+        'db_calls_per_update': (
+            db_calls / float(count) if db_calls is not None else None
+        ),
+        'db_calls': dict(store.calls) if hasattr(store, 'calls') else None,
+        'api_calls_per_update': sum(bot.calls.values()) / float(count),
+        'api_calls': dict(bot.calls),
+    }
+
+
+def render_report(result):
+    out = [
+        'Updates: %d' % result['updates'],
+        'Updates/sec: %.1f' % result['updates_per_sec'],
+        'Total time (incl. queue drain): %.2fs' % result['total_time'],
+        'Handler latency p50: %.3fms' % result['handler_p50_ms'],
+        'Handler latency p99: %.3fms' % result['handler_p99_ms'],
+        'Bot API calls/update: %.3f' % result['api_calls_per_update'],
+    ]
+    if result['db_calls_per_update'] is not None:
+        out.append('DB calls/update: %.3f' % result['db_calls_per_update'])
+    for key in ('api_calls', 'db_calls'):
+        for name, value in sorted((result[key] or {}).items()):
+            out.append('  %s: %d' % (name, value))
+    return '\n'.join(out)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--input', help='JSONL file with updates')
+    parser.add_argument('--profile', choices=PROFILES, default='many_chats')
+    parser.add_argument('--updates', type=int, default=10000)
+    parser.add_argument('--chats', type=int, default=1000)
+    parser.add_argument('--blocked-share', type=float, default=0.2)
+    parser.add_argument('--api-latency', type=float, default=0.0)
+    parser.add_argument('--store', choices=('memory', 'mongomock', 'sqlite'),
+                        default='memory')
+    parser.add_argument('--save', help='save generated updates and exit')
+    parser.add_argument('--json', action='store_true',
+                        help='print result as JSON')
+    opts = parser.parse_args()
+
+    if opts.save:
+        with open(opts.save, 'w') as out:
+            for data in generate(opts.profile, opts.updates, opts.chats):
+                out.write(json.dumps(data) + '\n')
+        return
+
+    store = build_store(opts.store)
+    chat_ids = get_chat_ids(opts.chats)
+    rows = build_chat_config(
+        chat_ids, blocked_share=opts.blocked_share,
+        always=get_raided_chat_ids(opts.chats),
+    )
+    if opts.input:
+        updates = list(load_updates(opts.input))
+    else:
+        updates = list(generate(opts.profile, opts.updates, opts.chats))
+    bot = FakeBot(latency=opts.api_latency)
+    result = replay(updates, store, bot, config_rows=rows)
+    if opts.json:
+        json.dump(result, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        print(render_report(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Local HTTP server which stands in for Telegram Bot API.
+
+    python -m bench.stub_api --port 8081 --latency 0.05
+
+Then set BOT_API['base_url'] (threaded robot) or
+ASYNC_ENGINE['base_url'] (asyncio engine) to 'http://127.0.0.1:8081/bot'.
+Connections are kept alive (HTTP/1.1). Updates put into the server
+with `add_update` are returned by getUpdates. Admins of chats are
+built the same way as by bench.fakes.FakeBot.
+"""
+from argparse import ArgumentParser
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from urllib.parse import parse_qsl
+import json
+import threading
+import time
+
+BOT_ID = 1
+
+
+class StubApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_params(self):
+        size = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(size) if size else b''
+        if not body:
+            return {}
+        if self.headers.get('Content-Type', '').startswith(
+                'application/json'
+            ):
+            return json.loads(body.decode('utf-8'))
+        return dict(parse_qsl(body.decode('utf-8')))
+
+    def send_json(self, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        method = self.path.rsplit('/', 1)[-1].split('?')[0]
+        params = self.read_params()
+        result = self.server.call(method, params)
+        if result is None:
+            self.send_json({
+                'ok': False, 'error_code': 404, 'description': 'Not Found',
+            })
+        else:
+            self.send_json({'ok': True, 'result': result})
+
+    do_GET = do_POST
+
+
+class StubApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, admin_count=2):
+        ThreadingHTTPServer.__init__(self, address, StubApiHandler)
+        self.latency = latency
+        self.admin_count = admin_count
+        self.calls = Counter()
+        self._message_ids = count(1)
+        self._updates = []
+        self._cond = threading.Condition()
+
+    def add_update(self, data):
+        with self._cond:
+            self._updates.append(data)
+            self._cond.notify_all()
+
+    def build_message(self, chat_id, text):
+        return {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id), 'type': 'supergroup'},
+            'from': {'id': BOT_ID, 'is_bot': True, 'first_name': 'Bot'},
+            'text': text,
+        }
+
+    def get_updates(self, params):
+        offset = int(params.get('offset') or 0)
+        timeout = float(params.get('timeout') or 0)
+        deadline = time.time() + timeout
+        with self._cond:
+            self._updates = [
+                x for x in self._updates if x['update_id'] >= offset
+            ]
+            while not self._updates and time.time() < deadline:
+                self._cond.wait(deadline - time.time())
+            return list(self._updates[:100])
+
+    def call(self, method, params):
+        self.calls[method] += 1
+        if method == 'getUpdates':
+            return self.get_updates(params)
+        if self.latency:
+            time.sleep(self.latency)
+        if method == 'getMe':
+            return {
+                'id': BOT_ID, 'is_bot': True, 'first_name': 'Watchdog',
+                'username': 'watchdog_stub_bot',
+            }
+        elif method == 'getChatAdministrators':
+            chat_id = int(params['chat_id'])
+            return [
+                {
+                    'status': 'administrator',
+                    'user': {
+                        'id': abs(chat_id) * 10 + idx, 'is_bot': False,
+                        'first_name': 'Admin',
+                    },
+                }
+                for idx in range(self.admin_count)
+            ]
+        elif method in ('deleteMessage', 'deleteMessages'):
+            return True
+        elif method in ('sendMessage', 'editMessageText'):
+            return self.build_message(params['chat_id'], params.get('text'))
+        return None
+
+
+def start_server(host='127.0.0.1', port=0, **kwargs):
+    """
+    Start server in background thread, return it. Port is available
+    as `server.server_address[1]`.
+    """
+    server = StubApiServer((host, port), **kwargs)
+    thread = threading.Thread(target=server.serve_forever, name='stub-api')
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0)
+    opts = parser.parse_args()
+    server = StubApiServer((opts.host, opts.port), latency=opts.latency)
+    print('Listening on http://%s:%d/bot<TOKEN>/' % server.server_address)
+    try:
+        server.serve_forever()
+    finally:
+        print('Calls: %s' % dict(server.calls))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Generators of synthetic Telegram updates.
+
+Each profile yields update dicts in the format of Bot API `getUpdates`.
+"""
+from itertools import count
+import random
+import time
+
+PROFILES = ('many_chats', 'raid', 'media')
+
+
+def build_chat_config(chat_ids, blocked_share=0.2, seed=0, always=()):
+    """
+    Return `config` rows which block some types in `blocked_share`
+    of chats and in all chats listed in `always`.
+    """
+    rnd = random.Random(seed)
+    rows = []
+    for chat_id in chat_ids:
+        if chat_id in always or rnd.random() < blocked_share:
+            for msg_type in ('link', 'sticker', 'photo'):
+                rows.append({
+                    'chat_id': chat_id,
+                    'key': 'is_allowed_%s' % msg_type,
+                    'value': False,
+                })
+    return rows
+
+
+class UpdateFactory(object):
+    def __init__(self):
+        self.update_ids = count(1)
+        self.message_ids = count(1)
+
+    def build(self, chat_id, user_id, **extra):
+        msg = {
+            'message_id': next(self.message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'supergroup', 'title': 'Chat'},
+            'from': {
+                'id': user_id, 'is_bot': False,
+                'first_name': 'User%d' % user_id,
+            },
+        }
+        msg.update(extra)
+        return {'update_id': next(self.update_ids), 'message': msg}
+
+    def text(self, chat_id, user_id, text='Hello world'):
+        return self.build(chat_id, user_id, text=text)
+
+    def link(self, chat_id, user_id):
+        text = 'Visit http://spam.example.com'
+        return self.build(chat_id, user_id, text=text, entities=[
+            {'type': 'url', 'offset': 6, 'length': len(text) - 6},
+        ])
+
+    # Media objects have all fields which are required by Bot API,
+    # newer python-telegram-bot fails to parse them otherwise
+
+    def sticker(self, chat_id, user_id):
+        return self.build(chat_id, user_id, sticker={
+            'file_id': 'sticker', 'file_unique_id': 'sticker-unique',
+            'type': 'regular', 'width': 512, 'height': 512,
+            'is_animated': False, 'is_video': False,
+        })
+
+    def photo(self, chat_id, user_id):
+        return self.build(chat_id, user_id, photo=[
+            {
+                'file_id': 'photo', 'file_unique_id': 'photo-unique',
+                'width': 90, 'height': 90,
+            },
+        ], caption='Photo')
+
+    def join(self, chat_id, user_id):
+        return self.build(chat_id, user_id, new_chat_members=[
+            {'id': user_id, 'is_bot': False, 'first_name': 'User'},
+        ])
+
+
+def get_chat_ids(chat_count):
+    return [-1000000 - idx for idx in range(chat_count)]
+
+
+def get_raided_chat_ids(chat_count):
+    return get_chat_ids(chat_count)[:3]
+
+
+def generate(profile, update_count, chat_count=1000, seed=0):
+    rnd = random.Random(seed)
+    factory = UpdateFactory()
+    chat_ids = get_chat_ids(chat_count)
+    if profile == 'many_chats':
+        for _ in range(update_count):
+            chat_id = rnd.choice(chat_ids)
+            user_id = rnd.randint(1000, 100000)
+            if rnd.random() < 0.05:
+                yield factory.link(chat_id, user_id)
+            else:
+                yield factory.text(chat_id, user_id)
+    elif profile == 'raid':
+        raided = get_raided_chat_ids(chat_count)
+        for _ in range(update_count):
+            if rnd.random() < 0.8:
+                chat_id = rnd.choice(raided)
+                user_id = rnd.randint(1000, 1100)
+                if rnd.random() < 0.2:
+                    yield factory.join(chat_id, user_id)
+                else:
+                    yield factory.link(chat_id, user_id)
+            else:
+                yield factory.text(
+                    rnd.choice(chat_ids), rnd.randint(1000, 100000)
+                )
+    elif profile == 'media':
+        builders = (factory.photo, factory.sticker, factory.text)
+        for _ in range(update_count):
+            builder = rnd.choice(builders)
+            yield builder(rnd.choice(chat_ids), rnd.randint(1000, 100000))
+    else:
+        raise ValueError('Unknown profile: %s' % profile)
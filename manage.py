@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+from argparse import ArgumentParser
+import sys
+from datetime import datetime, timedelta
+
+from project.database import connect_db
+
+
+def command_migrate(opts):
+    from project.indexes import ensure_indexes, remove_duplicate_settings
+
+    db = connect_db()
+    count = remove_duplicate_settings(db)
+    if count:
+        print('Deleted %d duplicate config rows' % count)
+    for spec in ensure_indexes(db):
+        print('Index %s.%s is up to date' % (spec.collection, spec.name))
+
+
+def command_check_indexes(opts):
+    from project.indexes import check_queries
+
+    failed = False
+    for description, collection, ok, index_names in check_queries(
+            connect_db()
+        ):
+        failed = failed or not ok
+        print('%s %s [%s]: %s' % (
+            'OK  ' if ok else 'SCAN', description, collection,
+            ', '.join(index_names) or 'no index',
+        ))
+    if failed:
+        sys.exit(1)
+
+
+def command_load_write_fallback(opts):
+    from project.write_buffer import load_fallback
+
+    count = load_fallback(connect_db(), opts.path)
+    print('Loaded %d operations' % count)
+
+
+def command_rebuild_stat(opts):
+    from project.stats import get_day_start
+    from project.storage import build_storage
+    from project.settings import STORAGE
+
+    storage = build_storage(STORAGE)
+    end = get_day_start(datetime.utcnow()) + timedelta(days=1)
+    start = end - timedelta(days=opts.days)
+    count = storage.rebuild_day_stat(start, end)
+    storage.close()
+    print('Rebuilt counters of %d days' % count)
+
+
+def command_copy_storage(opts):
+    from project.storage import build_storage, RECORD_KINDS
+
+    def build(backend):
+        if backend == 'sqlite':
+            return build_storage({
+                'backend': 'sqlite', 'options': {'path': opts.sqlite_path},
+            })
+        return build_storage({'backend': backend})
+
+    source = build(opts.source)
+    target = build(opts.target)
+    for kind in opts.kinds or RECORD_KINDS:
+        count = target.import_records(kind, source.export_records(kind))
+        print('Copied %d records of %s' % (count, kind))
+    target.close()
+    source.close()
+
+
+def command_simulate(opts):
+    from project.policy import MSG_TYPES, build_type_mask, load_all_policies
+    from project.simulator import (
+        PolicySimulator, iter_update_messages, iter_archive_messages,
+        iter_log_messages, render_report,
+    )
+    from project.storage import build_storage
+    from project.settings import STORAGE
+
+    candidates = []
+    for value in opts.block:
+        msg_types = value.split(',')
+        for msg_type in msg_types:
+            if msg_type not in MSG_TYPES:
+                sys.exit('Unknown message type: %s' % msg_type)
+        candidates.append((value, build_type_mask(msg_types)))
+    storage = None
+    if opts.log or opts.current:
+        storage = build_storage(STORAGE)
+    current_masks = None
+    if opts.current:
+        current_masks = dict(
+            (x.chat_id, x.blocked_mask) for x in load_all_policies(storage)
+        )
+    simulator = PolicySimulator(candidates, current_masks)
+    for path in opts.updates:
+        simulator.feed(iter_update_messages(path))
+    if opts.archive:
+        simulator.feed(iter_archive_messages(opts.archive))
+    if opts.log:
+        simulator.feed(iter_log_messages(storage))
+    print(render_report(simulator.report(top=opts.top)))
+
+
+def command_set_webhook(opts):
+    import asyncio
+
+    from project.aio import AsyncBotApi
+    from project.settings import ASYNC_ENGINE
+
+    async def set_webhook():
+        api = AsyncBotApi(ASYNC_ENGINE['token'], ASYNC_ENGINE['base_url'])
+        await api.start()
+        try:
+            await api.set_webhook(opts.url)
+        finally:
+            await api.close()
+
+    asyncio.get_event_loop().run_until_complete(set_webhook())
+    print('Webhook is set to %s' % opts.url)
+
+
+def command_compact_log(opts):
+    from pymongo import UpdateOne
+
+    from project.archive import ArchiveWriter
+    from project.log_schema import compact_legacy_record
+    from project.settings import LOG_ARCHIVE
+
+    if not LOG_ARCHIVE['path'] and not opts.force:
+        sys.exit(
+            'Message payloads would be deleted without archive copy.'
+            ' Set LOG_ARCHIVE path or use --force.'
+        )
+    db = connect_db()
+    archive = ArchiveWriter(**LOG_ARCHIVE) if LOG_ARCHIVE['path'] else None
+    for coll in (db.log, db.fail):
+        count = 0
+        ops = []
+        for doc in coll.find({'msg': {'$exists': True}}):
+            if archive:
+                archive.write(coll.name, doc)
+            ops.append(UpdateOne({'_id': doc['_id']}, {
+                '$set': compact_legacy_record(doc),
+                '$unset': {'msg': ''},
+            }))
+            if len(ops) >= opts.batch:
+                coll.bulk_write(ops, ordered=False)
+                count += len(ops)
+                ops = []
+        if ops:
+            coll.bulk_write(ops, ordered=False)
+            count += len(ops)
+        print('Compacted %d documents of %s collection' % (count, coll.name))
+    if archive:
+        archive.close()
+
+
+def main():
+    parser = ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    parser_migrate = subparsers.add_parser(
+        'migrate', help='create database indexes'
+    )
+    parser_migrate.set_defaults(func=command_migrate)
+
+    parser_check = subparsers.add_parser(
+        'check_indexes',
+        help='explain queries of the bot and report collection scans',
+    )
+    parser_check.set_defaults(func=command_check_indexes)
+
+    parser_fallback = subparsers.add_parser(
+        'load_write_fallback',
+        help='write operations saved by write buffer after failures',
+    )
+    parser_fallback.add_argument('path')
+    parser_fallback.set_defaults(func=command_load_write_fallback)
+
+    parser_stat = subparsers.add_parser(
+        'rebuild_stat', help='rebuild daily counters from moderation log'
+    )
+    parser_stat.add_argument('--days', type=int, default=30)
+    parser_stat.set_defaults(func=command_rebuild_stat)
+
+    parser_copy = subparsers.add_parser(
+        'copy_storage', help='copy data from one storage backend to another'
+    )
+    parser_copy.add_argument(
+        '--from', dest='source', choices=('mongo', 'sqlite'), required=True
+    )
+    parser_copy.add_argument(
+        '--to', dest='target', choices=('mongo', 'sqlite'), required=True
+    )
+    parser_copy.add_argument('--sqlite-path', default='var/watchdog.sqlite')
+    parser_copy.add_argument(
+        '--kind', dest='kinds', action='append',
+        help='copy only records of that kind, could be used many times',
+    )
+    parser_copy.set_defaults(func=command_copy_storage)
+
+    parser_simulate = subparsers.add_parser(
+        'simulate',
+        help='count messages from history which policies would delete',
+    )
+    parser_simulate.add_argument(
+        '--block', action='append', default=[], required=True,
+        help='comma-separated types of candidate policy,'
+             ' could be used many times',
+    )
+    parser_simulate.add_argument(
+        '--updates', action='append', default=[],
+        help='JSONL file of updates, could be gzipped',
+    )
+    parser_simulate.add_argument(
+        '--archive', help='log archive directory, see LOG_ARCHIVE setting'
+    )
+    parser_simulate.add_argument(
+        '--log', action='store_true',
+        help='read message payloads of moderation log',
+    )
+    parser_simulate.add_argument(
+        '--current', action='store_true',
+        help='count only messages not deleted by current chat settings',
+    )
+    parser_simulate.add_argument('--top', type=int, default=10)
+    parser_simulate.set_defaults(func=command_simulate)
+
+    parser_webhook = subparsers.add_parser(
+        'set_webhook',
+        help='set webhook URL of ASGI app with chat member updates enabled',
+    )
+    parser_webhook.add_argument('url')
+    parser_webhook.set_defaults(func=command_set_webhook)
+
+    parser_compact = subparsers.add_parser(
+        'compact_log',
+        help='convert log and fail documents to compact schema',
+    )
+    parser_compact.add_argument('--batch', type=int, default=1000)
+    parser_compact.add_argument(
+        '--force', action='store_true',
+        help='compact records even if LOG_ARCHIVE path is not set',
+    )
+    parser_compact.set_defaults(func=command_compact_log)
+
+    opts = parser.parse_args()
+    opts.func(opts)
+
+
+if __name__ == '__main__':
+    main()
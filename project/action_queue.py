@@ -0,0 +1,237 @@
+from collections import deque
+from traceback import format_exc
+import heapq
+import logging
+import threading
+import time
+
+from telegram.error import RetryAfter
+
+
+class TokenBucket(object):
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.update_time = time.time()
+
+    def consume(self, now):
+        """
+        Take one token. Return 0 on success or number of seconds
+        to wait until token is available.
+        """
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.update_time) * self.rate
+        )
+        self.update_time = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self, now):
+        return self.tokens + (now - self.update_time) * self.rate >= self.burst
+
+
+class Job(object):
+    __slots__ = ('func', 'args', 'kwargs', 'chat_limited', 'attempt')
+
+    def __init__(self, func, args, kwargs, chat_limited):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.chat_limited = chat_limited
+        self.attempt = 0
+
+
+class ActionQueue(object):
+    """
+    Executes Bot API actions in worker threads.
+
+    Every job takes a token from the global bucket, jobs put with
+    `chat_limited=True` also take a token from the chat's bucket. Chat
+    limited and unlimited jobs of one chat are kept in separate lanes,
+    so deletions do not wait behind a notification which waits for
+    chat tokens. Jobs of one lane are executed in order, one at a time,
+    different lanes are executed in parallel. Jobs failed with
+    RetryAfter are re-executed after delay requested by Telegram.
+    """
+    def __init__(
+            self, workers=8, global_rate=30, global_burst=30,
+            chat_rate=20 / 60.0, chat_burst=20, max_retries=5,
+            retry_backoff=1, drain_timeout=10,
+        ):
+        self.workers = workers
+        self.drain_timeout = drain_timeout
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self._chat_buckets = {}
+        self._prune_time = time.time()
+        # (chat_id, chat_limited) -> deque of jobs
+        self._jobs = {}
+        # Lanes which are queued, delayed or being processed
+        self._active = set()
+        self._ready = deque()
+        self._delayed = []
+        self._cond = threading.Condition()
+        self._threads = []
+        self._running = False
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            for idx in range(self.workers):
+                th = threading.Thread(
+                    target=self._work, name='action-queue-%d' % idx
+                )
+                th.daemon = True
+                th.start()
+                self._threads.append(th)
+
+    def drain(self, timeout=None):
+        """
+        Wait until all queued jobs are done, return number of jobs
+        which are left after `timeout` seconds.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._active and self._running:
+                if deadline is None:
+                    self._cond.wait()
+                else:
+                    left = deadline - time.time()
+                    if left <= 0:
+                        break
+                    self._cond.wait(left)
+            return sum(len(x) for x in self._jobs.values())
+
+    def stop(self, timeout=None, drain=True):
+        if drain and self._running:
+            left = self.drain(self.drain_timeout)
+            if left:
+                logging.error('Action queue stopped with %d jobs left' % left)
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        for th in self._threads:
+            th.join(timeout)
+        self._threads = []
+
+    def put(self, chat_id, func, args=(), kwargs=None, chat_limited=True):
+        if not self._running:
+            self.start()
+        job = Job(func, args, kwargs or {}, chat_limited)
+        lane = (chat_id, chat_limited)
+        with self._cond:
+            self._jobs.setdefault(lane, deque()).append(job)
+            if lane not in self._active:
+                self._active.add(lane)
+                self._ready.append(lane)
+                self._cond.notify()
+
+    def qsize(self):
+        return sum(len(x) for x in list(self._jobs.values()))
+
+    def _next_lane(self):
+        with self._cond:
+            while self._running:
+                now = time.time()
+                while self._delayed and self._delayed[0][0] <= now:
+                    self._ready.append(heapq.heappop(self._delayed)[1])
+                if self._ready:
+                    return self._ready.popleft()
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                self._cond.wait(timeout)
+            return None
+
+    def _schedule(self, lane, delay):
+        # Must be called with self._cond acquired
+        if not self._jobs.get(lane):
+            self._jobs.pop(lane, None)
+            self._active.discard(lane)
+            if lane[1]:
+                self._prune_buckets()
+            # Wake up drain()
+            self._cond.notify_all()
+        elif delay:
+            heapq.heappush(self._delayed, (time.time() + delay, lane))
+            self._cond.notify()
+        else:
+            self._ready.append(lane)
+            self._cond.notify()
+
+    def _prune_buckets(self):
+        # Must be called with self._cond acquired. Bucket of idle chat is
+        # kept until it is refilled, otherwise the chat would get a full
+        # burst every time its lane is drained. Buckets are checked once
+        # per time of full refill.
+        now = time.time()
+        if now - self._prune_time < self.chat_burst / self.chat_rate:
+            return
+        self._prune_time = now
+        for chat_id, bucket in list(self._chat_buckets.items()):
+            if (
+                    (chat_id, True) not in self._active
+                    and bucket.is_full(now)
+                ):
+                del self._chat_buckets[chat_id]
+
+    def _take_tokens(self, chat_id, job):
+        with self._cond:
+            now = time.time()
+            bucket = None
+            if job.chat_limited:
+                try:
+                    bucket = self._chat_buckets[chat_id]
+                except KeyError:
+                    bucket = self._chat_buckets[chat_id] = TokenBucket(
+                        self.chat_rate, self.chat_burst
+                    )
+                delay = bucket.consume(now)
+                if delay:
+                    return delay
+            delay = self.global_bucket.consume(now)
+            if delay and bucket is not None:
+                bucket.tokens += 1
+            return delay
+
+    def _work(self):
+        while True:
+            lane = self._next_lane()
+            if lane is None:
+                return
+            job = self._jobs[lane][0]
+            delay = self._take_tokens(lane[0], job)
+            if not delay:
+                delay = self._execute(job)
+                if not delay:
+                    with self._cond:
+                        self._jobs[lane].popleft()
+            with self._cond:
+                self._schedule(lane, delay)
+
+    def _execute(self, job):
+        """
+        Return number of seconds to wait before next attempt or 0
+        if job is done.
+        """
+        try:
+            job.func(*job.args, **job.kwargs)
+        except RetryAfter as ex:
+            job.attempt += 1
+            if job.attempt > self.max_retries:
+                logging.error('Action dropped after %d retries: %s' % (
+                    self.max_retries, ex
+                ))
+                return 0
+            return max(
+                ex.retry_after, self.retry_backoff * 2 ** (job.attempt - 1)
+            )
+        except Exception:
+            logging.error(format_exc())
+        return 0
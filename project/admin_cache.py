@@ -0,0 +1,136 @@
+from collections import OrderedDict
+import asyncio
+import threading
+import logging
+import time
+
+from project.metrics import METRICS
+
+
+class AdminCache(object):
+    """
+    LRU cache of chat administrator ids.
+
+    Only one refresh per chat is in flight at any time. Expired entries
+    are served stale while the refresh runs in background, so a caller
+    waits for the Bot API only when the chat is not cached at all.
+
+    `get` is used by threaded handlers, `get_async` by asyncio engine.
+    """
+    def __init__(self, size=10000, ttl=3600, wait_timeout=10):
+        self.size = size
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self._items = OrderedDict()
+        self._inflight = {}
+        self._async_inflight = {}
+        self._lock = threading.Lock()
+
+    def _lookup(self, chat_id):
+        # Must be called with self._lock acquired
+        item = self._items.get(chat_id)
+        if item is None:
+            METRICS.inc('cache_requests_total', cache='admin', result='miss')
+            return None, False
+        self._items.move_to_end(chat_id)
+        ids, update_time = item
+        stale = time.time() - update_time > self.ttl
+        METRICS.inc(
+            'cache_requests_total', cache='admin',
+            result='stale' if stale else 'hit',
+        )
+        return ids, stale
+
+    def _store(self, chat_id, ids):
+        with self._lock:
+            self._items[chat_id] = (ids, time.time())
+            self._items.move_to_end(chat_id)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def get(self, chat_id, loader):
+        with self._lock:
+            ids, stale = self._lookup(chat_id)
+            if ids is not None:
+                if stale and chat_id not in self._inflight:
+                    event = self._inflight[chat_id] = threading.Event()
+                    th = threading.Thread(
+                        target=self._refresh_background,
+                        args=[chat_id, loader, event],
+                    )
+                    th.daemon = True
+                    th.start()
+                return ids
+            event = self._inflight.get(chat_id)
+            owner = event is None
+            if owner:
+                event = self._inflight[chat_id] = threading.Event()
+        if owner:
+            return self._refresh(chat_id, loader, event)
+        event.wait(self.wait_timeout)
+        with self._lock:
+            item = self._items.get(chat_id)
+        if item is None:
+            # The refresh we were waiting for has failed
+            return loader(chat_id)
+        return item[0]
+
+    def _refresh(self, chat_id, loader, event):
+        try:
+            ids = loader(chat_id)
+            self._store(chat_id, ids)
+            return ids
+        finally:
+            with self._lock:
+                self._inflight.pop(chat_id, None)
+            event.set()
+
+    def _refresh_background(self, chat_id, loader, event):
+        try:
+            self._refresh(chat_id, loader, event)
+        except Exception as ex:
+            logging.error(
+                'Failed to refresh admin ids for chat [%d]: %s' % (chat_id, ex)
+            )
+
+    async def get_async(self, chat_id, loader):
+        with self._lock:
+            ids, stale = self._lookup(chat_id)
+        if ids is not None:
+            if stale and chat_id not in self._async_inflight:
+                self._async_inflight[chat_id] = asyncio.ensure_future(
+                    self._refresh_async(chat_id, loader)
+                )
+            return ids
+        try:
+            future = self._async_inflight[chat_id]
+        except KeyError:
+            future = self._async_inflight[chat_id] = asyncio.ensure_future(
+                self._refresh_async(chat_id, loader)
+            )
+        ids = await asyncio.shield(future)
+        if ids is None:
+            raise RuntimeError(
+                'Failed to load admin ids for chat [%d]' % chat_id
+            )
+        return ids
+
+    async def _refresh_async(self, chat_id, loader):
+        try:
+            ids = await loader(chat_id)
+            self._store(chat_id, ids)
+            return ids
+        except Exception as ex:
+            logging.error(
+                'Failed to refresh admin ids for chat [%d]: %s' % (chat_id, ex)
+            )
+            return None
+        finally:
+            self._async_inflight.pop(chat_id, None)
+
+    def invalidate(self, chat_id):
+        with self._lock:
+            self._items.pop(chat_id, None)
+
+    def __len__(self):
+        return len(self._items)
@@ -0,0 +1,349 @@
+"""
+Asyncio runtime of the robot.
+
+Group messages are moderated natively: Bot API calls go through one
+keep-alive aiohttp session, storage reads run in a small thread pool
+and writes go through the write buffer (or local SQLite file). Commands
+and private messages are rare, they are passed to the regular dispatcher
+in a separate thread pool, so all command handlers work without changes.
+"""
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from traceback import format_exc
+import asyncio
+import logging
+import time
+
+import aiohttp
+from telegram import Bot, Update
+from telegram.error import RetryAfter, TelegramError
+from telegram.ext import Dispatcher
+
+from project.action_queue import TokenBucket
+from project.classifier import CLASSIFIER, RATE_TYPES
+from project.metrics import track_api_call
+
+# Telegram sends chat_member updates only if they are requested
+# explicitly, they are used to drop cached admin ids
+ALLOWED_UPDATES = ('message', 'chat_member', 'my_chat_member')
+
+
+class AsyncBotApi(object):
+    def __init__(
+            self, token, base_url='https://api.telegram.org/bot',
+            pool_size=100, timeout=30, method_timeouts=None,
+        ):
+        self.token = token
+        self.base_url = base_url
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.method_timeouts = method_timeouts or {}
+        self.session = None
+
+    async def start(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=self.pool_size, keepalive_timeout=60,
+            ),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    async def call(self, method, request_timeout=None, **params):
+        url = '%s%s/%s' % (self.base_url, self.token, method)
+        kwargs = {}
+        if request_timeout is None:
+            request_timeout = self.method_timeouts.get(method)
+        if request_timeout:
+            kwargs['timeout'] = aiohttp.ClientTimeout(total=request_timeout)
+        with track_api_call(method):
+            async with self.session.post(url, json=params, **kwargs) as resp:
+                data = await resp.json()
+        if not data.get('ok'):
+            retry_after = data.get('parameters', {}).get('retry_after')
+            if retry_after:
+                raise RetryAfter(retry_after)
+            raise TelegramError(data.get('description', 'Unknown error'))
+        return data['result']
+
+    async def get_me(self):
+        return await self.call('getMe')
+
+    async def get_updates(self, offset=None, timeout=25):
+        return await self.call(
+            'getUpdates', request_timeout=timeout + self.timeout,
+            offset=offset, timeout=timeout,
+            allowed_updates=list(ALLOWED_UPDATES),
+        )
+
+    async def set_webhook(self, url):
+        return await self.call(
+            'setWebhook', url=url, allowed_updates=list(ALLOWED_UPDATES),
+        )
+
+    async def get_chat_administrators(self, chat_id):
+        return await self.call('getChatAdministrators', chat_id=chat_id)
+
+    async def delete_message(self, chat_id, message_id):
+        return await self.call(
+            'deleteMessage', chat_id=chat_id, message_id=message_id
+        )
+
+    async def send_message(self, chat_id, text):
+        return await self.call('sendMessage', chat_id=chat_id, text=text)
+
+
+class AsyncStorage(object):
+    """
+    Runs blocking storage calls in a thread pool.
+    """
+    def __init__(self, storage, workers=4):
+        self.storage = storage
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self.executor, partial(func, *args, **kwargs)
+        )
+
+
+class ChatLocks(object):
+    """
+    Per-chat asyncio locks which are dropped when nobody uses them.
+    asyncio.Lock wakes up waiters in FIFO order, so updates of one chat
+    are processed in order they were received.
+    """
+    def __init__(self):
+        self._locks = {}
+
+    def acquire(self, chat_id):
+        try:
+            lock, users = self._locks[chat_id]
+        except KeyError:
+            lock, users = asyncio.Lock(), 0
+        self._locks[chat_id] = (lock, users + 1)
+        return lock
+
+    def release(self, chat_id):
+        lock, users = self._locks[chat_id]
+        if users == 1:
+            del self._locks[chat_id]
+        else:
+            self._locks[chat_id] = (lock, users - 1)
+
+
+class AsyncEngine(object):
+    def __init__(
+            self, robot, storage, admin_cache, token,
+            base_url='https://api.telegram.org/bot', pool_size=100,
+            timeout=30, db_workers=4, handler_workers=4,
+            max_concurrency=10000, global_rate=30, global_burst=30,
+            chat_rate=20 / 60.0, chat_burst=20, max_retries=5,
+            max_chat_buckets=10000, method_timeouts=None,
+        ):
+        self.robot = robot
+        self.storage = AsyncStorage(storage, workers=db_workers)
+        self.admin_cache = admin_cache
+        self.api = AsyncBotApi(
+            token, base_url=base_url, pool_size=pool_size, timeout=timeout,
+            method_timeouts=method_timeouts,
+        )
+        self.sync_bot = Bot(token, base_url=base_url)
+        self.handler_executor = ThreadPoolExecutor(max_workers=handler_workers)
+        self.max_concurrency = max_concurrency
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_chat_buckets = max_chat_buckets
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.chat_buckets = OrderedDict()
+        self.chat_locks = ChatLocks()
+        self.dispatcher = None
+        self._semaphore = None
+        # Strong references to running tasks, event loop keeps weak ones
+        self._tasks = set()
+
+    async def start(self):
+        await self.api.start()
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        me = await self.api.get_me()
+        self.robot.bot_id = me['id']
+        await self.storage.run(self.robot.warm_up_caches)
+        self.dispatcher = Dispatcher(self.sync_bot, None, workers=0)
+        self.robot.register_handlers(self.dispatcher)
+        self.robot.start_background_workers()
+
+    async def stop(self, timeout=10):
+        if self._tasks:
+            await asyncio.wait(list(self._tasks), timeout=timeout)
+        await self.api.close()
+        self.handler_executor.shutdown()
+        self.storage.executor.shutdown()
+
+    def take_tokens(self, chat_id, chat_limited):
+        now = time.time()
+        bucket = None
+        if chat_limited:
+            try:
+                bucket = self.chat_buckets[chat_id]
+                self.chat_buckets.move_to_end(chat_id)
+            except KeyError:
+                bucket = self.chat_buckets[chat_id] = TokenBucket(
+                    self.chat_rate, self.chat_burst
+                )
+                if len(self.chat_buckets) > self.max_chat_buckets:
+                    self.chat_buckets.popitem(last=False)
+            delay = bucket.consume(now)
+            if delay:
+                return delay
+        delay = self.global_bucket.consume(now)
+        if delay and bucket is not None:
+            bucket.tokens += 1
+        return delay
+
+    async def call_api(self, chat_id, chat_limited, func, *args):
+        attempt = 0
+        while True:
+            delay = self.take_tokens(chat_id, chat_limited)
+            if delay:
+                await asyncio.sleep(delay)
+                continue
+            try:
+                return await func(*args)
+            except RetryAfter as ex:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                await asyncio.sleep(max(ex.retry_after, 2 ** (attempt - 1)))
+
+    async def load_chat_policy(self, chat_id):
+        # Same cache as the threaded handler reads, it is a shard cache
+        # when SHARDS is set
+        if chat_id in self.robot.get_policy_cache(chat_id):
+            return self.robot.load_chat_policy(chat_id)
+        return await self.storage.run(self.robot.load_chat_policy, chat_id)
+
+    async def fetch_chat_admin_ids(self, chat_id):
+        admins = await self.api.get_chat_administrators(chat_id)
+        return set(x['user']['id'] for x in admins)
+
+    async def moderate_message(self, msg, msg_type):
+        chat_id = msg.chat.id
+        claimed = await self.storage.run(
+            self.robot.claim_moderation, chat_id, msg.message_id
+        )
+        if not claimed:
+            return
+        try:
+            await self.call_api(
+                chat_id, False, self.api.delete_message,
+                chat_id, msg.message_id,
+            )
+        except Exception as ex:
+            await self.storage.run(self.robot.log_moderation_failure, msg, ex)
+            logging.error(format_exc())
+            return
+        await self.storage.run(self.robot.log_moderation, msg, msg_type)
+        policy = await self.load_chat_policy(chat_id)
+        if policy.get_setting('notify_actions'):
+            # Summaries are sent by the action queue with sync bot
+            self.robot.queue_notification(self.sync_bot, msg, msg_type)
+
+    async def handle_group_message(self, msg):
+        chat_id = msg.chat.id
+        lock = self.chat_locks.acquire(chat_id)
+        try:
+            async with lock:
+                policy = await self.load_chat_policy(chat_id)
+                msg_type = CLASSIFIER.classify(
+                    msg, policy.blocked_mask, policy.get_matcher()
+                )
+                self.robot.remember_recent_message(msg, msg_type)
+                if msg_type is None:
+                    return
+                admin_ids = await self.admin_cache.get_async(
+                    chat_id, self.fetch_chat_admin_ids
+                )
+                if msg.from_user.id in admin_ids:
+                    return
+                await self.moderate_message(msg, msg_type)
+                if msg_type in RATE_TYPES:
+                    # Claims of messages could go to database
+                    await self.storage.run(
+                        self.robot.purge_rate_limited, self.sync_bot, msg,
+                        msg_type,
+                    )
+        finally:
+            self.chat_locks.release(chat_id)
+
+    def is_group_message(self, msg):
+        return (
+            msg is not None
+            and msg.chat.type in ('group', 'supergroup')
+            and not (msg.text or '').startswith('/')
+        )
+
+    async def process_update(self, data):
+        for key in ('chat_member', 'my_chat_member'):
+            if key in data:
+                await self.storage.run(
+                    self.robot.invalidate_chat_admins,
+                    data[key]['chat']['id'],
+                )
+                return
+        update = Update.de_json(data, self.sync_bot)
+        # Edited messages are not moderated, as in the threaded runtime
+        msg = update.message
+        if self.is_group_message(msg):
+            # Dispatcher checks duplicates itself in the other branch
+            is_new = await self.storage.run(
+                self.robot.is_new_update, update.update_id
+            )
+            if is_new:
+                await self.handle_group_message(msg)
+        else:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(
+                self.handler_executor, self.dispatcher.process_update, update
+            )
+
+    async def process_update_safe(self, data):
+        async with self._semaphore:
+            try:
+                await self.process_update(data)
+            except Exception:
+                logging.error(format_exc())
+
+    def spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self.on_task_done)
+        return task
+
+    def on_task_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error('Task failed', exc_info=task.exception())
+
+    async def run_polling(self):
+        await self.start()
+        offset = None
+        try:
+            while True:
+                try:
+                    updates = await self.api.get_updates(offset)
+                except Exception:
+                    logging.error(format_exc())
+                    await asyncio.sleep(1)
+                    continue
+                for data in updates:
+                    offset = data['update_id'] + 1
+                    self.spawn(self.process_update_safe(data))
+        finally:
+            await self.stop()
@@ -0,0 +1,83 @@
+from datetime import datetime
+import gzip
+import json
+import logging
+import os
+import threading
+import zlib
+
+
+class ArchiveWriter(object):
+    """
+    Appends records to gzipped JSONL segments in `path` directory.
+
+    New segment is started every day and when current segment
+    grows over `segment_size` bytes of uncompressed data.
+    """
+    def __init__(self, path, segment_size=64 * 1024 * 1024):
+        self.path = path
+        self.segment_size = segment_size
+        self._file = None
+        self._day = None
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def _open_segment(self, now):
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        self._day = now.strftime('%Y%m%d')
+        filename = os.path.join(self.path, '%s-%s.jsonl.gz' % (
+            self._day, now.strftime('%H%M%S%f'),
+        ))
+        self._file = gzip.open(filename, 'ab')
+        self._size = 0
+
+    def write(self, kind, record):
+        now = datetime.utcnow()
+        data = json.dumps(
+            {'kind': kind, 'record': record}, default=str
+        ).encode('utf-8') + b'\n'
+        with self._lock:
+            if (
+                    self._file is None
+                    or self._size >= self.segment_size
+                    or self._day != now.strftime('%Y%m%d')
+                ):
+                self._close()
+                self._open_segment(now)
+            self._file.write(data)
+            self._size += len(data)
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+def iter_archive(path):
+    """
+    Yield records of all segments. Segment which is being written or was
+    cut short by a crash ends with incomplete gzip stream, records read
+    before its end are yielded and the rest is skipped.
+    """
+    for filename in sorted(os.listdir(path)):
+        if filename.endswith('.jsonl.gz'):
+            for record in iter_segment(os.path.join(path, filename)):
+                yield record
+
+
+def iter_segment(filename):
+    with gzip.open(filename, 'rb') as inp:
+        try:
+            for line in inp:
+                if not line.endswith(b'\n'):
+                    break
+                yield json.loads(line.decode('utf-8'))
+        except (EOFError, OSError, zlib.error) as ex:
+            logging.error('Incomplete archive segment %s: %s' % (
+                filename, ex
+            ))
@@ -0,0 +1,117 @@
+"""
+Export of chat moderation log as CSV or JSONL.
+
+Records are read page by page from the storage and rendered one line
+at a time, so memory use does not depend on the size of the export.
+Each line has the cursor of its record, pass the cursor of the last
+line as `after` to continue an interrupted export.
+"""
+from datetime import datetime
+from io import StringIO
+import csv
+import hashlib
+import hmac
+import json
+import time
+
+AUDIT_FIELDS = (
+    'date', 'type', 'reason', 'user_id', 'message_id', 'text', 'cursor',
+)
+AUDIT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+DATE_FORMATS = ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%d')
+
+
+def iter_chat_audit(
+        storage, chat_id, since=None, until=None, reason=None, after=None,
+        limit=None, page_size=1000,
+    ):
+    """
+    Yield log records of the chat requesting them from storage in pages
+    of `page_size` records.
+    """
+    count = 0
+    while True:
+        size = page_size
+        if limit:
+            size = min(size, limit - count)
+            if size <= 0:
+                return
+        records = storage.iter_chat_log(
+            chat_id, since=since, until=until, reason=reason, after=after,
+            limit=size,
+        )
+        page_count = 0
+        for record in records:
+            page_count += 1
+            after = record['cursor']
+            yield record
+        count += page_count
+        if page_count < size:
+            return
+
+
+def iter_csv(records):
+    yield ','.join(AUDIT_FIELDS) + '\r\n'
+    buf = StringIO()
+    writer = csv.writer(buf)
+    for record in records:
+        writer.writerow([
+            record['date'].isoformat() if key == 'date' else record.get(key)
+            for key in AUDIT_FIELDS
+        ])
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+
+
+def iter_jsonl(records):
+    for record in records:
+        item = dict((key, record.get(key)) for key in AUDIT_FIELDS)
+        item['date'] = record['date'].isoformat()
+        yield json.dumps(item, ensure_ascii=False) + '\n'
+
+
+def render_audit(records, fmt):
+    if fmt == 'csv':
+        return iter_csv(records)
+    elif fmt == 'jsonl':
+        return iter_jsonl(records)
+    raise ValueError('Unknown audit format: %s' % fmt)
+
+
+def parse_audit_date(value):
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    raise ValueError('Invalid date: %s' % value)
+
+
+def build_audit_token(secret, chat_id, expires):
+    """
+    Return token which gives access to log of the chat until `expires`
+    unix time.
+    """
+    payload = '%d:%d' % (chat_id, expires)
+    signature = hmac.new(
+        secret.encode('utf-8'), payload.encode('utf-8'), hashlib.sha256
+    ).hexdigest()
+    return '%d.%s' % (expires, signature)
+
+
+def check_audit_token(secret, chat_id, token, now=None):
+    if not secret or not token:
+        return False
+    try:
+        expires = int(token.split('.', 1)[0])
+    except ValueError:
+        return False
+    if expires < (time.time() if now is None else now):
+        return False
+    return hmac.compare_digest(
+        build_audit_token(secret, chat_id, expires), token
+    )
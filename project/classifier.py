@@ -0,0 +1,144 @@
+"""
+Message classifier built from a table of predicates.
+
+Rules are listed in priority order: when message matches multiple
+blocked types the first one is reported as the reason.
+"""
+from itertools import chain
+
+from project.policy import MSG_TYPE_BITS
+from project.flood import RateTracker
+from project.settings import FLOOD, JOIN_RAID
+
+FLOOD_TRACKER = RateTracker(FLOOD['messages'], FLOOD['window'], FLOOD['size'])
+JOIN_RAID_TRACKER = RateTracker(
+    JOIN_RAID['joins'], JOIN_RAID['window'], JOIN_RAID['size']
+)
+
+
+def has_entity(*entity_types):
+    def predicate(msg):
+        for ent in chain(msg.entities, msg.caption_entities):
+            if ent.type in entity_types:
+                return True
+        return False
+    return predicate
+
+
+def is_gif(msg):
+    return bool(msg.document and msg.document.mime_type == 'video/mp4')
+
+
+def is_attachment(msg):
+    return bool(msg.document and msg.document.mime_type != 'video/mp4')
+
+
+def has_bot_joined(msg):
+    return any(x.is_bot for x in msg.new_chat_members)
+
+
+def is_flood(msg):
+    return FLOOD_TRACKER.hit((msg.chat.id, msg.from_user.id))
+
+
+def is_join_raid(msg):
+    if not msg.new_chat_members:
+        return False
+    return JOIN_RAID_TRACKER.hit(msg.chat.id, len(msg.new_chat_members))
+
+
+# Rate rules go first: they have to count every message of the chats
+# which block them, not only messages not matched by other rules
+RATE_TYPES = ('flood', 'join_raid')
+RATE_MASK = sum(MSG_TYPE_BITS[x] for x in RATE_TYPES)
+MSG_TYPE_RULES = (
+    ('flood', is_flood),
+    ('join_raid', is_join_raid),
+    ('link', has_entity('url', 'text_link')),
+    ('bot', has_bot_joined),
+    ('sticker', lambda msg: bool(msg.sticker)),
+    ('gif', is_gif),
+    ('voice', lambda msg: bool(msg.voice)),
+    ('attachment', is_attachment),
+    ('audio', lambda msg: bool(msg.audio)),
+    ('photo', lambda msg: bool(msg.photo)),
+    ('user_joined_msg', lambda msg: bool(msg.new_chat_members)),
+    ('user_left_msg', lambda msg: bool(msg.left_chat_member)),
+    ('mention', has_entity('mention')),
+    ('video_message', lambda msg: bool(msg.video_note)),
+    ('email', has_entity('email')),
+)
+
+
+class MessageClassifier(object):
+    def __init__(self, rules):
+        self.rules = tuple(
+            (msg_type, MSG_TYPE_BITS.get(msg_type, 0), predicate)
+            for msg_type, predicate in rules
+        )
+        self.content_rules = tuple(
+            x for x in self.rules if x[0] not in RATE_TYPES and x[1]
+        )
+        self._mask_rules = {}
+
+    def get_mask_rules(self, blocked_mask):
+        try:
+            return self._mask_rules[blocked_mask]
+        except KeyError:
+            rules = tuple(
+                (msg_type, predicate)
+                for msg_type, bit, predicate in self.rules
+                if bit & blocked_mask
+            )
+            self._mask_rules[blocked_mask] = rules
+            return rules
+
+    def classify(self, msg, blocked_mask, matcher=None):
+        """
+        Return first blocked type the message matches or None.
+
+        Only predicates of blocked types are evaluated. With chat's
+        matcher, messages with denied domains or blocked keywords are
+        reported as "domain" and "keyword", and links to allowed domains
+        are not reported as "link". Blocked rate types are checked before
+        the matcher, so every message is counted.
+        """
+        if blocked_mask & RATE_MASK:
+            for msg_type, predicate in self.get_mask_rules(
+                    blocked_mask & RATE_MASK
+                ):
+                if predicate(msg):
+                    return msg_type
+            blocked_mask &= ~RATE_MASK
+        if matcher is not None:
+            reason, links_allowed = matcher.scan(msg)
+            if reason:
+                return reason
+            if links_allowed:
+                blocked_mask &= ~MSG_TYPE_BITS['link']
+        if not blocked_mask:
+            return None
+        for msg_type, predicate in self.get_mask_rules(blocked_mask):
+            if predicate(msg):
+                return msg_type
+        return None
+
+    def find_types(self, msg):
+        return set(
+            msg_type for msg_type, bit, predicate in self.rules
+            if msg_type not in RATE_TYPES and predicate(msg)
+        )
+
+    def find_mask(self, msg):
+        """
+        Return mask of all content types of the message. Rate rules are
+        not evaluated, they count messages on each call.
+        """
+        mask = 0
+        for msg_type, bit, predicate in self.content_rules:
+            if predicate(msg):
+                mask |= bit
+        return mask
+
+
+CLASSIFIER = MessageClassifier(MSG_TYPE_RULES)
@@ -1,9 +1,60 @@
-from pymongo import MongoClient
+import threading
+
+from pymongo import MongoClient, monitoring
 
 from project.settings import MONGODB
+from project.metrics import METRICS
+
+DB = None
+DB_LOCK = threading.Lock()
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """
+    Records latency of every MongoDB command by collection.
+    """
+    def __init__(self):
+        self._collections = {}
+
+    def started(self, event):
+        coll = event.command.get(event.command_name)
+        if not isinstance(coll, str):
+            coll = '-'
+        self._collections[event.request_id] = coll
+
+    def _finish(self, event):
+        coll = self._collections.pop(event.request_id, '-')
+        METRICS.observe(
+            'mongo_op_seconds', event.duration_micros / 1000000.0,
+            collection=coll, command=event.command_name,
+        )
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
 
 
 def connect_db():
-    db = MongoClient(**MONGODB['connection'])[MONGODB['dbname']]
-    db.log.create_index([('date', 1), ('type', 1)])
-    return db
+    """
+    Create new client. It does not connect to server until first query,
+    so it is safe to call before fork. Indexes are created by
+    `manage.py migrate`, see project.indexes.
+    """
+    options = dict(MONGODB['connection'])
+    options.setdefault('connect', False)
+    client = MongoClient(event_listeners=[MongoCommandListener()], **options)
+    return client[MONGODB['dbname']]
+
+
+def get_db():
+    """
+    Return database object shared by the whole process.
+    """
+    global DB
+    if DB is None:
+        with DB_LOCK:
+            if DB is None:
+                DB = connect_db()
+    return DB
@@ -0,0 +1,82 @@
+"""
+De-duplication of updates redelivered by Telegram and of moderation
+actions repeated after restart.
+"""
+from collections import OrderedDict
+from datetime import datetime
+import threading
+import time
+
+from pymongo.errors import DuplicateKeyError
+
+
+class TimedKeySet(object):
+    """
+    Remembers keys for `ttl` seconds, at most `size` keys.
+    """
+    def __init__(self, size=100000, ttl=3600):
+        self.size = size
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, key):
+        """
+        Return True if key has not been seen during last `ttl` seconds.
+        """
+        now = time.time()
+        with self._lock:
+            while self._items:
+                oldest_key, oldest_time = next(iter(self._items.items()))
+                if now - oldest_time > self.ttl:
+                    del self._items[oldest_key]
+                else:
+                    break
+            if key in self._items:
+                return False
+            while len(self._items) >= self.size:
+                self._items.popitem(last=False)
+            self._items[key] = now
+            return True
+
+    def __len__(self):
+        return len(self._items)
+
+
+class SharedKeySet(object):
+    """
+    Keys stored in MongoDB collection with unique _id and TTL index
+    (created by `manage.py migrate`), so they are visible to all processes.
+    """
+    def __init__(self, db, collection='dedup', ttl=3600):
+        self.db = db
+        self.collection = collection
+        self.ttl = ttl
+
+    def add(self, key):
+        coll = self.db[self.collection]
+        try:
+            coll.insert_one({'_id': key, 'date': datetime.utcnow()})
+        except DuplicateKeyError:
+            return False
+        return True
+
+
+class Deduplicator(object):
+    def __init__(self, db=None, size=100000, ttl=3600, shared=False):
+        self.local = TimedKeySet(size=size, ttl=ttl)
+        self.shared = SharedKeySet(db, ttl=ttl) if shared else None
+
+    def add(self, key):
+        # Local set answers for most duplicates without database query
+        if not self.local.add(key):
+            return False
+        if self.shared is not None:
+            return self.shared.add(key)
+        return True
+
+    def is_new_update(self, update_id):
+        return self.add('u:%d' % update_id)
+
+    def claim_action(self, action, chat_id, message_id):
+        return self.add('%s:%d:%d' % (action, chat_id, message_id))
@@ -0,0 +1,48 @@
+"""
+Sliding-window rate tracking for flood and join raid detection.
+"""
+from collections import OrderedDict, deque
+import threading
+import time
+
+
+class RateTracker(object):
+    """
+    Tells if a key got `limit` or more events during last `window`
+    seconds.
+
+    Each key keeps a ring buffer of its last `limit` event times, so
+    a hit is O(1): the limit is reached when the oldest remembered
+    event is still inside the window. At most `size` recently active
+    keys are remembered.
+    """
+    def __init__(self, limit, window, size=100000):
+        self.limit = limit
+        self.window = window
+        self.size = size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key, count=1, now=None):
+        """
+        Register `count` events of the key and return True if the key
+        has reached the limit.
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            try:
+                times = self._items[key]
+                self._items.move_to_end(key)
+            except KeyError:
+                times = self._items[key] = deque(maxlen=self.limit)
+                if len(self._items) > self.size:
+                    self._items.popitem(last=False)
+            for _ in range(min(count, self.limit)):
+                times.append(now)
+            return (
+                len(times) == self.limit and now - times[0] <= self.window
+            )
+
+    def __len__(self):
+        return len(self._items)
@@ -0,0 +1,184 @@
+"""
+Declarations of all database indexes.
+
+`ensure_indexes` creates them, `check_queries` runs `explain` for the
+queries the bot issues and reports the ones which scan collection.
+"""
+from datetime import datetime
+
+from pymongo.errors import OperationFailure
+
+from project.settings import LOG_TTL_DAYS, DEDUP
+
+# MongoDB error codes of index which exists with other options
+INDEX_CONFLICT_CODES = (85, 86)
+DUPLICATE_KEY_CODE = 11000
+# Indexes replaced by other ones: (collection, name)
+STALE_INDEXES = (
+    ('log', 'chat_id_1_date_1'),
+)
+
+
+class IndexSpec(object):
+    def __init__(self, collection, keys, **options):
+        self.collection = collection
+        self.keys = keys
+        self.options = options
+
+    @property
+    def name(self):
+        return '_'.join('%s_%s' % (key, order) for key, order in self.keys)
+
+
+def get_index_specs():
+    specs = [
+        IndexSpec('config', [('chat_id', 1), ('key', 1)], unique=True),
+        IndexSpec('config', [('date', 1)]),
+        IndexSpec('log', [('date', 1), ('type', 1)]),
+        # _id makes order of chat log unique for cursor pagination
+        IndexSpec('log', [('chat_id', 1), ('date', 1), ('_id', 1)]),
+        IndexSpec('log', [('reason', 1), ('date', 1)]),
+        IndexSpec('stat_day', [('date', 1)]),
+    ]
+    # user and chat documents are looked up by _id only
+    if LOG_TTL_DAYS:
+        for collection in ('log', 'fail'):
+            specs.append(IndexSpec(
+                collection, [('date', 1)],
+                expireAfterSeconds=int(LOG_TTL_DAYS * 86400),
+            ))
+    if DEDUP['shared']:
+        specs.append(IndexSpec(
+            'dedup', [('date', 1)], expireAfterSeconds=DEDUP['ttl'],
+        ))
+    return specs
+
+
+def get_query_plans():
+    """
+    Return (description, collection, filter, sort) of queries which
+    must be served by an index.
+    """
+    now = datetime.utcnow()
+    return [
+        ('load chat policy', 'config', {'chat_id': 0}, None),
+        ('save chat setting', 'config', {'chat_id': 0, 'key': 'x'}, None),
+        ('config changed since', 'config', {'date': {'$gt': now}}, None),
+        ('remember user', 'user', {'_id': 0}, None),
+        ('remember chat', 'chat', {'_id': 0}, None),
+        ('stat rebuild', 'log', {
+            'type': 'delete', 'date': {'$gte': now, '$lt': now},
+        }, None),
+        ('chat log', 'log', {
+            'chat_id': 0, 'date': {'$gte': now},
+        }, [('date', 1), ('_id', 1)]),
+        ('reason log', 'log', {
+            'reason': 'link', 'date': {'$gte': now},
+        }, None),
+        ('daily counters', 'stat_day', {'date': {'$gte': now}}, None),
+    ]
+
+
+def remove_duplicate_settings(db):
+    """
+    Delete all but the most recent config row of each (chat_id, key),
+    return number of deleted rows. Legacy databases could have such
+    duplicates which prevent creating the unique index.
+    """
+    count = 0
+    groups = db.config.aggregate([
+        {'$group': {
+            '_id': {'chat_id': '$chat_id', 'key': '$key'},
+            'count': {'$sum': 1},
+        }},
+        {'$match': {'count': {'$gt': 1}}},
+    ], allowDiskUse=True)
+    for group in groups:
+        rows = db.config.find(group['_id'], {'_id': 1}).sort(
+            [('date', -1), ('_id', -1)]
+        )
+        ids = [x['_id'] for x in rows][1:]
+        count += db.config.delete_many({'_id': {'$in': ids}}).deleted_count
+    return count
+
+
+def ensure_index(db, spec):
+    coll = db[spec.collection]
+    try:
+        coll.create_index(spec.keys, name=spec.name, **spec.options)
+    except OperationFailure as ex:
+        if ex.code == DUPLICATE_KEY_CODE:
+            raise RuntimeError(
+                'Could not create unique index %s.%s, remove documents'
+                ' with duplicate keys and run migrate again: %s'
+                % (spec.collection, spec.name, ex)
+            )
+        if ex.code not in INDEX_CONFLICT_CODES:
+            raise
+        # Index exists with other options e.g. other TTL
+        coll.drop_index(spec.name)
+        coll.create_index(spec.keys, name=spec.name, **spec.options)
+
+
+def drop_stale_indexes(db):
+    for collection, name in STALE_INDEXES:
+        if name in db[collection].index_information():
+            db[collection].drop_index(name)
+
+
+def drop_stale_ttl_indexes(db):
+    if not LOG_TTL_DAYS:
+        for collection in ('log', 'fail'):
+            info = db[collection].index_information().get('date_1')
+            if info and 'expireAfterSeconds' in info:
+                db[collection].drop_index('date_1')
+
+
+def ensure_indexes(db):
+    specs = get_index_specs()
+    for spec in specs:
+        ensure_index(db, spec)
+    drop_stale_ttl_indexes(db)
+    drop_stale_indexes(db)
+    return specs
+
+
+def find_scan_stages(plan):
+    stages = []
+    if plan.get('stage') == 'COLLSCAN':
+        stages.append(plan)
+    for key in ('inputStage', 'queryPlan'):
+        if key in plan:
+            stages.extend(find_scan_stages(plan[key]))
+    for child in plan.get('inputStages', []):
+        stages.extend(find_scan_stages(child))
+    return stages
+
+
+def find_index_names(plan):
+    names = []
+    if 'indexName' in plan:
+        names.append(plan['indexName'])
+    for key in ('inputStage', 'queryPlan'):
+        if key in plan:
+            names.extend(find_index_names(plan[key]))
+    for child in plan.get('inputStages', []):
+        names.extend(find_index_names(child))
+    return names
+
+
+def check_queries(db):
+    """
+    Return list of (description, collection, ok, index_names).
+    """
+    ret = []
+    for description, collection, query, sort in get_query_plans():
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = cursor.explain()['queryPlanner']['winningPlan']
+        ret.append((
+            description, collection, not find_scan_stages(plan),
+            find_index_names(plan),
+        ))
+    return ret
@@ -0,0 +1,261 @@
+"""
+Channels to tell other processes that cached data has changed.
+
+Message is a pair of `kind` and `key`, e.g. ('policy', chat_id) or
+('admin', chat_id). Process which publishes the message is not
+notified about it.
+"""
+from collections import OrderedDict
+from datetime import datetime
+from traceback import format_exc
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+
+
+class InvalidationChannel(object):
+    def __init__(self):
+        self.source = uuid.uuid4().hex
+        self._callback = None
+        self._thread = None
+        self._running = False
+
+    def publish(self, kind, key):
+        raise NotImplementedError
+
+    def listen(self):
+        raise NotImplementedError
+
+    def start(self, callback):
+        if self._running:
+            return
+        self._callback = callback
+        self._running = True
+        self._thread = threading.Thread(
+            target=self._work, name='invalidation'
+        )
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+
+    def notify(self, kind, key):
+        try:
+            self._callback(kind, key)
+        except Exception:
+            logging.error(format_exc())
+
+    def _work(self):
+        while self._running:
+            try:
+                self.listen()
+            except Exception:
+                logging.error(format_exc())
+                time.sleep(1)
+
+
+class NullChannel(InvalidationChannel):
+    """
+    Channel for deployments with single process.
+    """
+    def publish(self, kind, key):
+        pass
+
+    def start(self, callback):
+        pass
+
+
+class CappedCollectionChannel(InvalidationChannel):
+    """
+    Messages are inserted into capped collection which is tailed
+    by every process.
+
+    ObjectIds made by different hosts in one second are not ordered,
+    so position in the collection is not restored with `_id` query.
+    Tailable cursor follows natural order, when it dies the collection
+    is read again from the start and messages seen already are skipped.
+    """
+    def __init__(
+            self, db, collection='invalidation', size=1024 * 1024,
+            max_seen=100000,
+        ):
+        super(CappedCollectionChannel, self).__init__()
+        self.db = db
+        self.collection = collection
+        self.size = size
+        self.max_seen = max_seen
+        self._created = False
+        self._seen = None
+
+    def ensure_collection(self):
+        if self._created:
+            return
+        try:
+            self.db.create_collection(
+                self.collection, capped=True, size=self.size
+            )
+        except CollectionInvalid:
+            pass
+        else:
+            # Tailable cursor dies immediately on empty collection
+            self.db[self.collection].insert_one({
+                'kind': None, 'key': None, 'source': None,
+                'date': datetime.utcnow(),
+            })
+        self._created = True
+
+    def publish(self, kind, key):
+        self.ensure_collection()
+        self.db[self.collection].insert_one({
+            'kind': kind, 'key': key, 'source': self.source,
+            'date': datetime.utcnow(),
+        })
+
+    def mark_seen(self, doc_id):
+        """
+        Return False if message has been seen already.
+        """
+        if doc_id in self._seen:
+            return False
+        self._seen[doc_id] = True
+        if len(self._seen) > self.max_seen:
+            # Forgotten message is processed once more on reconnect,
+            # that only drops a cache entry again
+            self._seen.popitem(last=False)
+        return True
+
+    def listen(self):
+        self.ensure_collection()
+        coll = self.db[self.collection]
+        if self._seen is None:
+            # Messages published before the start are not processed
+            self._seen = OrderedDict()
+            for doc in coll.find({}, {'_id': 1}):
+                self.mark_seen(doc['_id'])
+        while self._running:
+            cursor = coll.find(cursor_type=CursorType.TAILABLE_AWAIT)
+            while self._running and cursor.alive:
+                for doc in cursor:
+                    if not self.mark_seen(doc['_id']):
+                        continue
+                    if doc['source'] not in (None, self.source):
+                        self.notify(doc['kind'], doc['key'])
+            time.sleep(1)
+
+
+class ChangeStreamChannel(InvalidationChannel):
+    """
+    Watches change stream of `config` collection, so settings saved by
+    any process are noticed without explicit message. Other messages
+    are inserted into `collection`. Requires MongoDB replica set.
+    """
+    def __init__(self, db, collection='invalidation'):
+        super(ChangeStreamChannel, self).__init__()
+        self.db = db
+        self.collection = collection
+
+    def publish(self, kind, key):
+        if kind == 'policy':
+            return
+        self.db[self.collection].insert_one({
+            'kind': kind, 'key': key, 'source': self.source,
+            'date': datetime.utcnow(),
+        })
+
+    def listen(self):
+        pipeline = [{'$match': {
+            'ns.coll': {'$in': ['config', self.collection]},
+            'operationType': {'$in': ['insert', 'update', 'replace']},
+        }}]
+        with self.db.watch(pipeline, full_document='updateLookup') as stream:
+            for change in stream:
+                if not self._running:
+                    break
+                doc = change.get('fullDocument')
+                if not doc:
+                    continue
+                if change['ns']['coll'] == 'config':
+                    self.notify('policy', doc['chat_id'])
+                elif doc['source'] != self.source:
+                    self.notify(doc['kind'], doc['key'])
+
+
+class UnixSocketChannel(InvalidationChannel):
+    """
+    Every process binds datagram socket in `path` directory and sends
+    messages to sockets of all other processes. Works only for processes
+    of one host, useful for development and tests.
+    """
+    def __init__(self, path):
+        super(UnixSocketChannel, self).__init__()
+        self.path = path
+        self._sock = None
+
+    def get_socket_path(self):
+        return os.path.join(self.path, '%s.sock' % self.source)
+
+    def bind(self):
+        if self._sock is None:
+            if not os.path.exists(self.path):
+                os.makedirs(self.path)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.bind(self.get_socket_path())
+            self._sock = sock
+        return self._sock
+
+    def publish(self, kind, key):
+        sock = self.bind()
+        data = json.dumps([kind, key]).encode('utf-8')
+        own_name = os.path.basename(self.get_socket_path())
+        for name in os.listdir(self.path):
+            if not name.endswith('.sock') or name == own_name:
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                sock.sendto(data, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Process has gone, socket file left behind
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+    def listen(self):
+        sock = self.bind()
+        sock.settimeout(1)
+        while self._running:
+            try:
+                data = sock.recv(4096)
+            except socket.timeout:
+                continue
+            kind, key = json.loads(data.decode('utf-8'))
+            self.notify(kind, key)
+
+    def stop(self):
+        super(UnixSocketChannel, self).stop()
+        try:
+            os.unlink(self.get_socket_path())
+        except OSError:
+            pass
+
+
+def build_channel(config, db):
+    backend = config.get('backend')
+    if backend is None:
+        return NullChannel()
+    elif backend == 'capped':
+        return CappedCollectionChannel(db, **config.get('options', {}))
+    elif backend == 'change_stream':
+        return ChangeStreamChannel(db, **config.get('options', {}))
+    elif backend == 'unix_socket':
+        return UnixSocketChannel(**config.get('options', {}))
+    else:
+        raise ValueError('Unknown invalidation backend: %s' % backend)
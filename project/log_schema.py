@@ -0,0 +1,67 @@
+"""
+Compact documents of `log` and `fail` collections.
+
+Full message payloads are not stored in database, they could be written
+to the archive, see `project.archive`.
+"""
+TEXT_EXCERPT_LENGTH = 200
+
+
+def build_text_excerpt(text):
+    if text and len(text) > TEXT_EXCERPT_LENGTH:
+        return text[:TEXT_EXCERPT_LENGTH]
+    return text
+
+
+def build_log_record(msg, date, event_type, reason):
+    return {
+        'date': date,
+        'type': event_type,
+        'reason': reason,
+        'chat_id': msg.chat.id,
+        'user_id': msg.from_user.id if msg.from_user else None,
+        'message_id': msg.message_id,
+        'text': build_text_excerpt(msg.text or msg.caption),
+    }
+
+
+def build_purge_record(chat_id, user_id, message_id, date, reason):
+    """
+    Log record of message deleted by id, its text is not known.
+    """
+    return {
+        'date': date,
+        'type': 'delete',
+        'reason': reason,
+        'chat_id': chat_id,
+        'user_id': user_id,
+        'message_id': message_id,
+        'text': None,
+    }
+
+
+def build_fail_record(msg, date, error, traceback):
+    return {
+        'date': date,
+        'error': error,
+        'traceback': traceback,
+        'chat_id': msg.chat.id,
+        'user_id': msg.from_user.id if msg.from_user else None,
+        'message_id': msg.message_id,
+    }
+
+
+def compact_legacy_record(doc):
+    """
+    Return fields to set on a document which stores whole message
+    in `msg` key.
+    """
+    msg = doc['msg']
+    return {
+        'chat_id': msg['chat']['id'],
+        'user_id': msg.get('from', {}).get('id'),
+        'message_id': msg.get('message_id'),
+        'text': build_text_excerpt(
+            doc.get('text') or msg.get('text') or msg.get('caption')
+        ),
+    }
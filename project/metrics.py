@@ -0,0 +1,241 @@
+"""
+In-process metrics rendered in Prometheus text format.
+
+    METRICS.inc('cache_requests_total', cache='policy', result='hit')
+    with METRICS.timer('handler_stage_seconds', stage='classify'):
+        ...
+"""
+from contextlib import contextmanager
+from traceback import extract_stack
+import logging
+import os
+import sys
+import threading
+import time
+
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1, 2.5, 5, 10,
+)
+METRIC_HELP = {
+    'cache_requests_total': ('counter', 'Cache lookups by cache and result'),
+    'bot_api_seconds': ('histogram', 'Bot API call latency by method'),
+    'bot_api_errors_total': ('counter', 'Failed Bot API calls by method'),
+    'bot_api_http_seconds': (
+        'histogram',
+        'Bot API HTTP request latency by method, including connection wait',
+    ),
+    'mongo_op_seconds': (
+        'histogram', 'MongoDB command latency by collection and command',
+    ),
+    'handler_stage_seconds': (
+        'histogram', 'Time spent in stages of message handler',
+    ),
+    'queue_depth': ('gauge', 'Number of pending items by queue'),
+}
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (key, str(value).replace('"', '\\"'))
+        for key, value in labels
+    )
+
+
+class Histogram(object):
+    __slots__ = ('buckets', 'counts', 'total', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for idx, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[idx] += 1
+                break
+        self.total += value
+        self.count += 1
+
+
+class Registry(object):
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            try:
+                hist = self._histograms[key]
+            except KeyError:
+                hist = self._histograms[key] = Histogram(self.buckets)
+            hist.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - started, **labels)
+
+    def register_gauge(self, name, func, **labels):
+        """
+        Register function which returns current value of gauge.
+        """
+        self._gauges[(name, tuple(sorted(labels.items())))] = func
+
+    def render(self):
+        with self._lock:
+            counters = list(self._counters.items())
+            histograms = [
+                (key, (list(x.counts), x.total, x.count))
+                for key, x in self._histograms.items()
+            ]
+        gauges = []
+        for key, func in list(self._gauges.items()):
+            try:
+                gauges.append((key, func()))
+            except Exception as ex:
+                logging.error('Failed to read gauge %s: %s' % (key[0], ex))
+        out = []
+        seen = set()
+
+        def add_header(name, default_type):
+            if name not in seen:
+                seen.add(name)
+                metric_type, help_text = METRIC_HELP.get(
+                    name, (default_type, name)
+                )
+                out.append('# HELP %s %s' % (name, help_text))
+                out.append('# TYPE %s %s' % (name, metric_type))
+
+        for (name, labels), value in sorted(counters):
+            add_header(name, 'counter')
+            out.append('%s%s %s' % (name, format_labels(labels), value))
+        for (name, labels), value in sorted(gauges):
+            add_header(name, 'gauge')
+            out.append('%s%s %s' % (name, format_labels(labels), value))
+        for (name, labels), (counts, total, count) in sorted(histograms):
+            add_header(name, 'histogram')
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                out.append('%s_bucket%s %d' % (
+                    name, format_labels(labels + (('le', bound),)),
+                    cumulative,
+                ))
+            out.append('%s_bucket%s %d' % (
+                name, format_labels(labels + (('le', '+Inf'),)), count,
+            ))
+            out.append('%s_sum%s %s' % (name, format_labels(labels), total))
+            out.append('%s_count%s %d' % (name, format_labels(labels), count))
+        return '\n'.join(out) + '\n'
+
+
+METRICS = Registry()
+
+
+@contextmanager
+def track_api_call(method):
+    started = time.time()
+    try:
+        yield
+    except Exception:
+        METRICS.inc('bot_api_errors_total', method=method)
+        raise
+    finally:
+        METRICS.observe('bot_api_seconds', time.time() - started, method=method)
+
+
+class SlowUpdateProfiler(object):
+    """
+    Sampling profiler of slow updates.
+
+    While an update is tracked, a background thread samples the stack of
+    the thread processing it every `interval` seconds. If processing takes
+    longer than `threshold` seconds, collected stacks are appended to
+    `path` in collapsed format ("frame;frame;frame count") which could
+    be fed to flamegraph.pl or speedscope.
+    """
+    def __init__(self, path, threshold=0.5, interval=0.005):
+        self.path = path
+        self.threshold = threshold
+        self.interval = interval
+        self._tracked = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._sample, name='profiler'
+                )
+                self._thread.daemon = True
+                self._thread.start()
+
+    @contextmanager
+    def track(self, label):
+        self._start()
+        ident = threading.current_thread().ident
+        stacks = {}
+        self._tracked[ident] = stacks
+        started = time.time()
+        try:
+            yield
+        finally:
+            self._tracked.pop(ident, None)
+            elapsed = time.time() - started
+            if elapsed >= self.threshold and stacks:
+                self.dump(label, elapsed, stacks)
+
+    def _sample(self):
+        while True:
+            time.sleep(self.interval)
+            if not self._tracked:
+                continue
+            frames = sys._current_frames()
+            for ident, stacks in list(self._tracked.items()):
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                key = ';'.join(
+                    '%s (%s:%d)' % (
+                        x.name, os.path.basename(x.filename), x.lineno,
+                    )
+                    for x in extract_stack(frame)
+                )
+                stacks[key] = stacks.get(key, 0) + 1
+
+    def dump(self, label, elapsed, stacks):
+        with self._lock:
+            with open(self.path, 'a') as out:
+                out.write('# update %s took %.3fs\n' % (label, elapsed))
+                for stack, count in sorted(stacks.items()):
+                    out.write('%s %d\n' % (stack, count))
+
+
+class NullProfiler(object):
+    @contextmanager
+    def track(self, label):
+        yield
+
+
+def build_profiler(config):
+    if config.get('path'):
+        return SlowUpdateProfiler(**config)
+    return NullProfiler()
@@ -0,0 +1,121 @@
+from collections import OrderedDict
+import heapq
+import logging
+import threading
+import time
+from traceback import format_exc
+
+
+class DeletionSummary(object):
+    __slots__ = ('messages', 'user_ids', 'reasons', 'first_notice')
+
+    def __init__(self):
+        self.messages = 0
+        self.user_ids = set()
+        self.reasons = {}
+        self.first_notice = None
+
+    def add(self, user_id, reason, notice):
+        if not self.messages:
+            self.first_notice = notice
+        self.messages += 1
+        self.user_ids.add(user_id)
+        self.reasons[reason] = self.reasons.get(reason, 0) + 1
+
+    def merged(self, other):
+        ret = DeletionSummary()
+        ret.messages = self.messages + other.messages
+        ret.user_ids = self.user_ids | other.user_ids
+        ret.reasons = dict(self.reasons)
+        for reason, count in other.reasons.items():
+            ret.reasons[reason] = ret.reasons.get(reason, 0) + count
+        ret.first_notice = self.first_notice or other.first_notice
+        return ret
+
+    def render(self):
+        if self.messages == 1:
+            return self.first_notice
+        return 'Deleted %d messages from %d users: %s' % (
+            self.messages, len(self.user_ids), ', '.join(
+                '%s ×%d' % (reason, count) for reason, count in sorted(
+                    self.reasons.items(), key=lambda x: (-x[1], x[0])
+                )
+            ),
+        )
+
+
+class NotificationAggregator(object):
+    """
+    Collects deletion notices of each chat during `window` seconds
+    and passes them to flush callback as one DeletionSummary.
+
+    Also remembers the last summary message of each chat, so it could be
+    edited instead of sending a new one during `rolling_period` seconds.
+    """
+    def __init__(self, window=3, rolling_period=600, max_chats=10000):
+        self.window = window
+        self.rolling_period = rolling_period
+        self.max_chats = max_chats
+        self._pending = {}
+        self._due = []
+        self._rolling = OrderedDict()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def _start(self):
+        # Must be called with self._cond acquired
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._work, name='notifications'
+            )
+            self._thread.daemon = True
+            self._thread.start()
+
+    def add(self, chat_id, user_id, reason, notice, flush):
+        with self._cond:
+            self._start()
+            try:
+                summary, _ = self._pending[chat_id]
+            except KeyError:
+                summary = DeletionSummary()
+                self._pending[chat_id] = (summary, flush)
+                heapq.heappush(self._due, (time.time() + self.window, chat_id))
+                self._cond.notify()
+            summary.add(user_id, reason, notice)
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._due or self._due[0][0] > time.time():
+                    timeout = self._due[0][0] - time.time() if self._due else None
+                    self._cond.wait(timeout)
+                _, chat_id = heapq.heappop(self._due)
+                summary, flush = self._pending.pop(chat_id)
+            try:
+                flush(chat_id, summary)
+            except Exception:
+                logging.error(format_exc())
+
+    def get_rolling(self, chat_id):
+        """
+        Return (message_id, summary) of the chat's last summary message
+        if it was sent less than `rolling_period` seconds ago.
+        """
+        with self._cond:
+            item = self._rolling.get(chat_id)
+            if item is None:
+                return None
+            message_id, summary, sent_time = item
+            if time.time() - sent_time > self.rolling_period:
+                del self._rolling[chat_id]
+                return None
+            return message_id, summary
+
+    def set_rolling(self, chat_id, message_id, summary, sent_time=None):
+        with self._cond:
+            prev = self._rolling.pop(chat_id, None)
+            if sent_time is None:
+                sent_time = prev[2] if prev else time.time()
+            self._rolling[chat_id] = (message_id, summary, sent_time)
+            while len(self._rolling) > self.max_chats:
+                self._rolling.popitem(last=False)
@@ -0,0 +1,211 @@
+"""
+Per-chat domain and keyword lists compiled into one regular expression.
+
+Patterns are kept in character tries which are converted into nested
+alternations, e.g. ["spam.com", "spam.org"] becomes "spam\\.(?:com|org)".
+At every position of the text the regex engine walks down the trie,
+so scan cost depends on the text length and not on number of patterns.
+"""
+import re
+import threading
+
+DENIED_DOMAINS = 'denied_domains'
+ALLOWED_DOMAINS = 'allowed_domains'
+BLOCKED_KEYWORDS = 'blocked_keywords'
+LIST_SETTINGS = (DENIED_DOMAINS, ALLOWED_DOMAINS, BLOCKED_KEYWORDS)
+RE_SCHEME = re.compile(r'[a-z][a-z0-9+.-]*://')
+RE_DOMAIN = re.compile(r'^[\w-]+(?:\.[\w-]+)+$')
+END = ''
+
+
+def normalize_domain(value):
+    """
+    Return lowercased host of domain or URL or None if it is invalid.
+    """
+    value = value.strip().lower()
+    match = RE_SCHEME.match(value)
+    if match:
+        value = value[match.end():]
+    value = re.split('[/:?#]', value, 1)[0].lstrip('*.')
+    if value.startswith('www.'):
+        value = value[4:]
+    if RE_DOMAIN.match(value):
+        return value
+    return None
+
+
+def normalize_keyword(value):
+    value = value.strip().lower()
+    return value or None
+
+
+class PatternTrie(object):
+    def __init__(self, patterns=()):
+        self.root = {}
+        for pattern in patterns:
+            self.add(pattern)
+
+    def add(self, pattern):
+        node = self.root
+        for char in pattern:
+            node = node.setdefault(char, {})
+        node[END] = True
+
+    def remove(self, pattern):
+        path = []
+        node = self.root
+        for char in pattern:
+            if char not in node:
+                return
+            path.append((node, char))
+            node = node[char]
+        node.pop(END, None)
+        # Drop branches which do not lead to any pattern anymore
+        for parent, char in reversed(path):
+            if parent[char]:
+                break
+            del parent[char]
+
+    def __bool__(self):
+        return bool(self.root)
+
+    def to_regex(self, node=None):
+        if node is None:
+            node = self.root
+        alts = [
+            re.escape(char) + self.to_regex(node[char])
+            for char in sorted(node) if char != END
+        ]
+        if not alts:
+            return ''
+        if len(alts) == 1 and END not in node:
+            return alts[0]
+        regex = '(?:%s)' % '|'.join(alts)
+        if END in node:
+            regex += '?'
+        return regex
+
+
+class ChatMatcher(object):
+    """
+    Scans text, caption and link URLs of a message for denied domains
+    and blocked keywords in one pass.
+
+    Lists are edited with `set_patterns`, which changes only the tries,
+    the regex is recompiled on next scan.
+    """
+    def __init__(self, settings):
+        self.patterns = dict((key, set()) for key in LIST_SETTINGS)
+        self.domain_trie = PatternTrie()
+        self.keyword_trie = PatternTrie()
+        self._regex = None
+        self._lock = threading.Lock()
+        for key in LIST_SETTINGS:
+            self.set_patterns(key, settings.get(key) or ())
+
+    def get_trie(self, key):
+        if key == BLOCKED_KEYWORDS:
+            return self.keyword_trie
+        return self.domain_trie
+
+    def is_used(self, pattern, except_key):
+        # Denied and allowed domains share one trie
+        trie = self.get_trie(except_key)
+        return any(
+            pattern in self.patterns[key] for key in LIST_SETTINGS
+            if key != except_key and self.get_trie(key) is trie
+        )
+
+    def set_patterns(self, key, patterns):
+        patterns = set(patterns)
+        with self._lock:
+            old = self.patterns[key]
+            self.patterns[key] = patterns
+            trie = self.get_trie(key)
+            for pattern in old - patterns:
+                if not self.is_used(pattern, key):
+                    trie.remove(pattern)
+            for pattern in patterns - old:
+                trie.add(pattern)
+            self._regex = None
+
+    def get_regex(self):
+        regex = self._regex
+        if regex is None:
+            with self._lock:
+                if self._regex is None:
+                    self._regex = self.compile()
+                regex = self._regex
+        return regex
+
+    def compile(self):
+        parts = []
+        if self.domain_trie:
+            parts.append(
+                r'(?<![\w.-])(?:[\w-]+\.)*?(?P<domain>%s)(?![\w-]|\.[\w-])'
+                % self.domain_trie.to_regex()
+            )
+        if self.keyword_trie:
+            parts.append(r'(?<!\w)(?P<keyword>%s)(?!\w)' % (
+                self.keyword_trie.to_regex()
+            ))
+        if not parts:
+            return False
+        return re.compile('|'.join(parts))
+
+    def iter_links(self, msg):
+        """
+        Yield (url, in_text) of each link of the message.
+        """
+        for ent in msg.entities:
+            if ent.type == 'text_link':
+                yield ent.url, False
+            elif ent.type == 'url':
+                yield msg.parse_entity(ent), True
+        for ent in msg.caption_entities:
+            if ent.type == 'text_link':
+                yield ent.url, False
+            elif ent.type == 'url':
+                yield msg.parse_caption_entity(ent), True
+
+    def scan(self, msg):
+        """
+        Return (reason, links_allowed): reason is "domain" or "keyword"
+        if message has to be deleted, links_allowed is True if message
+        has links and all of them point to allowed domains.
+        """
+        regex = self.get_regex()
+        if not regex:
+            return None, False
+        check_links = bool(self.patterns[ALLOWED_DOMAINS])
+        # Links go first, each one on its own line, then text and caption.
+        # URLs of `url` entities are in the text already, they are added
+        # only to check if all links are allowed.
+        parts = []
+        host_starts = {}
+        size = 0
+        for url, in_text in self.iter_links(msg):
+            if in_text and not check_links:
+                continue
+            url = url.lower()
+            match = RE_SCHEME.match(url)
+            host_starts[size + (match.end() if match else 0)] = len(
+                host_starts
+            )
+            parts.append(url)
+            size += len(url) + 1
+        parts.append(msg.text or '')
+        parts.append(msg.caption or '')
+        allowed_links = set()
+        for match in regex.finditer('\n'.join(parts).lower()):
+            if match.lastgroup == 'keyword':
+                return 'keyword', False
+            if match.group('domain') in self.patterns[DENIED_DOMAINS]:
+                return 'domain', False
+            link_idx = host_starts.get(match.start())
+            if link_idx is not None:
+                allowed_links.add(link_idx)
+        return None, bool(
+            check_links and host_starts
+            and len(allowed_links) == len(host_starts)
+        )
@@ -0,0 +1,179 @@
+import threading
+import time
+
+from project.metrics import METRICS
+from project.patterns import ChatMatcher, LIST_SETTINGS
+
+DEFAULT_IS_ALLOWED = True
+DEFAULT_SETTINGS = {
+    'notify_actions': True,
+    'notify_rolling': False,
+}
+VALID_SETTINGS = (
+    'notify_actions',
+    'notify_rolling',
+)
+MSG_TYPES = (
+    'link', 'bot', 'user', 'sticker', 'gif', 'voice',
+    'attachment', 'audio', 'photo', 'user_joined_msg',
+    'user_left_msg', 'mention', 'video_message', 'flood', 'join_raid',
+)
+MSG_TYPE_BITS = dict((x, 1 << idx) for idx, x in enumerate(MSG_TYPES))
+ALL_TYPES_MASK = (1 << len(MSG_TYPES)) - 1
+ALLOWED_PREFIX = 'is_allowed_'
+
+
+def build_type_mask(msg_types):
+    mask = 0
+    for msg_type in msg_types:
+        mask |= MSG_TYPE_BITS.get(msg_type, 0)
+    return mask
+
+
+class ChatPolicy(object):
+    """
+    All config rows of one chat packed into one object.
+
+    `is_allowed_<type>` rows are kept as bits of `blocked_mask`, any other
+    row is kept in `settings`. Domain and keyword lists are compiled into
+    `matcher` on first use.
+    """
+    __slots__ = ('chat_id', 'blocked_mask', 'settings', 'matcher')
+
+    def __init__(self, chat_id, blocked_mask=None, settings=None):
+        self.chat_id = chat_id
+        if blocked_mask is None:
+            blocked_mask = 0 if DEFAULT_IS_ALLOWED else ALL_TYPES_MASK
+        self.blocked_mask = blocked_mask
+        self.settings = settings if settings is not None else {}
+        self.matcher = None
+
+    @classmethod
+    def from_rows(cls, chat_id, rows):
+        policy = cls(chat_id)
+        for row in rows:
+            policy.apply(row['key'], row['value'])
+        return policy
+
+    def apply(self, key, value):
+        if key.startswith(ALLOWED_PREFIX):
+            bit = MSG_TYPE_BITS.get(key[len(ALLOWED_PREFIX):])
+            if bit:
+                if value:
+                    self.blocked_mask &= ~bit
+                else:
+                    self.blocked_mask |= bit
+                return
+        self.settings[key] = value
+        if key in LIST_SETTINGS and self.matcher is not None:
+            self.matcher.set_patterns(key, value)
+
+    def get(self, key, default=None):
+        if key.startswith(ALLOWED_PREFIX):
+            bit = MSG_TYPE_BITS.get(key[len(ALLOWED_PREFIX):])
+            if bit:
+                return not self.blocked_mask & bit
+        return self.settings.get(key, default)
+
+    def is_allowed(self, msg_type):
+        return not self.blocked_mask & MSG_TYPE_BITS.get(msg_type, 0)
+
+    def get_setting(self, key):
+        return self.settings.get(key, DEFAULT_SETTINGS[key])
+
+    def get_matcher(self):
+        """
+        Return ChatMatcher of the chat or None if it has no lists.
+        """
+        if self.matcher is None:
+            if not any(self.settings.get(x) for x in LIST_SETTINGS):
+                return None
+            self.matcher = ChatMatcher(self.settings)
+        return self.matcher
+
+
+def load_all_policies(storage):
+    """
+    Load policies of all chats in one pass over chat settings.
+    """
+    policies = {}
+    for row in storage.load_all_chat_settings():
+        try:
+            policy = policies[row['chat_id']]
+        except KeyError:
+            policy = policies[row['chat_id']] = ChatPolicy(row['chat_id'])
+        policy.apply(row['key'], row['value'])
+    return list(policies.values())
+
+
+class PolicyCache(object):
+    """
+    Policies of chats loaded on demand.
+
+    `data_time` is the unix time the oldest cached data was read at,
+    changes saved after that time could be missing in the cache. After
+    `mark_complete` (all chats were preloaded) chats which are not in
+    the cache have default policy and are not loaded from storage.
+    """
+    def __init__(self):
+        self._items = {}
+        self._lock = threading.Lock()
+        self.snapshot = None
+        self.data_time = None
+        self.complete = False
+        # Chats dropped from complete cache, they have to be loaded
+        self._dropped = set()
+
+    def note_data_time(self, value):
+        with self._lock:
+            if self.data_time is None or value < self.data_time:
+                self.data_time = value
+
+    def get(self, chat_id, storage):
+        try:
+            policy = self._items[chat_id]
+        except KeyError:
+            METRICS.inc('cache_requests_total', cache='policy', result='miss')
+            policy = None
+            if self.complete and chat_id not in self._dropped:
+                policy = ChatPolicy(chat_id)
+            if policy is None and self.snapshot is not None:
+                policy = self.snapshot.lookup(chat_id)
+                if policy is not None:
+                    self.note_data_time(self.snapshot.created)
+            if policy is None:
+                self.note_data_time(time.time())
+                policy = ChatPolicy.from_rows(
+                    chat_id, storage.load_chat_settings(chat_id)
+                )
+            with self._lock:
+                self._dropped.discard(chat_id)
+                return self._items.setdefault(chat_id, policy)
+        else:
+            METRICS.inc('cache_requests_total', cache='policy', result='hit')
+            return policy
+
+    def drop(self, chat_id):
+        with self._lock:
+            self._items.pop(chat_id, None)
+            if self.complete:
+                self._dropped.add(chat_id)
+        if self.snapshot is not None:
+            self.snapshot.excluded.add(chat_id)
+
+    def update(self, policies):
+        with self._lock:
+            for policy in policies:
+                self._items.setdefault(policy.chat_id, policy)
+
+    def mark_complete(self):
+        self.complete = True
+
+    def values(self):
+        return list(self._items.values())
+
+    def __contains__(self, chat_id):
+        return chat_id in self._items
+
+    def __len__(self):
+        return len(self._items)
@@ -0,0 +1,90 @@
+"""
+Index of recent messages of each chat, used to delete messages which
+were posted before the chat blocked them.
+"""
+from array import array
+from collections import OrderedDict
+import threading
+
+# message_id, user_id, types mask, unix time
+FIELDS = 4
+
+
+class ChatRing(object):
+    """
+    Ring buffer of last `size` messages of one chat packed into one
+    array of 64-bit integers.
+    """
+    __slots__ = ('data', 'size', 'pos', 'count')
+
+    def __init__(self, size):
+        self.data = array('q', [0]) * (size * FIELDS)
+        self.size = size
+        self.pos = 0
+        self.count = 0
+
+    def add(self, message_id, user_id, types_mask, date):
+        offset = self.pos * FIELDS
+        self.data[offset:offset + FIELDS] = array(
+            'q', (message_id, user_id, types_mask, date)
+        )
+        self.pos = (self.pos + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def iter_newest(self):
+        """
+        Yield (message_id, user_id, types_mask, date) from the newest
+        message to the oldest one.
+        """
+        data = self.data
+        for idx in range(1, self.count + 1):
+            offset = ((self.pos - idx) % self.size) * FIELDS
+            yield tuple(data[offset:offset + FIELDS])
+
+
+class RecentMessages(object):
+    """
+    Keeps last `size` messages of at most `max_chats` recently active
+    chats.
+    """
+    def __init__(self, size=200, max_chats=10000):
+        self.size = size
+        self.max_chats = max_chats
+        self._chats = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, chat_id, message_id, user_id, types_mask, date):
+        with self._lock:
+            try:
+                ring = self._chats[chat_id]
+                self._chats.move_to_end(chat_id)
+            except KeyError:
+                ring = self._chats[chat_id] = ChatRing(self.size)
+                if len(self._chats) > self.max_chats:
+                    self._chats.popitem(last=False)
+            ring.add(message_id, user_id, types_mask, date)
+
+    def find(self, chat_id, since, types_mask=None, user_id=None):
+        """
+        Return (message_id, user_id) of chat messages posted not earlier
+        than `since` which have any of `types_mask` types and were posted
+        by `user_id`, newest first. None filter matches any message.
+        """
+        with self._lock:
+            ring = self._chats.get(chat_id)
+            if ring is None:
+                return []
+            items = list(ring.iter_newest())
+        ret = []
+        for message_id, msg_user_id, msg_types_mask, date in items:
+            if date < since:
+                break
+            if types_mask is not None and not msg_types_mask & types_mask:
+                continue
+            if user_id is not None and msg_user_id != user_id:
+                continue
+            ret.append((message_id, msg_user_id))
+        return ret
+
+    def __len__(self):
+        return len(self._chats)
@@ -2,6 +2,141 @@ MONGODB = {
     'connection': {},
     'dbname': 'watchdog',
 }
+ADMIN_CACHE = {
+    'size': 10000,
+    'ttl': 3600,
+}
+# Telegram allows about 30 messages per second in total
+# and 20 messages per minute to the same group
+ACTION_QUEUE = {
+    'workers': 8,
+    'global_rate': 30,
+    'global_burst': 30,
+    'chat_rate': 20 / 60.0,
+    'chat_burst': 20,
+    'max_retries': 5,
+    # Seconds to wait for queued actions on exit
+    'drain_timeout': 10,
+}
+# Failed writes are retried on next 'max_retries' flushes, then saved
+# to 'fallback_path' file, see `manage.py load_write_fallback`
+WRITE_BUFFER = {
+    'size': 500,
+    'interval': 1.0,
+    'max_retries': 10,
+    'fallback_path': None,
+}
+# User posting 'messages' messages during 'window' seconds is flooding,
+# at most 'size' recently active chat users are tracked
+FLOOD = {
+    'messages': 20,
+    'window': 5,
+    'size': 100000,
+}
+# Chat getting 'joins' new members during 'window' seconds is raided
+JOIN_RAID = {
+    'joins': 10,
+    'window': 60,
+    'size': 10000,
+}
+# Last 'size' messages of at most 'max_chats' chats are remembered
+# for /watchdog_purge command
+RECENT_MESSAGES = {
+    'size': 200,
+    'max_chats': 10000,
+}
+# HTTP transport of Bot API calls, see project.transport. Set
+# 'base_url' to e.g. 'http://127.0.0.1:8081/bot' to use stub server
+# of bench.stub_api instead of Telegram.
+BOT_API = {
+    'pool_size': 32,
+    'connect_timeout': 5.0,
+    'read_timeout': 10.0,
+    'method_timeouts': {
+        'deleteMessage': 5.0,
+        'deleteMessages': 10.0,
+        'getChatAdministrators': 5.0,
+        'sendMessage': 10.0,
+        'editMessageText': 10.0,
+    },
+    'base_url': None,
+}
+# Where chat settings, users, chats, moderation log and counters are
+# stored. Backends: 'mongo', 'sqlite' (requires 'path' option)
+STORAGE = {
+    'backend': 'mongo',
+    'options': {},
+}
+# Delete log and fail documents older than that number of days,
+# None to keep them forever
+LOG_TTL_DAYS = None
+# Directory to save full payloads of log and fail events to,
+# None to not save them
+LOG_ARCHIVE = {
+    'path': None,
+    'segment_size': 64 * 1024 * 1024,
+}
+# Channel to notify other processes (e.g. gunicorn workers) about
+# changed chat settings and admins. Backends: None (single process),
+# 'capped', 'change_stream', 'unix_socket' (requires 'path' option)
+INVALIDATION = {
+    'backend': None,
+    'options': {},
+}
+# Options of asyncio runtime, see project.aio.AsyncEngine
+ASYNC_ENGINE = {
+    'token': None,
+    'base_url': 'https://api.telegram.org/bot',
+    'pool_size': 100,
+    'db_workers': 4,
+    'handler_workers': 4,
+    'max_concurrency': 10000,
+}
+ASGI_WEBHOOK_PATH = '/'
+# Set 'path' to dump stacks of updates processed longer than
+# 'threshold' seconds, sampled every 'interval' seconds
+PROFILER = {
+    'path': None,
+    'threshold': 0.5,
+    'interval': 0.005,
+}
+# Deletion notices of a chat are collected during 'window' seconds
+# and sent as one summary message. With notify_rolling chat setting
+# the summary message is edited during 'rolling_period' seconds.
+NOTIFICATIONS = {
+    'window': 3,
+    'rolling_period': 600,
+}
+# Number of threads to process updates in, updates of one chat are
+# always processed by the same thread. 0 disables sharding.
+SHARDS = 0
+# Remember update ids and moderated messages to skip duplicates.
+# With 'shared' keys are also stored in MongoDB for all processes.
+DEDUP = {
+    'size': 100000,
+    'ttl': 3600,
+    'shared': False,
+}
+# Load settings of all chats on start
+PRELOAD_POLICIES = False
+# File to save policy cache to on exit and to read it from on start,
+# snapshot older than 'max_age' seconds is ignored
+POLICY_SNAPSHOT = {
+    'path': None,
+    'max_age': 3600,
+}
+# Export of chat moderation log, see project.audit. With 'secret' set
+# the log is also available at '<url>/audit/<chat_id>?token=...' of
+# webhook app, 'url' is public URL of the app. Token given to admin
+# expires in 'token_ttl' seconds. Exports run in 'export_workers'
+# threads.
+AUDIT = {
+    'secret': None,
+    'url': None,
+    'max_days': 365,
+    'token_ttl': 24 * 3600,
+    'export_workers': 2,
+}
 
 try:
     from project.settings_local import *
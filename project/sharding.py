@@ -0,0 +1,81 @@
+"""
+Processing of updates in N shard threads.
+
+Updates are routed to shards by chat id, so updates of one chat are
+processed in order by one thread while different chats are processed
+in parallel. Every shard has own policy and admin caches which are used
+only by its thread.
+"""
+from traceback import format_exc
+import logging
+import threading
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+from telegram.ext import DispatcherHandlerStop
+
+
+class Shard(object):
+    def __init__(self, idx, policy_cache, admin_cache):
+        self.idx = idx
+        self.policy_cache = policy_cache
+        self.admin_cache = admin_cache
+        self.queue = Queue()
+        self.thread = None
+
+
+class ShardPool(object):
+    def __init__(self, count, policy_cache_factory, admin_cache_factory):
+        self.shards = [
+            Shard(idx, policy_cache_factory(), admin_cache_factory())
+            for idx in range(count)
+        ]
+        self.dispatcher = None
+        self._local = threading.local()
+
+    def start(self, dispatcher):
+        self.dispatcher = dispatcher
+        for shard in self.shards:
+            if shard.thread is None:
+                shard.thread = threading.Thread(
+                    target=self._work, args=[shard],
+                    name='shard-%d' % shard.idx,
+                )
+                shard.thread.daemon = True
+                shard.thread.start()
+
+    def current(self):
+        """
+        Return shard of current thread or None.
+        """
+        return getattr(self._local, 'shard', None)
+
+    def get_shard(self, chat_id):
+        return self.shards[hash(chat_id) % len(self.shards)]
+
+    def route(self, bot, update):
+        """
+        Handler of the first dispatcher group: passes update to its shard
+        and stops processing in the current thread. In shard thread the
+        update continues to the regular handlers.
+        """
+        if self.current() is not None:
+            return
+        chat = update.effective_chat
+        self.get_shard(chat.id if chat else 0).queue.put(update)
+        raise DispatcherHandlerStop
+
+    def _work(self, shard):
+        self._local.shard = shard
+        while True:
+            update = shard.queue.get()
+            try:
+                self.dispatcher.process_update(update)
+            except Exception:
+                logging.error(format_exc())
+
+    def qsize(self):
+        return sum(x.queue.qsize() for x in self.shards)
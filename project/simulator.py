@@ -0,0 +1,240 @@
+"""
+Offline evaluation of candidate policies over message history.
+
+Messages are streamed from a file of updates, from the log archive or
+from the moderation log, classified into type bitmasks and processed
+in chunks of NumPy arrays, so memory use does not depend on the size
+of history. Requires numpy.
+
+    simulator = PolicySimulator([
+        ('links', build_type_mask(['link'])),
+        ('media', build_type_mask(['photo', 'gif', 'sticker'])),
+    ])
+    simulator.feed(iter_update_messages('updates.jsonl'))
+    print(render_report(simulator.report()))
+"""
+import gzip
+import json
+
+import numpy as np
+
+from project.archive import iter_archive
+from project.classifier import CLASSIFIER
+from project.policy import MSG_TYPES, MSG_TYPE_BITS
+
+# Fields which are lists in Bot API message objects
+LIST_FIELDS = ('entities', 'caption_entities', 'new_chat_members', 'photo')
+FIELD_ALIASES = {'from_user': 'from'}
+MESSAGE_KEYS = ('message', 'edited_message')
+SHAPE_CACHE_SIZE = 100000
+
+
+class DictMessage(object):
+    """
+    Attribute access to message dict which is enough for classifier
+    rules. It is much cheaper than building telegram.Message.
+    """
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __getattr__(self, name):
+        value = self.data.get(FIELD_ALIASES.get(name, name))
+        if value is None:
+            return [] if name in LIST_FIELDS else None
+        if isinstance(value, dict):
+            return DictMessage(value)
+        if isinstance(value, list):
+            return [
+                DictMessage(x) if isinstance(x, dict) else x for x in value
+            ]
+        return value
+
+
+def get_message_shape(msg):
+    """
+    Return everything classifier rules depend on: present fields,
+    entity types, document type and bot flags of joined members.
+    """
+    return (
+        tuple(sorted(msg)),
+        tuple(x['type'] for x in msg.get('entities', ())),
+        tuple(x['type'] for x in msg.get('caption_entities', ())),
+        (msg.get('document') or {}).get('mime_type'),
+        tuple(x.get('is_bot') for x in msg.get('new_chat_members', ())),
+    )
+
+
+def open_text(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, encoding='utf-8')
+
+
+def iter_update_messages(path):
+    """
+    Yield group message dicts from JSONL file of updates.
+    """
+    with open_text(path) as inp:
+        for line in inp:
+            if not line.strip():
+                continue
+            update = json.loads(line)
+            for key in MESSAGE_KEYS:
+                msg = update.get(key)
+                if msg and msg['chat']['type'] in ('group', 'supergroup'):
+                    yield msg
+
+
+def iter_archive_messages(path):
+    """
+    Yield message dicts saved to the log archive.
+    """
+    for item in iter_archive(path):
+        msg = item['record'].get('msg')
+        if msg:
+            yield msg
+
+
+def iter_log_messages(storage):
+    """
+    Yield message payloads of moderation log records. Only legacy
+    records keep full payloads, see project.log_schema.
+    """
+    for record in storage.export_records('log'):
+        msg = record.get('msg')
+        if msg:
+            yield msg
+
+
+class PolicySimulator(object):
+    """
+    Counts messages which would be deleted by each of `candidates`,
+    a list of (name, blocked_mask) pairs. With `current_masks`, a dict
+    of chat_id -> blocked mask, each candidate is added to current
+    policy of the chat and only additional deletions are counted.
+    """
+    def __init__(self, candidates, current_masks=None, chunk_size=65536):
+        self.candidates = candidates
+        self.current_masks = current_masks
+        self.chunk_size = chunk_size
+        self.messages = 0
+        self.type_hits = np.zeros(len(MSG_TYPES), dtype=np.int64)
+        self.type_bits = np.array(
+            [MSG_TYPE_BITS[x] for x in MSG_TYPES], dtype=np.int64
+        )
+        # chat_id -> [messages, hits of candidate 1, hits of candidate 2...]
+        self.chats = {}
+        self._shape_masks = {}
+
+    def get_mask(self, msg):
+        # Most messages have one of a few shapes, they are classified once
+        shape = get_message_shape(msg)
+        try:
+            return self._shape_masks[shape]
+        except KeyError:
+            if len(self._shape_masks) >= SHAPE_CACHE_SIZE:
+                self._shape_masks.clear()
+            mask = self._shape_masks[shape] = CLASSIFIER.find_mask(
+                DictMessage(msg)
+            )
+            return mask
+
+    def feed(self, messages):
+        chat_ids = np.empty(self.chunk_size, dtype=np.int64)
+        masks = np.empty(self.chunk_size, dtype=np.int64)
+        size = 0
+        for msg in messages:
+            chat_ids[size] = msg['chat']['id']
+            masks[size] = self.get_mask(msg)
+            size += 1
+            if size == self.chunk_size:
+                self.process_chunk(chat_ids, masks)
+                size = 0
+        if size:
+            self.process_chunk(chat_ids[:size], masks[:size])
+
+    def process_chunk(self, chat_ids, masks):
+        self.messages += len(masks)
+        self.type_hits += (
+            (masks[:, None] & self.type_bits[None, :]) != 0
+        ).sum(axis=0)
+        unique_ids, inverse = np.unique(chat_ids, return_inverse=True)
+        columns = [np.bincount(inverse, minlength=len(unique_ids))]
+        if self.current_masks is not None:
+            current = np.array(
+                [self.current_masks.get(x, 0) for x in unique_ids.tolist()],
+                dtype=np.int64,
+            )[inverse]
+            already_deleted = (masks & current) != 0
+        for name, candidate_mask in self.candidates:
+            hits = (masks & candidate_mask) != 0
+            if self.current_masks is not None:
+                hits &= ~already_deleted
+            columns.append(
+                np.bincount(inverse, weights=hits, minlength=len(unique_ids))
+            )
+        counts = np.stack(columns, axis=1).astype(np.int64)
+        for chat_id, row in zip(unique_ids.tolist(), counts.tolist()):
+            try:
+                totals = self.chats[chat_id]
+            except KeyError:
+                self.chats[chat_id] = row
+            else:
+                for idx, value in enumerate(row):
+                    totals[idx] += value
+
+    def report(self, top=10):
+        """
+        Return dict with number of messages, hits of each type and
+        totals and top chats of each candidate.
+        """
+        candidates = []
+        for idx, (name, candidate_mask) in enumerate(self.candidates):
+            chats = sorted(
+                (
+                    (chat_id, row[idx + 1], row[0])
+                    for chat_id, row in self.chats.items() if row[idx + 1]
+                ),
+                key=lambda x: (-x[1], x[0]),
+            )
+            candidates.append({
+                'name': name,
+                'hits': sum(x[1] for x in chats),
+                'chats': len(chats),
+                'top_chats': chats[:top],
+            })
+        return {
+            'messages': self.messages,
+            'chats': len(self.chats),
+            'types': dict(zip(MSG_TYPES, self.type_hits.tolist())),
+            'candidates': candidates,
+        }
+
+
+def format_rate(hits, total):
+    return '%d (%.2f%%)' % (hits, 100.0 * hits / total if total else 0)
+
+
+def render_report(report):
+    total = report['messages']
+    out = [
+        'Messages: %d' % total,
+        'Chats: %d' % report['chats'],
+        'Messages by type:',
+    ]
+    for msg_type, hits in sorted(
+            report['types'].items(), key=lambda x: (-x[1], x[0])
+        ):
+        if hits:
+            out.append('  %s: %s' % (msg_type, format_rate(hits, total)))
+    for item in report['candidates']:
+        out.append('Policy %s: %s deleted in %d chats' % (
+            item['name'], format_rate(item['hits'], total), item['chats'],
+        ))
+        for chat_id, hits, messages in item['top_chats']:
+            out.append('  chat %d: %s of %d' % (
+                chat_id, format_rate(hits, messages), messages,
+            ))
+    return '\n'.join(out)
@@ -0,0 +1,167 @@
+"""
+Binary snapshot of the policy cache.
+
+File layout: magic, header (creation time, record count) and records
+sorted by chat id. Records are looked up with binary search directly in
+the memory-mapped file, so opening snapshot costs nothing regardless
+of its size.
+"""
+from datetime import datetime
+import fcntl
+import mmap
+import os
+import struct
+import time
+
+from project.policy import ChatPolicy, VALID_SETTINGS
+
+MAGIC = b'WDPS1'
+HEADER = struct.Struct('<dI')
+# chat_id, blocked_mask, settings bits
+RECORD = struct.Struct('<qIH')
+# Policy has settings which could not be packed into settings bits
+FLAG_INCOMPLETE = 1 << 15
+
+
+def pack_settings(settings):
+    bits = 0
+    for key, value in settings.items():
+        if key in VALID_SETTINGS and isinstance(value, bool):
+            idx = VALID_SETTINGS.index(key)
+            bits |= 1 << (idx * 2)
+            if value:
+                bits |= 1 << (idx * 2 + 1)
+        else:
+            bits |= FLAG_INCOMPLETE
+    return bits
+
+
+def unpack_settings(bits):
+    settings = {}
+    for idx, key in enumerate(VALID_SETTINGS):
+        if bits & (1 << (idx * 2)):
+            settings[key] = bool(bits & (1 << (idx * 2 + 1)))
+    return settings
+
+
+def write_policy_snapshot(path, policies, created, max_age=None):
+    """
+    Write snapshot of `policies` which were read from storage not
+    earlier than `created` unix time.
+
+    Processes could share one path: records of the existing snapshot
+    are kept unless it is older than `max_age` seconds, and creation
+    time of the new one is the oldest of the two.
+    """
+    records = dict(
+        (x.chat_id, (x.blocked_mask, pack_settings(x.settings)))
+        for x in policies
+    )
+    with open('%s.lock' % path, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        old = open_policy_snapshot(path)
+        if old is not None:
+            if max_age is None or time.time() - old.created <= max_age:
+                for record in old.iter_records():
+                    records.setdefault(record[0], record[1:])
+                created = min(created, old.created)
+            old.close()
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'wb') as out:
+            out.write(MAGIC)
+            out.write(HEADER.pack(created, len(records)))
+            for chat_id in sorted(records):
+                out.write(RECORD.pack(chat_id, *records[chat_id]))
+        os.replace(tmp_path, path)
+    return len(records)
+
+
+def open_policy_snapshot(path):
+    """
+    Return PolicySnapshot or None if file does not exist or is invalid.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        return PolicySnapshot(path)
+    except ValueError:
+        return None
+
+
+class PolicySnapshot(object):
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        try:
+            self._data = mmap.mmap(
+                self._file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        except ValueError:
+            # Empty file
+            self._file.close()
+            raise
+        self._offset = len(MAGIC) + HEADER.size
+        if (
+                len(self._data) < self._offset
+                or self._data[:len(MAGIC)] != MAGIC
+            ):
+            self.close()
+            raise ValueError('Invalid snapshot file: %s' % path)
+        self.created, self.count = HEADER.unpack_from(self._data, len(MAGIC))
+        if len(self._data) < self._offset + self.count * RECORD.size:
+            self.close()
+            raise ValueError('Truncated snapshot file: %s' % path)
+        # Chats changed after snapshot was created
+        self.excluded = set()
+
+    def iter_records(self):
+        for idx in range(self.count):
+            yield RECORD.unpack_from(
+                self._data, self._offset + idx * RECORD.size
+            )
+
+    def lookup(self, chat_id):
+        """
+        Return ChatPolicy of the chat or None if snapshot has no
+        reliable data about it.
+        """
+        if chat_id in self.excluded:
+            return None
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            record = RECORD.unpack_from(
+                self._data, self._offset + mid * RECORD.size
+            )
+            if record[0] < chat_id:
+                low = mid + 1
+            elif record[0] > chat_id:
+                high = mid
+            else:
+                if record[2] & FLAG_INCOMPLETE:
+                    return None
+                return ChatPolicy(
+                    chat_id, record[1], unpack_settings(record[2])
+                )
+        return None
+
+    def close(self):
+        self._data.close()
+        self._file.close()
+
+
+def load_policy_snapshot(path, max_age, storage):
+    """
+    Open snapshot if it is not older than `max_age` seconds. Chats
+    which settings were saved after snapshot had been created are
+    excluded from it.
+    """
+    snapshot = open_policy_snapshot(path)
+    if snapshot is None:
+        return None
+    if time.time() - snapshot.created > max_age:
+        snapshot.close()
+        return None
+    snapshot.excluded.update(storage.find_chats_changed_since(
+        datetime.utcfromtimestamp(snapshot.created)
+    ))
+    return snapshot
@@ -0,0 +1,107 @@
+"""
+Daily counters of deleted messages.
+
+Each day has one document in `stat_day` collection:
+
+    {
+        '_id': '2018-01-31',
+        'date': datetime(2018, 1, 31),
+        'messages': 123,
+        'reasons': {'link': 100, 'sticker': 23},
+        'chat_ids': [-1001, -1002],
+    }
+
+Counters are incremented by `record_deletion` through the write buffer
+and could be rebuilt from `log` collection with `rebuild_day_stat`.
+"""
+from datetime import datetime, timedelta
+
+DAY_FORMAT = '%Y-%m-%d'
+
+
+def get_day_start(date):
+    return date.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def record_deletion(write_buffer, date, chat_id, reason):
+    day = get_day_start(date)
+    write_buffer.update('stat_day', day.strftime(DAY_FORMAT), {
+        '$setOnInsert': {'date': day},
+        '$inc': {'messages': 1, 'reasons.%s' % reason: 1},
+        '$addToSet': {'chat_ids': chat_id},
+    })
+
+
+def load_day_stat(db, days):
+    """
+    Return list of (day, chat_count, msg_count, reasons) tuples for
+    last `days` days including today, oldest day goes first.
+    """
+    today = get_day_start(datetime.utcnow())
+    start = today - timedelta(days=days - 1)
+    cursor = db.stat_day.aggregate([
+        {'$match': {'date': {'$gte': start}}},
+        {'$project': {
+            'messages': 1,
+            'reasons': 1,
+            'chats': {'$size': {'$ifNull': ['$chat_ids', []]}},
+        }},
+    ])
+    items = dict((x['_id'], x) for x in cursor)
+    ret = []
+    for idx in range(days):
+        day = (start + timedelta(days=idx)).strftime(DAY_FORMAT)
+        item = items.get(day, {})
+        ret.append((
+            day, item.get('chats', 0), item.get('messages', 0),
+            item.get('reasons', {}),
+        ))
+    return ret
+
+
+def rebuild_day_stat(db, start, end):
+    """
+    Recalculate counters of days in [start, end) from `log` collection.
+    """
+    start = get_day_start(start)
+    cursor = db.log.aggregate([
+        {'$match': {
+            'type': 'delete',
+            'date': {'$gte': start, '$lt': end},
+        }},
+        {'$group': {
+            '_id': {
+                'day': {'$dateToString': {
+                    'format': DAY_FORMAT, 'date': '$date',
+                }},
+                'reason': '$reason',
+            },
+            'messages': {'$sum': 1},
+            'chat_ids': {'$addToSet': {
+                '$ifNull': ['$chat_id', '$msg.chat.id'],
+            }},
+        }},
+    ], allowDiskUse=True)
+    days = {}
+    for item in cursor:
+        day = days.setdefault(item['_id']['day'], {
+            'messages': 0, 'reasons': {}, 'chat_ids': set(),
+        })
+        day['messages'] += item['messages']
+        day['reasons'][item['_id']['reason']] = item['messages']
+        day['chat_ids'].update(item['chat_ids'])
+    date = start
+    while date < end:
+        key = date.strftime(DAY_FORMAT)
+        day = days.get(key)
+        if day:
+            db.stat_day.replace_one({'_id': key}, {
+                'date': date,
+                'messages': day['messages'],
+                'reasons': day['reasons'],
+                'chat_ids': list(day['chat_ids']),
+            }, upsert=True)
+        else:
+            db.stat_day.delete_one({'_id': key})
+        date += timedelta(days=1)
+    return len(days)
@@ -0,0 +1,24 @@
+from project.storage.base import Storage, RECORD_KINDS
+
+
+def build_storage(config, db=None):
+    backend = config.get('backend', 'mongo')
+    if backend == 'mongo':
+        from project.storage.mongo import MongoStorage
+
+        if db is None:
+            from project.database import get_db
+
+            db = get_db()
+        from project.settings import WRITE_BUFFER
+
+        options = dict(
+            {'write_buffer': WRITE_BUFFER}, **config.get('options', {})
+        )
+        return MongoStorage(db, **options)
+    elif backend == 'sqlite':
+        from project.storage.sqlite import SQLiteStorage
+
+        return SQLiteStorage(**config.get('options', {}))
+    else:
+        raise ValueError('Unknown storage backend: %s' % backend)
@@ -0,0 +1,115 @@
+from datetime import datetime
+
+# Kinds of records which could be exported from one storage
+# and imported into another one
+RECORD_KINDS = ('config', 'user', 'chat', 'log', 'fail', 'stat_day')
+CURSOR_DATE_FORMAT = '%Y%m%d%H%M%S%f'
+
+
+def build_cursor(date, key):
+    return '%s_%s' % (date.strftime(CURSOR_DATE_FORMAT), key)
+
+
+def parse_cursor(cursor):
+    """
+    Return (date, key) of cursor, key is a string. Raise ValueError
+    if cursor is invalid.
+    """
+    date, key = cursor.split('_', 1)
+    return datetime.strptime(date, CURSOR_DATE_FORMAT), key
+
+
+class Storage(object):
+    """
+    Interface of persistent data of the bot.
+
+    Records passed to `import_records` and returned by `export_records`:
+
+    * config: {'chat_id', 'key', 'value', 'date'}
+    * user, chat: {'_id', 'msg', 'join_date', 'first_join_date'}
+    * log: see project.log_schema.build_log_record
+    * fail: see project.log_schema.build_fail_record
+    * stat_day: {'_id', 'date', 'messages', 'reasons', 'chat_ids'}
+    """
+    def start(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def pending(self):
+        return 0
+
+    # Chat settings
+
+    def load_chat_settings(self, chat_id):
+        """
+        Return list of {'key': ..., 'value': ...} rows of the chat.
+        """
+        raise NotImplementedError
+
+    def load_all_chat_settings(self):
+        """
+        Iterate over {'chat_id', 'key', 'value'} rows of all chats.
+        """
+        raise NotImplementedError
+
+    def save_chat_setting(self, chat_id, key, value):
+        raise NotImplementedError
+
+    def find_chats_changed_since(self, date):
+        raise NotImplementedError
+
+    # Users and chats
+
+    def remember_user(self, user_id, msg_data):
+        raise NotImplementedError
+
+    def remember_chat(self, chat_id, msg_data):
+        raise NotImplementedError
+
+    # Moderation log and failures
+
+    def add_log_event(self, record):
+        raise NotImplementedError
+
+    def add_failure(self, record):
+        raise NotImplementedError
+
+    def iter_chat_log(
+            self, chat_id, since=None, until=None, reason=None, after=None,
+            limit=None,
+        ):
+        """
+        Iterate over log records of the chat ordered by date, without
+        loading them all into memory. Each record has 'cursor' key,
+        pass cursor of the last seen record as `after` to get the next
+        page.
+        """
+        raise NotImplementedError
+
+    # Daily counters
+
+    def record_deletion(self, date, chat_id, reason):
+        raise NotImplementedError
+
+    def load_day_stat(self, days):
+        """
+        Return list of (day, chat_count, msg_count, reasons) tuples for
+        last `days` days including today, oldest day goes first.
+        """
+        raise NotImplementedError
+
+    def rebuild_day_stat(self, start, end):
+        raise NotImplementedError
+
+    # Migration
+
+    def export_records(self, kind):
+        raise NotImplementedError
+
+    def import_records(self, kind, records):
+        raise NotImplementedError
@@ -0,0 +1,150 @@
+from datetime import datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ReplaceOne
+
+from project.storage.base import Storage, build_cursor, parse_cursor
+from project.write_buffer import WriteBuffer
+from project import stats
+
+
+class MongoStorage(Storage):
+    """
+    MongoDB storage. Log, failures, counters and user/chat upserts
+    go through the write buffer.
+    """
+    def __init__(self, db, write_buffer=None):
+        self.db = db
+        self.write_buffer = WriteBuffer(db, **(write_buffer or {}))
+
+    def start(self):
+        self.write_buffer.start()
+
+    def flush(self):
+        self.write_buffer.flush()
+
+    def close(self):
+        self.write_buffer.stop()
+
+    def pending(self):
+        return self.write_buffer.pending()
+
+    def load_chat_settings(self, chat_id):
+        return list(self.db.config.find(
+            {'chat_id': chat_id}, {'_id': 0, 'key': 1, 'value': 1}
+        ))
+
+    def load_all_chat_settings(self):
+        return self.db.config.find(
+            {}, {'_id': 0, 'chat_id': 1, 'key': 1, 'value': 1}
+        )
+
+    def save_chat_setting(self, chat_id, key, value):
+        self.db.config.find_one_and_update(
+            {'chat_id': chat_id, 'key': key},
+            {'$set': {'value': value, 'date': datetime.utcnow()}},
+            upsert=True,
+        )
+
+    def find_chats_changed_since(self, date):
+        return set(x['chat_id'] for x in self.db.config.find(
+            {'date': {'$gt': date}}, {'_id': 0, 'chat_id': 1}
+        ))
+
+    def _remember(self, collection, key, msg_data):
+        now = datetime.utcnow()
+        self.write_buffer.update(collection, key, {
+            '$set': {'_id': key, 'msg': msg_data, 'join_date': now},
+            '$setOnInsert': {'first_join_date': now},
+        })
+
+    def remember_user(self, user_id, msg_data):
+        self._remember('user', user_id, msg_data)
+
+    def remember_chat(self, chat_id, msg_data):
+        self._remember('chat', chat_id, msg_data)
+
+    def add_log_event(self, record):
+        self.write_buffer.insert('log', record)
+
+    def add_failure(self, record):
+        self.write_buffer.insert('fail', record)
+
+    def iter_chat_log(
+            self, chat_id, since=None, until=None, reason=None, after=None,
+            limit=None, batch_size=1000,
+        ):
+        query = {'chat_id': chat_id}
+        date_query = {}
+        if since:
+            date_query['$gte'] = since
+        if until:
+            date_query['$lt'] = until
+        if date_query:
+            query['date'] = date_query
+        if reason:
+            query['reason'] = reason
+        if after:
+            date, key = parse_cursor(after)
+            try:
+                key = ObjectId(key)
+            except InvalidId as ex:
+                raise ValueError(str(ex))
+            query['$or'] = [
+                {'date': {'$gt': date}},
+                {'date': date, '_id': {'$gt': key}},
+            ]
+        # Served by (chat_id, date, _id) index, see project.indexes
+        cursor = self.db.log.find(query).sort(
+            [('date', 1), ('_id', 1)]
+        ).batch_size(batch_size)
+        if limit:
+            cursor = cursor.limit(limit)
+        for record in cursor:
+            record['cursor'] = build_cursor(record['date'], record.pop('_id'))
+            yield record
+
+    def record_deletion(self, date, chat_id, reason):
+        stats.record_deletion(self.write_buffer, date, chat_id, reason)
+
+    def load_day_stat(self, days):
+        return stats.load_day_stat(self.db, days)
+
+    def rebuild_day_stat(self, start, end):
+        return stats.rebuild_day_stat(self.db, start, end)
+
+    def export_records(self, kind):
+        projection = {'_id': 0} if kind in ('config', 'log', 'fail') else None
+        return self.db[kind].find({}, projection)
+
+    def import_records(self, kind, records, batch=1000):
+        coll = self.db[kind]
+        items = []
+        count = 0
+        for record in records:
+            if kind in ('log', 'fail'):
+                record.pop('_id', None)
+                items.append(record)
+            elif kind == 'config':
+                items.append(ReplaceOne(
+                    {'chat_id': record['chat_id'], 'key': record['key']},
+                    record, upsert=True,
+                ))
+            else:
+                items.append(ReplaceOne(
+                    {'_id': record['_id']}, record, upsert=True,
+                ))
+            if len(items) >= batch:
+                count += self._write_batch(kind, coll, items)
+                items = []
+        if items:
+            count += self._write_batch(kind, coll, items)
+        return count
+
+    def _write_batch(self, kind, coll, items):
+        if kind in ('log', 'fail'):
+            coll.insert_many(items, ordered=False)
+        else:
+            coll.bulk_write(items, ordered=False)
+        return len(items)
@@ -0,0 +1,439 @@
+"""
+Embedded storage for single-node deployments.
+
+One SQLite file in WAL mode: readers do not block the writer, every
+thread has own connection and writes are serialized with a lock.
+"""
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import json
+import os
+import sqlite3
+import threading
+
+from project.storage.base import Storage, build_cursor, parse_cursor
+from project.stats import DAY_FORMAT, get_day_start
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS config (
+    chat_id INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    date TIMESTAMP,
+    PRIMARY KEY (chat_id, key)
+);
+CREATE INDEX IF NOT EXISTS config_date ON config (date);
+CREATE TABLE IF NOT EXISTS user (
+    id INTEGER PRIMARY KEY,
+    msg TEXT,
+    join_date TIMESTAMP,
+    first_join_date TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS chat (
+    id INTEGER PRIMARY KEY,
+    msg TEXT,
+    join_date TIMESTAMP,
+    first_join_date TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    date TIMESTAMP NOT NULL,
+    type TEXT,
+    reason TEXT,
+    chat_id INTEGER,
+    user_id INTEGER,
+    message_id INTEGER,
+    text TEXT
+);
+CREATE INDEX IF NOT EXISTS log_date_type ON log (date, type);
+CREATE INDEX IF NOT EXISTS log_chat_date ON log (chat_id, date);
+CREATE TABLE IF NOT EXISTS fail (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    date TIMESTAMP NOT NULL,
+    error TEXT,
+    traceback TEXT,
+    chat_id INTEGER,
+    user_id INTEGER,
+    message_id INTEGER
+);
+CREATE TABLE IF NOT EXISTS stat_day (
+    day TEXT PRIMARY KEY,
+    date TIMESTAMP NOT NULL,
+    messages INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS stat_day_date ON stat_day (date);
+CREATE TABLE IF NOT EXISTS stat_day_reason (
+    day TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    messages INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, reason)
+);
+CREATE TABLE IF NOT EXISTS stat_day_chat (
+    day TEXT NOT NULL,
+    chat_id INTEGER NOT NULL,
+    PRIMARY KEY (day, chat_id)
+);
+"""
+LOG_FIELDS = (
+    'date', 'type', 'reason', 'chat_id', 'user_id', 'message_id', 'text',
+)
+FAIL_FIELDS = (
+    'date', 'error', 'traceback', 'chat_id', 'user_id', 'message_id',
+)
+
+
+class SQLiteStorage(Storage):
+    def __init__(self, path):
+        self.path = path
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        conn = self.connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        with self._write_lock:
+            conn.executescript(SCHEMA)
+
+    def open_connection(self):
+        conn = sqlite3.connect(
+            self.path, detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False, isolation_level=None,
+        )
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def connection(self):
+        try:
+            return self._local.conn
+        except AttributeError:
+            conn = self._local.conn = self.open_connection()
+            return conn
+
+    def execute_write(self, sql, params=()):
+        with self._write_lock:
+            return self.connection().execute(sql, params)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Yield connection of the thread inside write transaction which
+        is rolled back on error.
+        """
+        conn = self.connection()
+        with self._write_lock:
+            conn.execute('BEGIN')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            else:
+                conn.execute('COMMIT')
+
+    def executemany_write(self, sql, rows):
+        with self.transaction() as conn:
+            conn.executemany(sql, rows)
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            del self._local.conn
+
+    # Chat settings
+
+    def load_chat_settings(self, chat_id):
+        rows = self.connection().execute(
+            'SELECT key, value FROM config WHERE chat_id = ?', (chat_id,)
+        )
+        return [{'key': key, 'value': json.loads(value)} for key, value in rows]
+
+    def load_all_chat_settings(self):
+        rows = self.connection().execute(
+            'SELECT chat_id, key, value FROM config ORDER BY chat_id'
+        )
+        for chat_id, key, value in rows:
+            yield {'chat_id': chat_id, 'key': key, 'value': json.loads(value)}
+
+    def save_chat_setting(self, chat_id, key, value):
+        self.execute_write(
+            'INSERT INTO config (chat_id, key, value, date) '
+            'VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (chat_id, key) DO UPDATE '
+            'SET value = excluded.value, date = excluded.date',
+            (chat_id, key, json.dumps(value), datetime.utcnow()),
+        )
+
+    def find_chats_changed_since(self, date):
+        rows = self.connection().execute(
+            'SELECT DISTINCT chat_id FROM config WHERE date > ?', (date,)
+        )
+        return set(x[0] for x in rows)
+
+    # Users and chats
+
+    def _remember(self, table, key, msg_data, join_date=None,
+                  first_join_date=None):
+        now = datetime.utcnow()
+        self.execute_write(
+            'INSERT INTO %s (id, msg, join_date, first_join_date) '
+            'VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (id) DO UPDATE '
+            'SET msg = excluded.msg, join_date = excluded.join_date' % table,
+            (
+                key, json.dumps(msg_data, default=str),
+                join_date or now, first_join_date or now,
+            ),
+        )
+
+    def remember_user(self, user_id, msg_data):
+        self._remember('user', user_id, msg_data)
+
+    def remember_chat(self, chat_id, msg_data):
+        self._remember('chat', chat_id, msg_data)
+
+    # Moderation log and failures
+
+    def add_log_event(self, record):
+        self.execute_write(
+            'INSERT INTO log (%s) VALUES (%s)' % (
+                ', '.join(LOG_FIELDS), ', '.join('?' for x in LOG_FIELDS),
+            ),
+            tuple(record.get(x) for x in LOG_FIELDS),
+        )
+
+    def add_failure(self, record):
+        self.execute_write(
+            'INSERT INTO fail (%s) VALUES (%s)' % (
+                ', '.join(FAIL_FIELDS), ', '.join('?' for x in FAIL_FIELDS),
+            ),
+            tuple(record.get(x) for x in FAIL_FIELDS),
+        )
+
+    def iter_chat_log(
+            self, chat_id, since=None, until=None, reason=None, after=None,
+            limit=None,
+        ):
+        # log_chat_date index includes rowid, so it serves the order
+        where = ['chat_id = ?']
+        params = [chat_id]
+        if since:
+            where.append('date >= ?')
+            params.append(since)
+        if until:
+            where.append('date < ?')
+            params.append(until)
+        if reason:
+            where.append('reason = ?')
+            params.append(reason)
+        if after:
+            date, key = parse_cursor(after)
+            where.append('(date, id) > (?, ?)')
+            params.extend((date, int(key)))
+        sql = 'SELECT id, %s FROM log WHERE %s ORDER BY date, id' % (
+            ', '.join(LOG_FIELDS), ' AND '.join(where),
+        )
+        if limit:
+            sql += ' LIMIT %d' % limit
+        # Separate connection: rows are fetched lazily and the thread
+        # could use its connection for other queries meanwhile
+        conn = self.open_connection()
+        try:
+            for row in conn.execute(sql, params):
+                record = dict(zip(LOG_FIELDS, row[1:]))
+                record['cursor'] = build_cursor(record['date'], row[0])
+                yield record
+        finally:
+            conn.close()
+
+    # Daily counters
+
+    def record_deletion(self, date, chat_id, reason):
+        day = get_day_start(date)
+        key = day.strftime(DAY_FORMAT)
+        with self.transaction() as conn:
+            conn.execute(
+                'INSERT INTO stat_day (day, date, messages) VALUES (?, ?, 1) '
+                'ON CONFLICT (day) DO UPDATE SET messages = messages + 1',
+                (key, day),
+            )
+            conn.execute(
+                'INSERT INTO stat_day_reason (day, reason, messages) '
+                'VALUES (?, ?, 1) ON CONFLICT (day, reason) '
+                'DO UPDATE SET messages = messages + 1',
+                (key, reason),
+            )
+            conn.execute(
+                'INSERT OR IGNORE INTO stat_day_chat (day, chat_id) '
+                'VALUES (?, ?)', (key, chat_id),
+            )
+
+    def load_day_stat(self, days):
+        conn = self.connection()
+        today = get_day_start(datetime.utcnow())
+        start = today - timedelta(days=days - 1)
+        start_key = start.strftime(DAY_FORMAT)
+        messages = dict(conn.execute(
+            'SELECT day, messages FROM stat_day WHERE day >= ?', (start_key,)
+        ))
+        chats = dict(conn.execute(
+            'SELECT day, COUNT(*) FROM stat_day_chat WHERE day >= ? '
+            'GROUP BY day', (start_key,)
+        ))
+        reasons = {}
+        rows = conn.execute(
+            'SELECT day, reason, messages FROM stat_day_reason '
+            'WHERE day >= ?', (start_key,)
+        )
+        for day, reason, count in rows:
+            reasons.setdefault(day, {})[reason] = count
+        ret = []
+        for idx in range(days):
+            day = (start + timedelta(days=idx)).strftime(DAY_FORMAT)
+            ret.append((
+                day, chats.get(day, 0), messages.get(day, 0),
+                reasons.get(day, {}),
+            ))
+        return ret
+
+    def rebuild_day_stat(self, start, end):
+        start = get_day_start(start)
+        day_expr = "strftime('%Y-%m-%d', date)"
+        with self.transaction() as conn:
+            for table in ('stat_day', 'stat_day_reason', 'stat_day_chat'):
+                conn.execute(
+                    'DELETE FROM %s WHERE day >= ? AND day < ?' % table,
+                    (start.strftime(DAY_FORMAT), end.strftime(DAY_FORMAT)),
+                )
+            where = "type = 'delete' AND date >= ? AND date < ?"
+            conn.execute(
+                'INSERT INTO stat_day (day, date, messages) '
+                'SELECT %s, MIN(date), COUNT(*) FROM log WHERE %s '
+                'GROUP BY 1' % (day_expr, where), (start, end),
+            )
+            conn.execute(
+                'INSERT INTO stat_day_reason (day, reason, messages) '
+                'SELECT %s, reason, COUNT(*) FROM log WHERE %s '
+                'GROUP BY 1, 2' % (day_expr, where), (start, end),
+            )
+            conn.execute(
+                'INSERT INTO stat_day_chat (day, chat_id) '
+                'SELECT DISTINCT %s, chat_id FROM log WHERE %s' % (
+                    day_expr, where,
+                ), (start, end),
+            )
+            # Day start instead of the time of the first event
+            conn.execute(
+                "UPDATE stat_day SET date = datetime(day) "
+                "WHERE day >= ? AND day < ?",
+                (start.strftime(DAY_FORMAT), end.strftime(DAY_FORMAT)),
+            )
+            count = conn.execute(
+                'SELECT COUNT(*) FROM stat_day WHERE day >= ? AND day < ?',
+                (start.strftime(DAY_FORMAT), end.strftime(DAY_FORMAT)),
+            ).fetchone()[0]
+        return count
+
+    # Migration
+
+    def export_records(self, kind):
+        conn = self.connection()
+        if kind == 'config':
+            rows = conn.execute('SELECT chat_id, key, value, date FROM config')
+            for chat_id, key, value, date in rows:
+                yield {
+                    'chat_id': chat_id, 'key': key,
+                    'value': json.loads(value), 'date': date,
+                }
+        elif kind in ('user', 'chat'):
+            rows = conn.execute(
+                'SELECT id, msg, join_date, first_join_date FROM %s' % kind
+            )
+            for key, msg, join_date, first_join_date in rows:
+                yield {
+                    '_id': key, 'msg': json.loads(msg) if msg else None,
+                    'join_date': join_date,
+                    'first_join_date': first_join_date,
+                }
+        elif kind in ('log', 'fail'):
+            fields = LOG_FIELDS if kind == 'log' else FAIL_FIELDS
+            rows = conn.execute('SELECT %s FROM %s ORDER BY id' % (
+                ', '.join(fields), kind,
+            ))
+            for row in rows:
+                yield dict(zip(fields, row))
+        elif kind == 'stat_day':
+            days = conn.execute('SELECT day, date, messages FROM stat_day')
+            for day, date, messages in days.fetchall():
+                reasons = dict(conn.execute(
+                    'SELECT reason, messages FROM stat_day_reason '
+                    'WHERE day = ?', (day,)
+                ))
+                chat_ids = [x[0] for x in conn.execute(
+                    'SELECT chat_id FROM stat_day_chat WHERE day = ?', (day,)
+                )]
+                yield {
+                    '_id': day, 'date': date, 'messages': messages,
+                    'reasons': reasons, 'chat_ids': chat_ids,
+                }
+        else:
+            raise ValueError('Unknown record kind: %s' % kind)
+
+    def import_records(self, kind, records):
+        count = 0
+        if kind == 'config':
+            rows = (
+                (
+                    x['chat_id'], x['key'], json.dumps(x['value']),
+                    x.get('date'),
+                ) for x in records
+            )
+            sql = 'INSERT OR REPLACE INTO config VALUES (?, ?, ?, ?)'
+        elif kind in ('user', 'chat'):
+            rows = (
+                (
+                    x['_id'], json.dumps(x.get('msg'), default=str),
+                    x.get('join_date'), x.get('first_join_date'),
+                ) for x in records
+            )
+            sql = 'INSERT OR REPLACE INTO %s VALUES (?, ?, ?, ?)' % kind
+        elif kind in ('log', 'fail'):
+            fields = LOG_FIELDS if kind == 'log' else FAIL_FIELDS
+            rows = (tuple(x.get(y) for y in fields) for x in records)
+            sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+                kind, ', '.join(fields), ', '.join('?' for x in fields),
+            )
+        elif kind == 'stat_day':
+            for record in records:
+                day = record['_id']
+                self.execute_write(
+                    'INSERT OR REPLACE INTO stat_day VALUES (?, ?, ?)',
+                    (day, record['date'], record.get('messages', 0)),
+                )
+                self.executemany_write(
+                    'INSERT OR REPLACE INTO stat_day_reason VALUES (?, ?, ?)',
+                    [
+                        (day, reason, value) for reason, value
+                        in record.get('reasons', {}).items()
+                    ],
+                )
+                self.executemany_write(
+                    'INSERT OR IGNORE INTO stat_day_chat VALUES (?, ?)',
+                    [(day, x) for x in record.get('chat_ids', [])],
+                )
+                count += 1
+            return count
+        else:
+            raise ValueError('Unknown record kind: %s' % kind)
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= 1000:
+                self.executemany_write(sql, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            self.executemany_write(sql, batch)
+            count += len(batch)
+        return count
@@ -0,0 +1,62 @@
+"""
+HTTP transport of Bot API calls made by python-telegram-bot.
+
+Default request object of the library keeps one connection and opens
+a new one (with new TLS handshake) for every call made in parallel.
+PooledRequest keeps `pool_size` keep-alive connections, threads wait
+for a free connection instead of opening extra ones, and each Bot API
+method could have own read timeout.
+"""
+import time
+
+from telegram.utils.request import Request
+
+from project.metrics import METRICS
+
+
+class PooledRequest(Request):
+    __slots__ = ('method_timeouts',)
+
+    def __init__(
+            self, pool_size=32, connect_timeout=5.0, read_timeout=10.0,
+            method_timeouts=None, **kwargs
+        ):
+        super(PooledRequest, self).__init__(
+            con_pool_size=pool_size, connect_timeout=connect_timeout,
+            read_timeout=read_timeout, **kwargs
+        )
+        self.method_timeouts = method_timeouts or {}
+        # Wait for free connection instead of opening one which is
+        # closed right after the call
+        self._con_pool.connection_pool_kw['block'] = True
+
+    def post(self, url, data, timeout=None):
+        method = url.rsplit('/', 1)[-1]
+        if timeout is None:
+            timeout = self.method_timeouts.get(method)
+        started = time.time()
+        try:
+            return super(PooledRequest, self).post(url, data, timeout=timeout)
+        finally:
+            METRICS.observe(
+                'bot_api_http_seconds', time.time() - started, method=method
+            )
+
+
+def install_transport(bot, config):
+    """
+    Replace request object of telegram.Bot with PooledRequest. Objects
+    which are not telegram.Bot (e.g. fakes of benchmark) are skipped.
+    """
+    request = getattr(bot, '_request', None)
+    if request is None or isinstance(request, PooledRequest):
+        return
+    request.stop()
+    bot._request = PooledRequest(
+        pool_size=config['pool_size'],
+        connect_timeout=config['connect_timeout'],
+        read_timeout=config['read_timeout'],
+        method_timeouts=config['method_timeouts'],
+    )
+    if config.get('base_url'):
+        bot.base_url = '%s%s' % (config['base_url'], bot.token)
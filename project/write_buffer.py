@@ -0,0 +1,212 @@
+from traceback import format_exc
+import logging
+import threading
+
+from bson import json_util
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+DUPLICATE_KEY_CODE = 11000
+
+
+def merge_update(ops, new_ops):
+    for op, fields in new_ops.items():
+        target = ops.setdefault(op, {})
+        if op == '$setOnInsert':
+            for key, value in fields.items():
+                target.setdefault(key, value)
+        elif op == '$inc':
+            for key, value in fields.items():
+                target[key] = target.get(key, 0) + value
+        elif op == '$addToSet':
+            for key, value in fields.items():
+                if isinstance(value, dict) and '$each' in value:
+                    values = value['$each']
+                else:
+                    values = [value]
+                items = target.setdefault(key, {'$each': []})['$each']
+                items.extend(x for x in values if x not in items)
+        else:
+            target.update(fields)
+
+
+class WriteBuffer(object):
+    """
+    Collects inserts and upserts and writes them to database in bulk.
+
+    Buffer is flushed by background thread every `interval` seconds
+    or as soon as `size` operations are pending. Upserts of the same
+    document are merged into one operation.
+
+    Operations failed with database error are retried on next flushes,
+    after `max_retries` attempts they are appended to `fallback_path`
+    file (if set) which could be loaded with `load_fallback`.
+    """
+    def __init__(
+            self, db, size=500, interval=1.0, max_retries=10,
+            fallback_path=None,
+        ):
+        self.db = db
+        self.size = size
+        self.interval = interval
+        self.max_retries = max_retries
+        self.fallback_path = fallback_path
+        self._inserts = {}
+        self._updates = {}
+        # [attempt, collection, docs, updates] of failed writes,
+        # updates are (key, ops) pairs
+        self._retries = []
+        self._count = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            self._thread = threading.Thread(
+                target=self._work, name='write-buffer'
+            )
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        # No more flushes to retry on
+        retries, self._retries = self._retries, []
+        for attempt, collection, docs, updates in retries:
+            self.write_fallback(collection, docs, updates)
+
+    def insert(self, collection, doc):
+        with self._lock:
+            self._inserts.setdefault(collection, []).append(doc)
+            self._count += 1
+            if self._count >= self.size:
+                self._wakeup.set()
+
+    def update(self, collection, key, ops):
+        with self._lock:
+            updates = self._updates.setdefault(collection, {})
+            try:
+                merge_update(updates[key], ops)
+            except KeyError:
+                updates[key] = {}
+                merge_update(updates[key], ops)
+                self._count += 1
+                if self._count >= self.size:
+                    self._wakeup.set()
+
+    def pending(self):
+        return self._count + sum(
+            len(x[2]) + len(x[3]) for x in list(self._retries)
+        )
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                inserts, self._inserts = self._inserts, {}
+                updates, self._updates = self._updates, {}
+                self._count = 0
+            batches, self._retries = self._retries, []
+            for collection, docs in inserts.items():
+                batches.append([0, collection, docs, []])
+            for collection, items in updates.items():
+                batches.append([0, collection, [], list(items.items())])
+            for batch in batches:
+                self.write_batch(*batch)
+
+    def write_batch(self, attempt, collection, docs, updates):
+        # Only failed items are retried. Inserted docs have _id set by
+        # pymongo, so an insert repeated after lost reply is a duplicate
+        # key error which is ignored. Upserts are not idempotent, one
+        # repeated after lost reply could be applied twice.
+        if docs:
+            try:
+                self.db[collection].insert_many(docs, ordered=False)
+            except BulkWriteError as ex:
+                docs = [
+                    docs[x['index']] for x in ex.details['writeErrors']
+                    if x['code'] != DUPLICATE_KEY_CODE
+                ]
+                if docs:
+                    logging.error(format_exc())
+            except Exception:
+                logging.error(format_exc())
+            else:
+                docs = []
+        if updates:
+            ops = [
+                UpdateOne({'_id': key}, item_ops, upsert=True)
+                for key, item_ops in updates
+            ]
+            try:
+                self.db[collection].bulk_write(ops, ordered=False)
+            except BulkWriteError as ex:
+                updates = [
+                    updates[x['index']] for x in ex.details['writeErrors']
+                ]
+                logging.error(format_exc())
+            except Exception:
+                logging.error(format_exc())
+            else:
+                updates = []
+        if not docs and not updates:
+            return
+        if attempt + 1 < self.max_retries:
+            self._retries.append([attempt + 1, collection, docs, updates])
+        else:
+            self.write_fallback(collection, docs, updates)
+
+    def write_fallback(self, collection, docs, updates):
+        if not self.fallback_path:
+            logging.error(
+                'Dropped %d inserts and %d updates of %s after %d attempts'
+                % (len(docs), len(updates), collection, self.max_retries)
+            )
+            return
+        with open(self.fallback_path, 'a') as out:
+            for doc in docs:
+                out.write(json_util.dumps({
+                    'collection': collection, 'doc': doc,
+                }) + '\n')
+            for key, ops in updates:
+                out.write(json_util.dumps({
+                    'collection': collection, 'key': key, 'ops': ops,
+                }) + '\n')
+
+    def _work(self):
+        while self._running:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+
+def load_fallback(db, path):
+    """
+    Write operations saved to fallback file of WriteBuffer, return
+    their number.
+    """
+    count = 0
+    with open(path) as inp:
+        for line in inp:
+            item = json_util.loads(line)
+            coll = db[item['collection']]
+            doc = item.get('doc')
+            if doc is None:
+                coll.update_one({'_id': item['key']}, item['ops'], upsert=True)
+            elif '_id' in doc:
+                # Could be written already by an attempt with lost reply
+                coll.replace_one({'_id': doc['_id']}, doc, upsert=True)
+            else:
+                coll.insert_one(doc)
+            count += 1
+    return count
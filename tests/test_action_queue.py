@@ -0,0 +1,117 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('telegram')
+
+from telegram.error import RetryAfter
+
+from project.action_queue import ActionQueue, TokenBucket
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=1, burst=2)
+    now = bucket.update_time
+    assert bucket.consume(now) == 0
+    assert bucket.consume(now) == 0
+    assert bucket.consume(now) == pytest.approx(1)
+    assert bucket.consume(now + 1) == 0
+
+
+def test_jobs_of_one_chat_run_in_order():
+    queue = ActionQueue(workers=4)
+    done = []
+    for idx in range(20):
+        queue.put(-1, done.append, args=(idx,), chat_limited=False)
+    assert queue.drain(5) == 0
+    queue.stop()
+    assert done == list(range(20))
+
+
+def test_unlimited_jobs_do_not_wait_for_chat_tokens():
+    queue = ActionQueue(workers=2, chat_rate=1, chat_burst=1)
+    done = []
+    event = threading.Event()
+    # Takes the only chat token and keeps the lane busy
+    queue.put(-1, event.wait, args=(5,))
+    queue.put(-1, done.append, args=('notify',))
+    queue.put(-1, done.append, args=('delete',), chat_limited=False)
+    event.set()
+    time.sleep(0.3)
+    assert done == ['delete']
+    assert queue.drain(5) == 0
+    queue.stop()
+    assert done == ['delete', 'notify']
+
+
+def test_chat_is_limited_when_lane_drains_between_jobs():
+    queue = ActionQueue(workers=2, chat_rate=10, chat_burst=2)
+    start = time.time()
+    for idx in range(7):
+        queue.put(-1, lambda: None)
+        assert queue.drain(5) == 0
+    queue.stop()
+    # Burst of 2 jobs, then 10 jobs per second
+    assert time.time() - start >= 0.45
+
+
+def test_full_buckets_of_idle_chats_are_dropped():
+    queue = ActionQueue(workers=1, chat_rate=100, chat_burst=1)
+    queue.put(-1, lambda: None)
+    assert queue.drain(5) == 0
+    time.sleep(0.05)
+    queue.put(-2, lambda: None)
+    assert queue.drain(5) == 0
+    queue.stop()
+    assert list(queue._chat_buckets) == [-2]
+
+
+def test_retry_after():
+    queue = ActionQueue(workers=1, retry_backoff=0.01)
+    calls = []
+
+    def func():
+        calls.append(time.time())
+        if len(calls) < 3:
+            raise RetryAfter(0)
+    queue.put(-1, func)
+    assert queue.drain(5) == 0
+    queue.stop()
+    assert len(calls) == 3
+
+
+def test_job_dropped_after_max_retries():
+    queue = ActionQueue(workers=1, max_retries=2, retry_backoff=0.01)
+    calls = []
+
+    def func():
+        calls.append(1)
+        raise RetryAfter(0)
+    queue.put(-1, func)
+    assert queue.drain(5) == 0
+    queue.stop()
+    assert len(calls) == 3
+
+
+def test_stop_drains_queue():
+    queue = ActionQueue(workers=1, drain_timeout=5)
+    done = []
+    event = threading.Event()
+    queue.put(-1, event.wait, args=(5,))
+    queue.put(-1, done.append, args=(1,))
+    event.set()
+    queue.stop()
+    assert done == [1]
+
+
+def test_stop_gives_up_after_drain_timeout():
+    queue = ActionQueue(workers=1, drain_timeout=0.1)
+    event = threading.Event()
+    queue.put(-1, event.wait, args=(5,))
+    queue.put(-1, lambda: None)
+    start = time.time()
+    queue.stop(timeout=0.1)
+    assert time.time() - start < 1
+    assert queue.qsize() == 2
+    event.set()
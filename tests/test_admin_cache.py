@@ -0,0 +1,162 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from project.admin_cache import AdminCache
+
+
+class Loader(object):
+    def __init__(self, delay=0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, chat_id):
+        with self._lock:
+            self.calls.append(chat_id)
+            count = len(self.calls)
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError('API error')
+        return set([count])
+
+
+def run_threads(count, func):
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(func()))
+        for _ in range(count)
+    ]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    return results
+
+
+def test_single_flight():
+    cache = AdminCache()
+    loader = Loader(delay=0.1)
+    results = run_threads(10, lambda: cache.get(-1, loader))
+    assert loader.calls == [-1]
+    assert results == [set([1])] * 10
+
+
+def test_stale_entry_is_served_while_refreshed():
+    cache = AdminCache(ttl=0.05)
+    loader = Loader(delay=0.1)
+    assert cache.get(-1, loader) == set([1])
+    time.sleep(0.1)
+    started = time.time()
+    assert cache.get(-1, loader) == set([1])
+    assert cache.get(-1, loader) == set([1])
+    assert time.time() - started < 0.05
+    time.sleep(0.2)
+    assert loader.calls == [-1, -1]
+    assert cache.get(-1, loader) == set([2])
+
+
+def test_failed_stale_refresh_keeps_old_entry():
+    cache = AdminCache(ttl=0.05)
+    assert cache.get(-1, Loader()) == set([1])
+    time.sleep(0.1)
+    assert cache.get(-1, Loader(fail=True)) == set([1])
+    time.sleep(0.05)
+    assert cache.get(-1, Loader()) == set([1])
+
+
+def test_waiter_loads_itself_when_refresh_fails():
+    cache = AdminCache()
+    failing = Loader(delay=0.1, fail=True)
+    errors = []
+
+    def owner():
+        try:
+            cache.get(-1, failing)
+        except RuntimeError as ex:
+            errors.append(ex)
+    th = threading.Thread(target=owner)
+    th.start()
+    time.sleep(0.02)
+    loader = Loader()
+    assert cache.get(-1, loader) == set([1])
+    th.join()
+    assert len(errors) == 1
+    assert loader.calls == [-1]
+
+
+def test_lru_eviction():
+    cache = AdminCache(size=2)
+    loader = Loader()
+    cache.get(-1, loader)
+    cache.get(-2, loader)
+    cache.get(-1, loader)
+    cache.get(-3, loader)
+    assert len(cache) == 2
+    assert loader.calls == [-1, -2, -3]
+    cache.get(-1, loader)
+    assert loader.calls == [-1, -2, -3]
+    cache.get(-2, loader)
+    assert loader.calls == [-1, -2, -3, -2]
+
+
+def test_invalidate():
+    cache = AdminCache()
+    loader = Loader()
+    assert cache.get(-1, loader) == set([1])
+    cache.invalidate(-1)
+    assert cache.get(-1, loader) == set([2])
+    cache.invalidate(-5)
+
+
+class AsyncLoader(object):
+    def __init__(self, delay=0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.calls = []
+
+    async def __call__(self, chat_id):
+        self.calls.append(chat_id)
+        count = len(self.calls)
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError('API error')
+        return set([count])
+
+
+def test_async_single_flight():
+    async def main():
+        cache = AdminCache()
+        loader = AsyncLoader(delay=0.05)
+        results = await asyncio.gather(*[
+            cache.get_async(-1, loader) for _ in range(10)
+        ])
+        assert loader.calls == [-1]
+        assert results == [set([1])] * 10
+    asyncio.run(main())
+
+
+def test_async_stale_entry_is_served_while_refreshed():
+    async def main():
+        cache = AdminCache(ttl=0.05)
+        loader = AsyncLoader(delay=0.05)
+        assert await cache.get_async(-1, loader) == set([1])
+        await asyncio.sleep(0.1)
+        assert await cache.get_async(-1, loader) == set([1])
+        assert await cache.get_async(-1, loader) == set([1])
+        await asyncio.sleep(0.1)
+        assert loader.calls == [-1, -1]
+        assert await cache.get_async(-1, loader) == set([2])
+    asyncio.run(main())
+
+
+def test_async_failed_load():
+    async def main():
+        cache = AdminCache()
+        with pytest.raises(RuntimeError):
+            await cache.get_async(-1, AsyncLoader(fail=True))
+        assert await cache.get_async(-1, AsyncLoader()) == set([1])
+    asyncio.run(main())
@@ -0,0 +1,38 @@
+import os
+
+from project.archive import ArchiveWriter, iter_archive
+
+
+def write_records(writer, start, count):
+    for idx in range(start, start + count):
+        writer.write('log', {'idx': idx, 'text': 'message %d' % idx})
+
+
+def test_read_while_writer_is_open(tmpdir):
+    path = str(tmpdir)
+    writer = ArchiveWriter(path, segment_size=1000)
+    write_records(writer, 0, 100)
+    # Rotated segments are closed, the last one is still open
+    assert len(os.listdir(path)) > 1
+    records = list(iter_archive(path))
+    idxs = [x['record']['idx'] for x in records]
+    assert idxs == list(range(len(idxs)))
+    assert len(idxs) >= 50
+    writer.close()
+    assert len(list(iter_archive(path))) == 100
+
+
+def test_truncated_segment(tmpdir):
+    path = str(tmpdir)
+    writer = ArchiveWriter(path)
+    for idx in range(5000):
+        writer.write('log', {'idx': idx, 'data': os.urandom(16).hex()})
+    writer.close()
+    filename = os.path.join(path, os.listdir(path)[0])
+    with open(filename, 'rb') as inp:
+        data = inp.read()
+    with open(filename, 'wb') as out:
+        out.write(data[:len(data) // 2])
+    idxs = [x['record']['idx'] for x in iter_archive(path)]
+    assert 0 < len(idxs) < 5000
+    assert idxs == list(range(len(idxs)))
@@ -0,0 +1,106 @@
+from datetime import datetime
+import csv
+import json
+
+import pytest
+
+from project.audit import (
+    build_audit_token, check_audit_token, iter_chat_audit, iter_csv,
+    iter_jsonl, parse_audit_date, render_audit,
+)
+
+
+class FakeStorage(object):
+    def __init__(self, count):
+        self.records = [{
+            'date': datetime(2020, 1, 1, 0, 0, idx),
+            'type': 'sticker',
+            'reason': 'sticker' if idx % 2 else 'link',
+            'user_id': 100,
+            'message_id': idx,
+            'text': 'text, "%d"' % idx,
+            'cursor': '%05d' % idx,
+        } for idx in range(count)]
+        self.requests = []
+
+    def iter_chat_log(
+            self, chat_id, since=None, until=None, reason=None, after=None,
+            limit=None,
+        ):
+        self.requests.append((after, limit))
+        records = [
+            x for x in self.records
+            if (after is None or x['cursor'] > after)
+            and (reason is None or x['reason'] == reason)
+        ]
+        return iter(records[:limit])
+
+
+def test_pages():
+    storage = FakeStorage(25)
+    records = list(iter_chat_audit(storage, -1, page_size=10))
+    assert [x['message_id'] for x in records] == list(range(25))
+    assert storage.requests == [
+        (None, 10), ('00009', 10), ('00019', 10),
+    ]
+
+
+def test_limit_and_after():
+    storage = FakeStorage(25)
+    records = list(iter_chat_audit(
+        storage, -1, after='00004', limit=12, page_size=10,
+    ))
+    assert [x['message_id'] for x in records] == list(range(5, 17))
+    assert storage.requests == [('00004', 10), ('00014', 2)]
+
+
+def test_csv():
+    storage = FakeStorage(3)
+    lines = ''.join(iter_csv(iter_chat_audit(storage, -1)))
+    rows = list(csv.reader(lines.splitlines()))
+    assert rows[0] == [
+        'date', 'type', 'reason', 'user_id', 'message_id', 'text', 'cursor',
+    ]
+    assert rows[2] == [
+        '2020-01-01T00:00:01', 'sticker', 'sticker', '100', '1',
+        'text, "1"', '00001',
+    ]
+    assert len(rows) == 4
+
+
+def test_jsonl():
+    storage = FakeStorage(2)
+    lines = list(iter_jsonl(iter_chat_audit(storage, -1)))
+    assert all(x.endswith('\n') for x in lines)
+    items = [json.loads(x) for x in lines]
+    assert items[1] == {
+        'date': '2020-01-01T00:00:01', 'type': 'sticker',
+        'reason': 'sticker', 'user_id': 100, 'message_id': 1,
+        'text': 'text, "1"', 'cursor': '00001',
+    }
+    assert list(render_audit(storage.records, 'jsonl')) == lines
+    with pytest.raises(ValueError):
+        render_audit(storage.records, 'xml')
+
+
+def test_parse_audit_date():
+    assert parse_audit_date('2020-01-02') == datetime(2020, 1, 2)
+    assert parse_audit_date('2020-01-02T03:04:05') == (
+        datetime(2020, 1, 2, 3, 4, 5)
+    )
+    with pytest.raises(ValueError):
+        parse_audit_date('yesterday')
+
+
+def test_token():
+    token = build_audit_token('secret', -1, 1000)
+    assert check_audit_token('secret', -1, token, now=999)
+    assert not check_audit_token('secret', -1, token, now=1001)
+    assert not check_audit_token('secret', -2, token, now=999)
+    assert not check_audit_token('other', -1, token, now=999)
+    assert not check_audit_token(None, -1, token, now=999)
+    assert not check_audit_token('secret', -1, '', now=999)
+    assert not check_audit_token('secret', -1, 'garbage', now=999)
+    # Expiry time is signed
+    forged = '2000' + token[len('1000'):]
+    assert not check_audit_token('secret', -1, forged, now=999)
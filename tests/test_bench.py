@@ -0,0 +1,30 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+telegram = pytest.importorskip('telegram')
+pytest.importorskip('tgram')
+
+from bench.traffic import PROFILES, generate
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.mark.parametrize('profile', PROFILES)
+def test_updates_are_parsed(profile):
+    for data in generate(profile, 300, chat_count=10):
+        update = telegram.Update.de_json(data, None)
+        assert update.message.message_id == data['message']['message_id']
+
+
+@pytest.mark.parametrize('profile', PROFILES)
+def test_replay(profile):
+    output = subprocess.check_output([
+        sys.executable, '-m', 'bench.replay', '--profile', profile,
+        '--updates', '200', '--chats', '10', '--json',
+    ], cwd=ROOT_DIR)
+    result = json.loads(output.decode('utf-8'))
+    assert result['updates'] == 200
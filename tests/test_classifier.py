@@ -0,0 +1,62 @@
+from project.classifier import CLASSIFIER
+from project.policy import MSG_TYPE_BITS, build_type_mask
+
+from tests.utils import FakeMessage, Obj, url_entity
+
+
+def test_not_blocked_types_are_not_reported():
+    msg = FakeMessage(sticker=Obj(file_id='x'))
+    assert CLASSIFIER.classify(msg, 0) is None
+    assert CLASSIFIER.classify(msg, build_type_mask(['photo'])) is None
+    assert CLASSIFIER.classify(msg, build_type_mask(['sticker'])) == (
+        'sticker'
+    )
+
+
+def test_first_blocked_type_is_reason():
+    text = 'see http://example.com @someone'
+    msg = FakeMessage(text=text, entities=[
+        url_entity(text, 'http://example.com'),
+        {'type': 'mention', 'offset': text.index('@'), 'length': 8},
+    ])
+    mask = build_type_mask(['link', 'mention'])
+    assert CLASSIFIER.classify(msg, mask) == 'link'
+    assert CLASSIFIER.classify(msg, build_type_mask(['mention'])) == (
+        'mention'
+    )
+
+
+def test_gif_and_attachment():
+    gif = FakeMessage(document=Obj(mime_type='video/mp4'))
+    doc = FakeMessage(document=Obj(mime_type='application/pdf'))
+    mask = build_type_mask(['gif', 'attachment'])
+    assert CLASSIFIER.classify(gif, mask) == 'gif'
+    assert CLASSIFIER.classify(doc, mask) == 'attachment'
+
+
+def test_bot_joined():
+    msg = FakeMessage(new_chat_members=[
+        Obj(id=2, is_bot=False), Obj(id=3, is_bot=True),
+    ])
+    mask = build_type_mask(['bot', 'user_joined_msg'])
+    assert CLASSIFIER.classify(msg, mask) == 'bot'
+    assert CLASSIFIER.classify(msg, build_type_mask(['user_joined_msg'])) == (
+        'user_joined_msg'
+    )
+
+
+def test_find_mask_reports_all_content_types():
+    text = 'http://example.com'
+    msg = FakeMessage(
+        caption=text, caption_entities=[url_entity(text, text)],
+        photo=[Obj(file_id='x')],
+    )
+    assert CLASSIFIER.find_mask(msg) == build_type_mask(['link', 'photo'])
+    assert CLASSIFIER.find_types(msg) == set(['link', 'photo'])
+
+
+def test_find_mask_does_not_count_rate_types():
+    msg = FakeMessage(chat_id=-1007)
+    for _ in range(100):
+        assert CLASSIFIER.find_mask(msg) == 0
+    assert CLASSIFIER.classify(msg, MSG_TYPE_BITS['flood']) is None
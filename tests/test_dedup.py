@@ -0,0 +1,67 @@
+import time
+
+import pytest
+
+pytest.importorskip('pymongo')
+
+from pymongo.errors import DuplicateKeyError
+
+from project.dedup import Deduplicator, TimedKeySet
+
+
+class FakeCollection(object):
+    def __init__(self):
+        self.ids = set()
+        self.inserts = 0
+
+    def insert_one(self, doc):
+        self.inserts += 1
+        if doc['_id'] in self.ids:
+            raise DuplicateKeyError('duplicate')
+        self.ids.add(doc['_id'])
+
+
+def test_timed_key_set():
+    keys = TimedKeySet(ttl=0.05)
+    assert keys.add('a')
+    assert not keys.add('a')
+    assert keys.add('b')
+    time.sleep(0.1)
+    assert keys.add('a')
+    assert len(keys) == 1
+
+
+def test_timed_key_set_size():
+    keys = TimedKeySet(size=2)
+    assert keys.add('a')
+    assert keys.add('b')
+    assert keys.add('c')
+    assert len(keys) == 2
+    # Oldest key is forgotten
+    assert keys.add('a')
+    assert not keys.add('c')
+
+
+def test_local_deduplicator():
+    dedup = Deduplicator()
+    assert dedup.is_new_update(1)
+    assert not dedup.is_new_update(1)
+    assert dedup.claim_action('delete', -1, 1)
+    assert not dedup.claim_action('delete', -1, 1)
+    assert dedup.claim_action('delete', -1, 2)
+    assert dedup.claim_action('notify', -1, 1)
+
+
+def test_shared_deduplicator():
+    coll = FakeCollection()
+    db = {'dedup': coll}
+    first = Deduplicator(db, shared=True)
+    second = Deduplicator(db, shared=True)
+    assert first.is_new_update(1)
+    # Local duplicate does not query database
+    assert not first.is_new_update(1)
+    assert coll.inserts == 1
+    # Other process has seen the update
+    assert not second.is_new_update(1)
+    assert coll.inserts == 2
+    assert coll.ids == set(['u:1'])
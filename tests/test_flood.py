@@ -0,0 +1,57 @@
+from project.flood import RateTracker
+
+from tests.utils import FakeMessage
+
+
+def test_limit_inside_window():
+    tracker = RateTracker(3, 10)
+    assert not tracker.hit('a', now=0)
+    assert not tracker.hit('a', now=1)
+    assert tracker.hit('a', now=2)
+    assert tracker.hit('a', now=3)
+    assert not tracker.hit('b', now=3)
+
+
+def test_events_outside_window_are_not_counted():
+    tracker = RateTracker(3, 10)
+    tracker.hit('a', now=0)
+    tracker.hit('a', now=1)
+    assert not tracker.hit('a', now=20)
+    assert not tracker.hit('a', now=21)
+    assert tracker.hit('a', now=22)
+
+
+def test_count():
+    tracker = RateTracker(10, 60)
+    assert not tracker.hit('chat', count=5, now=0)
+    assert tracker.hit('chat', count=5, now=1)
+    tracker = RateTracker(10, 60)
+    assert tracker.hit('chat', count=50, now=0)
+
+
+def test_least_recently_active_keys_are_forgotten():
+    tracker = RateTracker(2, 10, size=2)
+    tracker.hit('a', now=0)
+    tracker.hit('b', now=0)
+    tracker.hit('a', now=1)
+    tracker.hit('c', now=1)
+    assert len(tracker) == 2
+    # "a" is remembered, "b" is forgotten
+    assert tracker.hit('a', now=2)
+    assert not tracker.hit('b', now=2)
+
+
+def test_flood_is_counted_before_matcher():
+    from project.classifier import CLASSIFIER, FLOOD_TRACKER
+    from project.patterns import ChatMatcher
+    from project.policy import MSG_TYPE_BITS
+
+    matcher = ChatMatcher({'blocked_keywords': ['spam']})
+    mask = MSG_TYPE_BITS['flood']
+    msg = FakeMessage(chat_id=-1018, text='spam')
+    reasons = [
+        CLASSIFIER.classify(msg, mask, matcher)
+        for _ in range(FLOOD_TRACKER.limit)
+    ]
+    assert reasons[:-1] == ['keyword'] * (FLOOD_TRACKER.limit - 1)
+    assert reasons[-1] == 'flood'
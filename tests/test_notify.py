@@ -0,0 +1,84 @@
+import threading
+import time
+
+from project.notify import DeletionSummary, NotificationAggregator
+
+
+def test_summary():
+    summary = DeletionSummary()
+    summary.add(1, 'link', 'Deleted link from User1')
+    assert summary.render() == 'Deleted link from User1'
+    summary.add(2, 'link', 'Deleted link from User2')
+    summary.add(1, 'sticker', 'Deleted sticker from User1')
+    assert summary.render() == (
+        'Deleted 3 messages from 2 users: link ×2, sticker ×1'
+    )
+
+
+def test_merged():
+    first = DeletionSummary()
+    first.add(1, 'link', 'first')
+    second = DeletionSummary()
+    second.add(2, 'link', 'second')
+    second.add(2, 'photo', 'second')
+    merged = first.merged(second)
+    assert merged.messages == 3
+    assert merged.user_ids == set([1, 2])
+    assert merged.reasons == {'link': 2, 'photo': 1}
+    assert merged.first_notice == 'first'
+    # Originals are not changed
+    assert first.messages == 1
+
+
+def test_notices_of_chat_are_flushed_together():
+    aggregator = NotificationAggregator(window=0.1)
+    flushed = []
+    done = threading.Event()
+
+    def flush(chat_id, summary):
+        flushed.append((chat_id, summary.messages))
+        if len(flushed) == 2:
+            done.set()
+    for idx in range(3):
+        aggregator.add(-1, idx, 'link', 'notice', flush)
+    aggregator.add(-2, 1, 'link', 'notice', flush)
+    assert flushed == []
+    assert done.wait(2)
+    assert sorted(flushed) == [(-2, 1), (-1, 3)]
+
+
+def test_failed_flush_does_not_stop_worker():
+    aggregator = NotificationAggregator(window=0.01)
+    done = threading.Event()
+
+    def fail(chat_id, summary):
+        raise RuntimeError('API error')
+    aggregator.add(-1, 1, 'link', 'notice', fail)
+    time.sleep(0.05)
+    aggregator.add(-1, 1, 'link', 'notice', lambda x, y: done.set())
+    assert done.wait(2)
+
+
+def test_rolling():
+    aggregator = NotificationAggregator(rolling_period=60, max_chats=2)
+    summary = DeletionSummary()
+    assert aggregator.get_rolling(-1) is None
+    aggregator.set_rolling(-1, 10, summary, sent_time=time.time() - 30)
+    assert aggregator.get_rolling(-1) == (10, summary)
+    # Edited message keeps time when it was sent
+    aggregator.set_rolling(-1, 10, summary)
+    aggregator.set_rolling(-2, 20, summary, sent_time=time.time() - 61)
+    assert aggregator.get_rolling(-2) is None
+    aggregator.set_rolling(-2, 20, summary)
+    aggregator.set_rolling(-3, 30, summary)
+    # Least recently sent chat is forgotten
+    assert aggregator.get_rolling(-1) is None
+    assert aggregator.get_rolling(-3) == (30, summary)
+
+
+def test_rolling_period_counts_from_first_send():
+    aggregator = NotificationAggregator(rolling_period=60)
+    summary = DeletionSummary()
+    aggregator.set_rolling(-1, 10, summary, sent_time=time.time() - 61)
+    aggregator.set_rolling(-1, 10, summary)
+    assert aggregator.get_rolling(-1) is None
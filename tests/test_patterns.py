@@ -0,0 +1,87 @@
+import re
+
+from project.patterns import (
+    ChatMatcher, PatternTrie, normalize_domain, normalize_keyword,
+)
+
+from tests.utils import FakeMessage, url_entity
+
+
+def test_normalize_domain():
+    assert normalize_domain(' HTTPS://www.Spam.com/path?x=1 ') == 'spam.com'
+    assert normalize_domain('*.spam.com') == 'spam.com'
+    assert normalize_domain('spam.com:8080') == 'spam.com'
+    assert normalize_domain('spam') is None
+    assert normalize_domain('') is None
+
+
+def test_normalize_keyword():
+    assert normalize_keyword(' Buy Now ') == 'buy now'
+    assert normalize_keyword('  ') is None
+
+
+def test_trie_regex():
+    trie = PatternTrie(['spam.com', 'spam.org', 'spa'])
+    regex = re.compile('^%s$' % trie.to_regex())
+    for value in ('spam.com', 'spam.org', 'spa'):
+        assert regex.match(value)
+    assert not regex.match('spam')
+    trie.remove('spam.org')
+    trie.remove('missing')
+    regex = re.compile('^%s$' % trie.to_regex())
+    assert not regex.match('spam.org')
+    assert regex.match('spam.com')
+
+
+def test_keyword():
+    matcher = ChatMatcher({'blocked_keywords': ['buy now', 'casino']})
+    assert matcher.scan(FakeMessage(text='Buy now!')) == ('keyword', False)
+    assert matcher.scan(FakeMessage(caption='best CASINO')) == (
+        'keyword', False
+    )
+    # Only whole words match
+    assert matcher.scan(FakeMessage(text='casinos')) == (None, False)
+
+
+def test_denied_domain_and_subdomains():
+    matcher = ChatMatcher({'denied_domains': ['spam.com']})
+    assert matcher.scan(FakeMessage(text='go to spam.com')) == (
+        'domain', False
+    )
+    assert matcher.scan(FakeMessage(text='go to www.spam.com/x')) == (
+        'domain', False
+    )
+    assert matcher.scan(FakeMessage(text='nospam.com')) == (None, False)
+    assert matcher.scan(FakeMessage(text='spam.com.org')) == (None, False)
+    msg = FakeMessage(text='click', entities=[{
+        'type': 'text_link', 'url': 'https://SPAM.com/x',
+        'offset': 0, 'length': 5,
+    }])
+    assert matcher.scan(msg) == ('domain', False)
+
+
+def test_allowed_domains():
+    matcher = ChatMatcher({'allowed_domains': ['example.com']})
+    text = 'see https://docs.example.com/page'
+    msg = FakeMessage(text=text, entities=[
+        url_entity(text, 'https://docs.example.com/page'),
+    ])
+    assert matcher.scan(msg) == (None, True)
+    text = 'see https://example.com and https://other.com'
+    msg = FakeMessage(text=text, entities=[
+        url_entity(text, 'https://example.com'),
+        url_entity(text, 'https://other.com'),
+    ])
+    assert matcher.scan(msg) == (None, False)
+
+
+def test_set_patterns():
+    matcher = ChatMatcher({
+        'denied_domains': ['spam.com'], 'allowed_domains': ['spam.com'],
+    })
+    matcher.set_patterns('allowed_domains', [])
+    # Domain is still denied
+    assert matcher.scan(FakeMessage(text='spam.com')) == ('domain', False)
+    matcher.set_patterns('denied_domains', [])
+    assert matcher.scan(FakeMessage(text='spam.com')) == (None, False)
+    assert matcher.get_regex() is False
@@ -0,0 +1,91 @@
+from project.policy import (
+    ChatPolicy, PolicyCache, MSG_TYPE_BITS, build_type_mask,
+    load_all_policies,
+)
+
+
+class FakeStorage(object):
+    def __init__(self, rows):
+        self.rows = rows
+        self.loads = []
+
+    def load_chat_settings(self, chat_id):
+        self.loads.append(chat_id)
+        return [x for x in self.rows if x['chat_id'] == chat_id]
+
+    def load_all_chat_settings(self):
+        return list(self.rows)
+
+
+def test_from_rows_packs_allowed_types():
+    policy = ChatPolicy.from_rows(-1, [
+        {'key': 'is_allowed_link', 'value': False},
+        {'key': 'is_allowed_sticker', 'value': False},
+        {'key': 'is_allowed_sticker', 'value': True},
+        {'key': 'notify_actions', 'value': False},
+    ])
+    assert policy.blocked_mask == MSG_TYPE_BITS['link']
+    assert not policy.is_allowed('link')
+    assert policy.is_allowed('sticker')
+    assert policy.get('is_allowed_link') is False
+    assert policy.get('is_allowed_sticker') is True
+    assert policy.settings == {'notify_actions': False}
+    assert policy.get_setting('notify_actions') is False
+    assert policy.get_setting('notify_rolling') is False
+
+
+def test_build_type_mask_ignores_unknown_types():
+    assert build_type_mask(['link', 'photo', 'unknown']) == (
+        MSG_TYPE_BITS['link'] | MSG_TYPE_BITS['photo']
+    )
+
+
+def test_matcher_is_built_only_for_lists():
+    policy = ChatPolicy(-1)
+    assert policy.get_matcher() is None
+    policy.apply('blocked_keywords', ['spam'])
+    matcher = policy.get_matcher()
+    assert matcher is not None
+    policy.apply('blocked_keywords', ['ham'])
+    assert policy.get_matcher() is matcher
+    assert matcher.patterns['blocked_keywords'] == set(['ham'])
+
+
+def test_load_all_policies():
+    storage = FakeStorage([
+        {'chat_id': -1, 'key': 'is_allowed_link', 'value': False},
+        {'chat_id': -2, 'key': 'is_allowed_photo', 'value': False},
+        {'chat_id': -1, 'key': 'is_allowed_voice', 'value': False},
+    ])
+    policies = dict((x.chat_id, x) for x in load_all_policies(storage))
+    assert policies[-1].blocked_mask == build_type_mask(['link', 'voice'])
+    assert policies[-2].blocked_mask == build_type_mask(['photo'])
+
+
+def test_cache_loads_chat_once():
+    storage = FakeStorage([
+        {'chat_id': -1, 'key': 'is_allowed_link', 'value': False},
+    ])
+    cache = PolicyCache()
+    policy = cache.get(-1, storage)
+    assert cache.get(-1, storage) is policy
+    assert storage.loads == [-1]
+    assert cache.data_time is not None
+    cache.drop(-1)
+    assert -1 not in cache
+    cache.get(-1, storage)
+    assert storage.loads == [-1, -1]
+
+
+def test_complete_cache_does_not_load_unknown_chats():
+    storage = FakeStorage([
+        {'chat_id': -1, 'key': 'is_allowed_link', 'value': False},
+    ])
+    cache = PolicyCache()
+    cache.mark_complete()
+    assert cache.get(-1, storage).blocked_mask == 0
+    assert storage.loads == []
+    # Dropped chat was changed, it has to be loaded
+    cache.drop(-1)
+    assert cache.get(-1, storage).blocked_mask == MSG_TYPE_BITS['link']
+    assert storage.loads == [-1]
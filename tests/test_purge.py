@@ -0,0 +1,73 @@
+import pytest
+
+pytest.importorskip('telegram')
+pytest.importorskip('tgram')
+
+import watchdog_robot
+from watchdog_robot import WatchdogRobot, PURGE_CHUNK_SIZE
+from project.policy import MSG_TYPE_BITS
+
+from tests.utils import FakeMessage, Obj, url_entity
+
+
+class FakeRequest(object):
+    def __init__(self):
+        self.posts = []
+
+    def post(self, url, data, timeout=None):
+        self.posts.append((url, data))
+        return True
+
+
+@pytest.fixture
+def robot(monkeypatch):
+    robot = WatchdogRobot.__new__(WatchdogRobot)
+    jobs = []
+    monkeypatch.setattr(
+        watchdog_robot.ACTION_QUEUE, 'put',
+        lambda chat_id, func, args=(), chat_limited=True: jobs.append(args),
+    )
+    monkeypatch.setattr(robot, 'get_chat_admin_ids', lambda bot, x: set())
+    monkeypatch.setattr(robot, 'claim_moderation', lambda x, y: True)
+    robot.jobs = jobs
+    return robot
+
+
+def test_type_blocked_just_now_is_purged(robot):
+    # Chat blocked nothing when the message was posted
+    text = 'see http://example.com'
+    msg = FakeMessage(chat_id=-1020, text=text, entities=[
+        url_entity(text, 'http://example.com'),
+    ])
+    msg.message_id = 5
+    robot.remember_recent_message(msg, None)
+    count = robot.purge_recent_messages(
+        None, -1020, 60, 'link', types_mask=MSG_TYPE_BITS['link'],
+    )
+    assert count == 1
+    assert robot.jobs == [(None, -1020, [(5, msg.from_user.id)], 'link')]
+
+
+def test_messages_are_deleted_in_chunks(robot, monkeypatch):
+    logged = []
+    monkeypatch.setattr(
+        robot, 'log_purge', lambda chat_id, items, reason: logged.extend(items)
+    )
+    for idx in range(PURGE_CHUNK_SIZE + 1):
+        msg = FakeMessage(chat_id=-1021, text='hi')
+        msg.message_id = idx
+        robot.remember_recent_message(msg, None)
+    # Old python-telegram-bot has no delete_messages method
+    bot = Obj(request=FakeRequest(), base_url='https://api/bot123')
+    assert robot.purge_recent_messages(bot, -1021, 60, 'purge') == (
+        PURGE_CHUNK_SIZE + 1
+    )
+    assert len(robot.jobs) == 2
+    for args in robot.jobs:
+        robot.delete_messages(*args)
+    url, data = bot.request.posts[0]
+    assert url == 'https://api/bot123/deleteMessages'
+    assert data['chat_id'] == -1021
+    assert len(data['message_ids']) == PURGE_CHUNK_SIZE
+    assert len(bot.request.posts[1][1]['message_ids']) == 1
+    assert len(logged) == PURGE_CHUNK_SIZE + 1
@@ -0,0 +1,37 @@
+from project.recent import ChatRing, RecentMessages
+
+
+def test_ring_keeps_last_messages():
+    ring = ChatRing(3)
+    for idx in range(5):
+        ring.add(idx, 10 + idx, 1 << idx, 100 + idx)
+    assert list(ring.iter_newest()) == [
+        (4, 14, 16, 104), (3, 13, 8, 103), (2, 12, 4, 102),
+    ]
+
+
+def test_find_filters():
+    recent = RecentMessages(size=10)
+    recent.add(-1, 1, 100, 1, 10)
+    recent.add(-1, 2, 200, 2, 20)
+    recent.add(-1, 3, 100, 3, 30)
+    recent.add(-2, 4, 100, 1, 30)
+    assert recent.find(-1, 0) == [(3, 100), (2, 200), (1, 100)]
+    assert recent.find(-1, 20) == [(3, 100), (2, 200)]
+    assert recent.find(-1, 0, types_mask=1) == [(3, 100), (1, 100)]
+    assert recent.find(-1, 0, user_id=200) == [(2, 200)]
+    assert recent.find(-1, 0, types_mask=2, user_id=100) == [(3, 100)]
+    # Chat which blocks nothing has no types of messages
+    assert recent.find(-2, 0, types_mask=2) == []
+    assert recent.find(-3, 0) == []
+
+
+def test_least_recently_active_chats_are_forgotten():
+    recent = RecentMessages(size=2, max_chats=2)
+    recent.add(-1, 1, 100, 0, 10)
+    recent.add(-2, 1, 100, 0, 10)
+    recent.add(-1, 2, 100, 0, 10)
+    recent.add(-3, 1, 100, 0, 10)
+    assert len(recent) == 2
+    assert recent.find(-2, 0) == []
+    assert recent.find(-1, 0) == [(2, 100), (1, 100)]
@@ -0,0 +1,80 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from project.policy import MSG_TYPE_BITS, build_type_mask
+from project.simulator import PolicySimulator, render_report
+
+LINK = MSG_TYPE_BITS['link']
+PHOTO = MSG_TYPE_BITS['photo']
+STICKER = MSG_TYPE_BITS['sticker']
+CANDIDATES = [
+    ('links', LINK),
+    ('media', build_type_mask(['photo', 'sticker'])),
+]
+CHAT_IDS = [-1, -1, -1, -1, -2, -2]
+MASKS = [LINK, PHOTO, LINK | PHOTO, 0, STICKER, LINK]
+
+
+def process(simulator, chunk_size=None):
+    chunk_size = chunk_size or len(MASKS)
+    for idx in range(0, len(MASKS), chunk_size):
+        simulator.process_chunk(
+            np.array(CHAT_IDS[idx:idx + chunk_size], dtype=np.int64),
+            np.array(MASKS[idx:idx + chunk_size], dtype=np.int64),
+        )
+
+
+def test_process_chunk():
+    simulator = PolicySimulator(CANDIDATES)
+    process(simulator)
+    # messages, links, media
+    assert simulator.chats == {-1: [4, 2, 2], -2: [2, 1, 1]}
+    report = simulator.report()
+    assert report['messages'] == 6
+    assert report['chats'] == 2
+    assert report['types']['link'] == 3
+    assert report['types']['photo'] == 2
+    assert report['types']['sticker'] == 1
+    assert [
+        (x['name'], x['hits'], x['chats']) for x in report['candidates']
+    ] == [('links', 3, 2), ('media', 3, 2)]
+    assert report['candidates'][0]['top_chats'] == [(-1, 2, 4), (-2, 1, 2)]
+
+
+def test_process_chunk_with_current_masks():
+    simulator = PolicySimulator(CANDIDATES, current_masks={-1: LINK})
+    process(simulator)
+    # Messages with links of chat -1 are deleted already
+    assert simulator.chats == {-1: [4, 0, 1], -2: [2, 1, 1]}
+
+
+def test_chunks_are_summed():
+    simulator = PolicySimulator(CANDIDATES)
+    process(simulator, chunk_size=4)
+    assert simulator.chats == {-1: [4, 2, 2], -2: [2, 1, 1]}
+    assert simulator.messages == 6
+
+
+def test_feed_messages():
+    def build(chat_id, **extra):
+        msg = {
+            'message_id': 1, 'chat': {'id': chat_id, 'type': 'group'},
+            'from': {'id': 1, 'is_bot': False},
+        }
+        msg.update(extra)
+        return msg
+    messages = [
+        build(-1, text='http://example.com', entities=[
+            {'type': 'url', 'offset': 0, 'length': 18},
+        ]),
+        build(-1, photo=[{'file_id': 'x', 'width': 1, 'height': 1}]),
+        build(-2, sticker={'file_id': 'x'}),
+        build(-2, text='hello'),
+    ]
+    simulator = PolicySimulator(CANDIDATES, chunk_size=3)
+    simulator.feed(messages)
+    assert simulator.chats == {-1: [2, 1, 1], -2: [2, 0, 1]}
+    assert 'Policy links: 1 (25.00%) deleted in 1 chats' in render_report(
+        simulator.report()
+    )
@@ -0,0 +1,100 @@
+import time
+
+from project.policy import ChatPolicy, PolicyCache, build_type_mask
+from project.snapshot import (
+    PolicySnapshot, open_policy_snapshot, write_policy_snapshot,
+)
+
+
+def make_policy(chat_id, msg_types, settings=None):
+    return ChatPolicy(chat_id, build_type_mask(msg_types), settings)
+
+
+def test_lookup(tmpdir):
+    path = str(tmpdir.join('policy.snap'))
+    count = write_policy_snapshot(path, [
+        make_policy(-3, ['photo']),
+        make_policy(-1, ['link'], {'notify_actions': False}),
+        make_policy(-2, [], {'blocked_keywords': ['spam']}),
+    ], created=100)
+    assert count == 3
+    snapshot = PolicySnapshot(path)
+    assert snapshot.created == 100
+    policy = snapshot.lookup(-1)
+    assert policy.blocked_mask == build_type_mask(['link'])
+    assert policy.settings == {'notify_actions': False}
+    assert snapshot.lookup(-3).blocked_mask == build_type_mask(['photo'])
+    # Lists could not be packed
+    assert snapshot.lookup(-2) is None
+    assert snapshot.lookup(-4) is None
+    snapshot.excluded.add(-1)
+    assert snapshot.lookup(-1) is None
+    snapshot.close()
+
+
+def test_invalid_files(tmpdir):
+    empty = tmpdir.join('empty.snap')
+    empty.write('')
+    garbage = tmpdir.join('garbage.snap')
+    garbage.write('garbage' * 10)
+    assert open_policy_snapshot(str(tmpdir.join('missing.snap'))) is None
+    assert open_policy_snapshot(str(empty)) is None
+    assert open_policy_snapshot(str(garbage)) is None
+
+    path = str(tmpdir.join('policy.snap'))
+    write_policy_snapshot(path, [make_policy(-1, ['link'])], created=100)
+    with open(path, 'rb') as inp:
+        data = inp.read()
+    truncated = tmpdir.join('truncated.snap')
+    truncated.write_binary(data[:-1])
+    assert open_policy_snapshot(str(truncated)) is None
+
+
+def test_snapshots_of_workers_are_merged(tmpdir):
+    path = str(tmpdir.join('policy.snap'))
+    now = time.time()
+    write_policy_snapshot(
+        path, [make_policy(-1, ['link'])], created=now - 10, max_age=60,
+    )
+    write_policy_snapshot(
+        path, [make_policy(-2, ['photo']), make_policy(-1, ['voice'])],
+        created=now, max_age=60,
+    )
+    snapshot = open_policy_snapshot(path)
+    assert snapshot.created == now - 10
+    assert snapshot.lookup(-1).blocked_mask == build_type_mask(['voice'])
+    assert snapshot.lookup(-2).blocked_mask == build_type_mask(['photo'])
+    snapshot.close()
+
+
+def test_old_snapshot_is_not_merged(tmpdir):
+    path = str(tmpdir.join('policy.snap'))
+    now = time.time()
+    write_policy_snapshot(
+        path, [make_policy(-1, ['link'])], created=now - 100, max_age=60,
+    )
+    write_policy_snapshot(
+        path, [make_policy(-2, ['photo'])], created=now, max_age=60,
+    )
+    snapshot = open_policy_snapshot(path)
+    assert snapshot.created == now
+    assert snapshot.lookup(-1) is None
+    snapshot.close()
+
+
+def test_cache_uses_snapshot(tmpdir):
+    path = str(tmpdir.join('policy.snap'))
+    write_policy_snapshot(path, [make_policy(-1, ['link'])], created=100)
+
+    class Storage(object):
+        def load_chat_settings(self, chat_id):
+            assert chat_id != -1
+            return []
+
+    cache = PolicyCache()
+    cache.snapshot = open_policy_snapshot(path)
+    assert cache.get(-1, Storage()).blocked_mask == build_type_mask(['link'])
+    assert cache.data_time == 100
+    cache.drop(-1)
+    assert -1 in cache.snapshot.excluded
+    cache.snapshot.close()
@@ -0,0 +1,125 @@
+from datetime import datetime, timedelta
+import sqlite3
+
+import pytest
+
+from project.log_schema import build_purge_record
+from project.storage import RECORD_KINDS, build_storage
+from project.storage.sqlite import SQLiteStorage
+
+
+@pytest.fixture
+def storage(tmpdir):
+    storage = SQLiteStorage(str(tmpdir.join('watchdog.sqlite')))
+    yield storage
+    storage.close()
+
+
+def add_deletion(storage, chat_id, message_id, date, reason):
+    storage.add_log_event(
+        build_purge_record(chat_id, 100, message_id, date, reason)
+    )
+    storage.record_deletion(date, chat_id, reason)
+
+
+def test_build_storage(tmpdir):
+    storage = build_storage({
+        'backend': 'sqlite',
+        'options': {'path': str(tmpdir.join('db', 'watchdog.sqlite'))},
+    })
+    assert isinstance(storage, SQLiteStorage)
+    storage.close()
+    with pytest.raises(ValueError):
+        build_storage({'backend': 'redis'})
+
+
+def test_chat_settings(storage):
+    before = datetime.utcnow() - timedelta(seconds=1)
+    storage.save_chat_setting(-1, 'is_allowed_link', False)
+    storage.save_chat_setting(-1, 'is_allowed_link', True)
+    storage.save_chat_setting(-1, 'blocked_keywords', ['spam'])
+    storage.save_chat_setting(-2, 'notify_actions', False)
+    assert sorted(
+        (x['key'], x['value']) for x in storage.load_chat_settings(-1)
+    ) == [('blocked_keywords', ['spam']), ('is_allowed_link', True)]
+    assert len(list(storage.load_all_chat_settings())) == 3
+    assert storage.find_chats_changed_since(before) == set([-1, -2])
+    assert storage.find_chats_changed_since(
+        datetime.utcnow() + timedelta(seconds=1)
+    ) == set()
+
+
+def test_chat_log_pages(storage):
+    start = datetime(2020, 1, 1)
+    for idx in range(5):
+        add_deletion(
+            storage, -1, idx, start + timedelta(minutes=idx),
+            'link' if idx % 2 else 'sticker',
+        )
+    add_deletion(storage, -2, 100, start, 'link')
+    records = list(storage.iter_chat_log(-1, limit=2))
+    assert [x['message_id'] for x in records] == [0, 1]
+    records = list(storage.iter_chat_log(-1, after=records[-1]['cursor']))
+    assert [x['message_id'] for x in records] == [2, 3, 4]
+    records = list(storage.iter_chat_log(-1, reason='link'))
+    assert [x['message_id'] for x in records] == [1, 3]
+    records = list(storage.iter_chat_log(
+        -1, since=start + timedelta(minutes=1),
+        until=start + timedelta(minutes=3),
+    ))
+    assert [x['message_id'] for x in records] == [1, 2]
+
+
+def test_day_stat(storage):
+    now = datetime.utcnow()
+    add_deletion(storage, -1, 1, now, 'link')
+    add_deletion(storage, -1, 2, now, 'link')
+    add_deletion(storage, -2, 3, now, 'sticker')
+    day, chat_count, msg_count, reasons = storage.load_day_stat(2)[-1]
+    assert (chat_count, msg_count) == (2, 3)
+    assert reasons == {'link': 2, 'sticker': 1}
+    assert storage.load_day_stat(2)[0][1:] == (0, 0, {})
+    # Counters are rebuilt from log
+    storage.execute_write('DELETE FROM stat_day_reason')
+    count = storage.rebuild_day_stat(now, now + timedelta(days=1))
+    assert count == 1
+    assert storage.load_day_stat(1)[0][1:] == (
+        2, 3, {'link': 2, 'sticker': 1}
+    )
+
+
+def test_failed_transaction_is_rolled_back(storage):
+    with pytest.raises(sqlite3.IntegrityError):
+        with storage.transaction() as conn:
+            conn.execute(
+                "INSERT INTO stat_day (day, date) VALUES ('x', ?)",
+                (datetime.utcnow(),),
+            )
+            conn.execute("INSERT INTO stat_day (day, date) VALUES ('y', NULL)")
+    assert list(storage.export_records('stat_day')) == []
+    # Connection is usable after rollback
+    storage.record_deletion(datetime.utcnow(), -1, 'link')
+    assert len(list(storage.export_records('stat_day'))) == 1
+
+
+def test_copy_round_trip(storage, tmpdir):
+    now = datetime(2020, 1, 1, 12)
+    storage.save_chat_setting(-1, 'is_allowed_link', False)
+    storage.remember_user(100, {'text': 'hi'})
+    storage.remember_chat(-1, {'text': 'hi'})
+    add_deletion(storage, -1, 1, now, 'link')
+    storage.add_failure({
+        'date': now, 'error': 'error', 'traceback': 'traceback',
+        'chat_id': -1, 'user_id': 100, 'message_id': 1,
+    })
+    target = SQLiteStorage(str(tmpdir.join('copy.sqlite')))
+    for kind in RECORD_KINDS:
+        count = target.import_records(kind, storage.export_records(kind))
+        assert count == 1
+    for kind in RECORD_KINDS:
+        assert list(target.export_records(kind)) == list(
+            storage.export_records(kind)
+        )
+    target.close()
+    with pytest.raises(ValueError):
+        list(storage.export_records('unknown'))
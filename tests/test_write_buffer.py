@@ -0,0 +1,129 @@
+import pytest
+
+pytest.importorskip('pymongo')
+
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from project.write_buffer import WriteBuffer, load_fallback, merge_update
+
+
+class FakeCollection(object):
+    def __init__(self):
+        self.docs = []
+        self.upserts = []
+        # Errors raised by next calls
+        self.errors = []
+
+    def raise_error(self):
+        if self.errors:
+            raise self.errors.pop(0)
+
+    def insert_many(self, docs, ordered=True):
+        self.raise_error()
+        self.docs.extend(docs)
+
+    def bulk_write(self, ops, ordered=True):
+        self.raise_error()
+        self.upserts.extend(ops)
+
+    def insert_one(self, doc):
+        self.docs.append(doc)
+
+    def replace_one(self, query, doc, upsert=False):
+        self.docs.append(doc)
+
+    def update_one(self, query, ops, upsert=False):
+        self.upserts.append((query, ops))
+
+
+class FakeDb(dict):
+    def __missing__(self, key):
+        coll = self[key] = FakeCollection()
+        return coll
+
+
+def test_merge_update():
+    ops = {}
+    merge_update(ops, {
+        '$set': {'a': 1}, '$inc': {'n': 1}, '$setOnInsert': {'x': 1},
+        '$addToSet': {'tags': 'a'},
+    })
+    merge_update(ops, {
+        '$set': {'a': 2}, '$inc': {'n': 2}, '$setOnInsert': {'x': 2},
+        '$addToSet': {'tags': {'$each': ['a', 'b']}},
+    })
+    assert ops == {
+        '$set': {'a': 2}, '$inc': {'n': 3}, '$setOnInsert': {'x': 1},
+        '$addToSet': {'tags': {'$each': ['a', 'b']}},
+    }
+
+
+def test_flush_merges_updates():
+    db = FakeDb()
+    buf = WriteBuffer(db)
+    buf.insert('log', {'_id': 1})
+    buf.update('user', 1, {'$inc': {'n': 1}})
+    buf.update('user', 1, {'$inc': {'n': 1}})
+    assert buf.pending() == 2
+    buf.flush()
+    assert buf.pending() == 0
+    assert db['log'].docs == [{'_id': 1}]
+    assert len(db['user'].upserts) == 1
+
+
+def test_failed_batch_is_retried():
+    db = FakeDb()
+    buf = WriteBuffer(db)
+    db['log'].errors.append(AutoReconnect('down'))
+    buf.insert('log', {'_id': 1})
+    buf.flush()
+    assert db['log'].docs == []
+    assert buf.pending() == 1
+    buf.flush()
+    assert db['log'].docs == [{'_id': 1}]
+    assert buf.pending() == 0
+
+
+def test_only_failed_inserts_are_retried():
+    db = FakeDb()
+    buf = WriteBuffer(db)
+    db['log'].errors.append(BulkWriteError({'writeErrors': [
+        {'index': 0, 'code': 11000},
+        {'index': 2, 'code': 1},
+    ]}))
+    for idx in range(3):
+        buf.insert('log', {'_id': idx})
+    buf.flush()
+    # Duplicate key means the doc is written already
+    assert buf.pending() == 1
+    buf.flush()
+    assert db['log'].docs == [{'_id': 2}]
+
+
+def test_fallback_after_max_retries(tmpdir):
+    path = str(tmpdir.join('fallback.jsonl'))
+    db = FakeDb()
+    buf = WriteBuffer(db, max_retries=2, fallback_path=path)
+    db['log'].errors.extend([AutoReconnect('down')] * 2)
+    db['user'].errors.extend([AutoReconnect('down')] * 2)
+    buf.insert('log', {'_id': 1, 'text': 'foo'})
+    buf.update('user', 5, {'$set': {'name': 'bar'}})
+    buf.flush()
+    buf.flush()
+    assert buf.pending() == 0
+    other = FakeDb()
+    assert load_fallback(other, path) == 2
+    assert other['log'].docs == [{'_id': 1, 'text': 'foo'}]
+    assert other['user'].upserts == [({'_id': 5}, {'$set': {'name': 'bar'}})]
+
+
+def test_stop_writes_retries_to_fallback(tmpdir):
+    path = str(tmpdir.join('fallback.jsonl'))
+    db = FakeDb()
+    buf = WriteBuffer(db, fallback_path=path)
+    db['log'].errors.extend([AutoReconnect('down')] * 2)
+    buf.insert('log', {'_id': 1})
+    buf.stop()
+    assert buf.pending() == 0
+    with open(path) as inp:
+        assert len(inp.readlines()) == 1
@@ -0,0 +1,38 @@
+class Obj(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class FakeMessage(object):
+    """
+    Message with the attributes read by classifier and matcher.
+    """
+    def __init__(
+            self, chat_id=-1, user_id=1, text=None, caption=None,
+            entities=(), caption_entities=(), new_chat_members=(), **kwargs
+        ):
+        self.chat = Obj(id=chat_id)
+        self.from_user = Obj(id=user_id, is_bot=False)
+        self.text = text
+        self.caption = caption
+        self.entities = [Obj(**x) for x in entities]
+        self.caption_entities = [Obj(**x) for x in caption_entities]
+        self.new_chat_members = list(new_chat_members)
+        for key in (
+                'document', 'sticker', 'voice', 'audio', 'photo',
+                'left_chat_member', 'video_note',
+            ):
+            setattr(self, key, kwargs.pop(key, None))
+        if kwargs:
+            raise TypeError('Unknown arguments: %s' % ', '.join(kwargs))
+
+    def parse_entity(self, ent):
+        return self.text[ent.offset:ent.offset + ent.length]
+
+    def parse_caption_entity(self, ent):
+        return self.caption[ent.offset:ent.offset + ent.length]
+
+
+def url_entity(text, url):
+    offset = text.index(url)
+    return {'type': 'url', 'offset': offset, 'length': len(url)}
@@ -4,16 +4,63 @@ import time
 import json
 import logging
 from argparse import ArgumentParser
-from itertools import chain
+from functools import partial
 from datetime import datetime, timedelta
 from traceback import format_exc
 import re
+import os
+import atexit
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
-from telegram import ParseMode
-from telegram.ext import CommandHandler, MessageHandler, Filters, RegexHandler
+from telegram import ParseMode, Update
+from telegram.error import RetryAfter
+from telegram.ext import (
+    CommandHandler, MessageHandler, Filters, RegexHandler, TypeHandler,
+    DispatcherHandlerStop,
+)
 from tgram import TgramRobot, run_polling
 
-from project.database import connect_db
+from project.database import get_db
+from project.admin_cache import AdminCache
+from project.action_queue import ActionQueue
+from project.storage import build_storage
+from project.log_schema import (
+    build_log_record, build_fail_record, build_purge_record,
+)
+from project.archive import ArchiveWriter
+from project.classifier import CLASSIFIER, RATE_TYPES
+from project.invalidation import build_channel
+from project.metrics import METRICS, track_api_call, build_profiler
+from project.notify import NotificationAggregator
+from project.sharding import ShardPool
+from project.dedup import Deduplicator
+from project.recent import RecentMessages
+from project.transport import install_transport
+from project.audit import iter_chat_audit, iter_csv, build_audit_token
+from project.snapshot import write_policy_snapshot, load_policy_snapshot
+from project.settings import ADMIN_CACHE as ADMIN_CACHE_CONFIG
+from project.settings import ACTION_QUEUE as ACTION_QUEUE_CONFIG
+from project.settings import STORAGE as STORAGE_CONFIG
+from project.settings import LOG_ARCHIVE
+from project.settings import INVALIDATION
+from project.settings import ASYNC_ENGINE
+from project.settings import PROFILER
+from project.settings import NOTIFICATIONS as NOTIFICATIONS_CONFIG
+from project.settings import SHARDS
+from project.settings import DEDUP
+from project.settings import PRELOAD_POLICIES, POLICY_SNAPSHOT
+from project.settings import RECENT_MESSAGES as RECENT_MESSAGES_CONFIG
+from project.settings import FLOOD, JOIN_RAID
+from project.settings import BOT_API
+from project.settings import AUDIT
+from project.policy import (
+    PolicyCache, load_all_policies, VALID_SETTINGS, MSG_TYPES, MSG_TYPE_BITS,
+)
+from project.patterns import (
+    DENIED_DOMAINS, ALLOWED_DOMAINS, BLOCKED_KEYWORDS, normalize_domain,
+    normalize_keyword,
+)
 
 
 class InvalidCommand(Exception):
@@ -31,10 +78,22 @@ To stop deleting messages of particular type use: `/watchdog_allow MSG_TYPE` whe
 
 By defalt, messages of all types are allowed.
 
+Type `flood` means a user posting too many messages in a few seconds, type `join_raid` means too many users joining the chat in a short time.
+
 To see which message types are allowed and which disabled use command `/watchdog_config`
 
 By default when bot deletes message it write about it to the chat. If you want to disable this notifications use command `/watchdog_set notify_actions=no`
 
+If many messages are deleted in short time, bot writes one summary message. Use `/watchdog_set notify_rolling=yes` to make bot update its previous summary message instead of writing new one.
+
+To delete messages with links to particular domains use `/watchdog_deny_domain example.com`. To block all links except links to particular domains, block `link` type and use `/watchdog_allow_domain example.com`. Use `/watchdog_forget_domain example.com` to remove domain from both lists. Subdomains are matched too.
+
+To delete messages with particular words use `/watchdog_block_word WORD`, to stop it use `/watchdog_unblock_word WORD`. Each of these commands accepts many space-separated values. Use `/watchdog_lists` to see all lists.
+
+To delete messages which were posted before the type had been blocked use `/watchdog_purge MINUTES MSG_TYPE`, e.g. `/watchdog_purge 30 link`. Send this command as reply to message to delete only messages of its author, in that case MSG\_TYPE could be omitted. Use `all` as MSG\_TYPE to delete messages of any type.
+
+To get the log of deleted messages as CSV file use `/watchdog_log DAYS REASON`, e.g. `/watchdog_log 30 link`, both DAYS and REASON could be omitted. Bot sends the file in private message, so start private chat with the bot first.
+
 All these commands `/watchdog_allow`, `/watchdog_block`, `/watchdog_config` and `/watchdog_set` have to be sent to the chat which you want to configure. Do not send this command in private message to the bot, it will ignore such private messages.
 
 *How to Install Bot to the Chat*
@@ -58,27 +117,66 @@ The source code is available at [github.com/lorien/watchdog_robot](https://githu
 [@coinsignal_robot](https://t.me/coinsignal_robot) - bot to be notified when price of specific coin reaches the level you have set, also you can use this bot just to see price of coins.
 [@lang_blocker_bot](https://t.me/lang_blocker_bot) - bot to delete messages in particular languages configured by chat administrator 
 """
-db = connect_db()
-ADMIN_IDS_CACHE = {}
+db = get_db()
+ADMIN_IDS_CACHE = AdminCache(**ADMIN_CACHE_CONFIG)
 SUPERUSER_IDS = set([
     46284539, # @madspectator
 ])
 RE_ALLOW_COMMAND = re.compile('^/watchdog_allow (\w+)$')
 RE_BLOCK_COMMAND = re.compile('^/watchdog_block (\w+)$')
 RE_SET_COMMAND = re.compile('^/watchdog_set (\w+)=(\w+)$')
-OPTION_CACHE = {}
-DEFAULT_IS_ALLOWED = True
-DEFAULT_SETTINGS = {
-    'notify_actions': True,
+# command: (list setting, add or remove values, normalizer)
+LIST_COMMANDS = {
+    'watchdog_deny_domain': (DENIED_DOMAINS, True, normalize_domain),
+    'watchdog_allow_domain': (ALLOWED_DOMAINS, True, normalize_domain),
+    'watchdog_forget_domain': (None, False, normalize_domain),
+    'watchdog_block_word': (BLOCKED_KEYWORDS, True, normalize_keyword),
+    'watchdog_unblock_word': (BLOCKED_KEYWORDS, False, normalize_keyword),
 }
-VALID_SETTINGS = (
-    'notify_actions',
-)
-MSG_TYPES = (
-    'link', 'bot', 'user', 'sticker', 'gif', 'voice',
-    'attachment', 'audio', 'photo', 'user_joined_msg',
-    'user_left_msg', 'mention', 'video_message',
-)
+MAX_LIST_SIZE = 10000
+RE_PURGE_COMMAND = re.compile('^/watchdog_purge(?:@\w+)? (\d+)(?: (\w+))?$')
+# Bot could delete messages not older than 48 hours
+PURGE_MAX_MINUTES = 48 * 60
+# Max number of messages in one deleteMessages call
+PURGE_CHUNK_SIZE = 100
+LIST_DISPLAY_LIMIT = 100
+RE_LOG_COMMAND = re.compile('^/watchdog_log(?:@\w+)?(?: (\d+))?(?: (\w+))?$')
+LOG_DEFAULT_DAYS = 30
+# Max size of file bot could send
+LOG_MAX_FILE_SIZE = 50 * 1024 * 1024
+RE_STAT_COMMAND = re.compile('^/stat(?:@\w+)?(?: (\d+))?$')
+STAT_DEFAULT_DAYS = 7
+STAT_MAX_DAYS = 365
+POLICY_CACHE = PolicyCache()
+ACTION_QUEUE = ActionQueue(**ACTION_QUEUE_CONFIG)
+# Log exports read storage for a long time, they do not go to the
+# action queue which deletes messages
+EXPORT_EXECUTOR = ThreadPoolExecutor(max_workers=AUDIT['export_workers'])
+STORAGE = build_storage(STORAGE_CONFIG, db)
+atexit.register(STORAGE.close)
+INVALIDATION_CHANNEL = build_channel(INVALIDATION, db)
+PROFILER = build_profiler(PROFILER)
+NOTIFICATIONS = NotificationAggregator(**NOTIFICATIONS_CONFIG)
+DEDUPLICATOR = Deduplicator(db, **DEDUP)
+RECENT_MESSAGES = RecentMessages(**RECENT_MESSAGES_CONFIG)
+if SHARDS:
+    SHARD_POOL = ShardPool(
+        SHARDS, PolicyCache, partial(AdminCache, **ADMIN_CACHE_CONFIG)
+    )
+    METRICS.register_gauge('queue_depth', SHARD_POOL.qsize, queue='shard')
+else:
+    SHARD_POOL = None
+METRICS.register_gauge('queue_depth', ACTION_QUEUE.qsize, queue='action')
+METRICS.register_gauge('queue_depth', STORAGE.pending, queue='write')
+atexit.register(INVALIDATION_CHANNEL.stop)
+if LOG_ARCHIVE['path']:
+    ARCHIVE = ArchiveWriter(**LOG_ARCHIVE)
+    atexit.register(ARCHIVE.close)
+else:
+    ARCHIVE = None
+# Registered last to run first: queued deletions still write to the
+# log, archive and storage
+atexit.register(ACTION_QUEUE.stop)
 
 
 class InvalidCommand(Exception):
@@ -87,34 +185,10 @@ class InvalidCommand(Exception):
 
 class WatchdogRobot(TgramRobot):
     def remember_user(self, msg):
-        update = {
-            '_id': msg.from_user.id,
-            'msg': msg.to_dict(),
-            'join_date': datetime.utcnow(),
-        }
-        update_insert = {
-            'first_join_date': datetime.utcnow(),
-        }
-        db.user.find_one_and_update(
-            {'_id': update['_id']},
-            {'$set': update, '$setOnInsert': update_insert},
-            upsert=True,
-        )
+        STORAGE.remember_user(msg.from_user.id, msg.to_dict())
 
     def remember_chat(self, msg):
-        update = {
-            '_id': msg.chat.id,
-            'msg': msg.to_dict(),
-            'join_date': datetime.utcnow(),
-        }
-        update_insert = {
-            'first_join_date': datetime.utcnow(),
-        }
-        db.chat.find_one_and_update(
-            {'_id': update['_id']},
-            {'$set': update, '$setOnInsert': update_insert},
-            upsert=True,
-        )
+        STORAGE.remember_chat(msg.chat.id, msg.to_dict())
 
     def render_help(self):
         msg_types_data = '\n'.join(
@@ -122,18 +196,63 @@ class WatchdogRobot(TgramRobot):
         )
         return HELP.format(msg_types=msg_types_data)
 
-    def get_chat_admin_ids(self, bot, chat_id):
-        try:
-            ids, update_time = ADMIN_IDS_CACHE[chat_id]
-        except KeyError:
-            ids, update_time = None, 0
-        else:
-            logging.debug('Using cached admin ids for chat [%d]' % chat_id)
-        if time.time() - update_time > 3600:
+    def fetch_chat_admin_ids(self, bot, chat_id):
+        logging.debug('Fetching admin ids for chat [%d]' % chat_id)
+        with track_api_call('getChatAdministrators'):
             admins = bot.get_chat_administrators(chat_id)
-            ids = [x.user.id for x in admins]
-            ADMIN_IDS_CACHE[chat_id] = (ids, time.time())
-        return ids
+        return set(x.user.id for x in admins)
+
+    def get_policy_cache(self, chat_id):
+        # Caches of the chat's shard are used by any thread, e.g. by
+        # action queue workers, so every chat has one cached policy
+        if SHARD_POOL:
+            return SHARD_POOL.get_shard(chat_id).policy_cache
+        return POLICY_CACHE
+
+    def get_admin_cache(self, chat_id):
+        if SHARD_POOL:
+            return SHARD_POOL.get_shard(chat_id).admin_cache
+        return ADMIN_IDS_CACHE
+
+    def iter_caches(self):
+        yield POLICY_CACHE, ADMIN_IDS_CACHE
+        if SHARD_POOL:
+            for shard in SHARD_POOL.shards:
+                yield shard.policy_cache, shard.admin_cache
+
+    def get_chat_admin_ids(self, bot, chat_id):
+        return self.get_admin_cache(chat_id).get(
+            chat_id, partial(self.fetch_chat_admin_ids, bot)
+        )
+
+    def handle_duplicate_update(self, bot, update):
+        # In shard thread the update has been checked already
+        if SHARD_POOL and SHARD_POOL.current():
+            return
+        if not self.is_new_update(update.update_id):
+            logging.debug('Skipping duplicate update [%d]' % update.update_id)
+            raise DispatcherHandlerStop
+
+    def is_new_update(self, update_id):
+        return DEDUPLICATOR.is_new_update(update_id)
+
+    def claim_moderation(self, chat_id, message_id):
+        return DEDUPLICATOR.claim_action('delete', chat_id, message_id)
+
+    def invalidate_chat_admins(self, chat_id):
+        for policy_cache, admin_cache in self.iter_caches():
+            admin_cache.invalidate(chat_id)
+        INVALIDATION_CHANNEL.publish('admin', chat_id)
+
+    def handle_invalidation(self, kind, key):
+        for policy_cache, admin_cache in self.iter_caches():
+            if kind == 'policy':
+                policy_cache.drop(key)
+            elif kind == 'admin':
+                admin_cache.invalidate(key)
+
+    def start_cache_invalidation(self):
+        INVALIDATION_CHANNEL.start(self.handle_invalidation)
 
     def build_user_name(self, user):
         if user.first_name and user.last_name:
@@ -149,40 +268,65 @@ class WatchdogRobot(TgramRobot):
             return '#%d' % user.id
 
     def find_msg_types(self, msg):
-        ret = set()
-        for ent in chain(msg.entities, msg.caption_entities):
-            if ent.type in ('url', 'text_link'):
-                ret.add('link')
-            elif ent.type  == 'email':
-                ret.add('email')
-            elif ent.type == 'mention':
-                ret.add('mention')
-        for user in msg.new_chat_members:
-            if user.is_bot:
-                ret.add('bot')
-        if msg.sticker:
-            ret.add('sticker')
-        if msg.document and msg.document.mime_type == 'video/mp4':
-            ret.add('gif')
-        if msg.voice:
-            ret.add('voice')
-        if msg.document and msg.document.mime_type != 'video/mp4':
-            ret.add('attachment')
-        if msg.audio:
-            ret.add('audio')
-        if msg.photo:
-            ret.add('photo')
-        if msg.new_chat_members:
-            ret.add('user_joined_msg')
-        if msg.left_chat_member:
-            ret.add('user_left_msg')
-        if msg.video_note:
-            ret.add('video_message')
-        return ret
+        return CLASSIFIER.find_types(msg)
+
+    def start_background_workers(self):
+        STORAGE.start()
+        self.start_cache_invalidation()
+
+    def warm_up_caches(self):
+        if getattr(self, 'caches_warmed_up', False):
+            return
+        self.caches_warmed_up = True
+        if POLICY_SNAPSHOT['path']:
+            snapshot = load_policy_snapshot(
+                POLICY_SNAPSHOT['path'], POLICY_SNAPSHOT['max_age'], STORAGE
+            )
+            for policy_cache, admin_cache in self.iter_caches():
+                policy_cache.snapshot = snapshot
+            atexit.register(self.save_policy_snapshot)
+        if PRELOAD_POLICIES:
+            load_time = time.time()
+            policies = load_all_policies(STORAGE)
+            if SHARD_POOL:
+                for policy in policies:
+                    shard = SHARD_POOL.get_shard(policy.chat_id)
+                    shard.policy_cache.update([policy])
+            else:
+                POLICY_CACHE.update(policies)
+            # Chats without settings rows have default policy
+            for policy_cache, admin_cache in self.iter_caches():
+                policy_cache.note_data_time(load_time)
+                policy_cache.mark_complete()
+            logging.debug('Preloaded settings of %d chats' % len(policies))
+
+    def save_policy_snapshot(self):
+        policies = {}
+        created = time.time()
+        for policy_cache, admin_cache in self.iter_caches():
+            if policy_cache.data_time is not None:
+                created = min(created, policy_cache.data_time)
+            for policy in policy_cache.values():
+                policies[policy.chat_id] = policy
+        write_policy_snapshot(
+            POLICY_SNAPSHOT['path'], policies.values(), created,
+            max_age=POLICY_SNAPSHOT['max_age'],
+        )
 
     def before_start_processing(self):
         self.bot_id = self.bot.get_me().id
-        self.db = connect_db()
+        self.warm_up_caches()
+        ACTION_QUEUE.start()
+        self.start_background_workers()
+
+    def build_async_engine(self, **kwargs):
+        from project.aio import AsyncEngine
+
+        opts = dict(ASYNC_ENGINE, **kwargs)
+        opts.setdefault('method_timeouts', BOT_API['method_timeouts'])
+        return AsyncEngine(
+            self, STORAGE, ADMIN_IDS_CACHE, **opts
+        )
 
     def handle_start_help(self, bot, update):
         msg = update.effective_message
@@ -196,11 +340,22 @@ class WatchdogRobot(TgramRobot):
             )
 
     def safe_delete_msg(self, bot, msg):
+        # Result is not needed, do not block the handler
+        ACTION_QUEUE.put(
+            msg.chat.id, self.safe_delete_message,
+            args=(bot, msg.chat.id, msg.message_id), chat_limited=False,
+        )
+
+    def safe_delete_message(self, bot, chat_id, message_id):
+        # Executed by ACTION_QUEUE worker, RetryAfter is handled there
         try:
-            bot.delete_message(
-                chat_id=msg.chat.id,
-                message_id=msg.message_id
-            )
+            with track_api_call('deleteMessage'):
+                bot.delete_message(
+                    chat_id=chat_id,
+                    message_id=message_id
+                )
+        except RetryAfter:
+            raise
         except Exception as ex:
             logging.error(ex)
 
@@ -211,13 +366,10 @@ class WatchdogRobot(TgramRobot):
         if msg.from_user.id not in self.get_chat_admin_ids(bot, msg.chat.id):
             self.safe_delete_msg(bot, msg)
         elif msg.chat.type in ('group', 'supergroup'):
+            policy = self.load_chat_policy(msg.chat.id)
             out = ['*Chat config:*']
             for setting in VALID_SETTINGS:
-                allowed = self.load_chat_setting(
-                    msg.chat.id,
-                    setting,
-                    DEFAULT_SETTINGS[setting]
-                )
+                allowed = policy.get_setting(setting)
                 out.append(
                     ' - `%s`: %s' % (
                         setting, 'YES' if allowed else 'NO'
@@ -226,11 +378,7 @@ class WatchdogRobot(TgramRobot):
             allowed_box = []
             blocked_box = []
             for msg_type in MSG_TYPES:
-                allowed = self.load_chat_setting(
-                    msg.chat.id,
-                    'is_allowed_%s' % msg_type,
-                    DEFAULT_IS_ALLOWED
-                )
+                allowed = policy.is_allowed(msg_type)
                 box = allowed_box if allowed else blocked_box
                 box.append(' - `%s`' % msg_type)
             out.append('\n*Allowed content:*')
@@ -263,54 +411,58 @@ class WatchdogRobot(TgramRobot):
         elif msg.from_user.id not in SUPERUSER_IDS:
             pass
         else:
-            today = datetime.utcnow().replace(
-                hour=0, minute=0, second=0, microsecond=0
-            )
-            start = today
-            day_chats = []
-            day_messages = []
-            for x in range(7):
-                end = start + timedelta(days=1)
-                query = {
-                    'date': {'$gte': start, '$lt': end},
-                    'type': 'delete',
-                }
-                events = list(db.log.find(query))
-                chat_count = len(set((x['msg']['chat']['id'] for x in events)))
-                msg_count = len(events)
-                day_chats.insert(0, chat_count)
-                day_messages.insert(0, msg_count)
-                start -= timedelta(days=1)
-            output = '\n'.join((
-                'Chats: %s' % ' | '.join(map(str, day_chats)),
-                'Deleted messages: %s' % ' | '.join(map(str, day_messages)),
-            ))
+            match = RE_STAT_COMMAND.match(msg.text)
+            days = STAT_DEFAULT_DAYS
+            if match and match.group(1):
+                days = max(1, min(STAT_MAX_DAYS, int(match.group(1))))
+            day_stat = STORAGE.load_day_stat(days)
+            reasons = {}
+            for day, chat_count, msg_count, day_reasons in day_stat:
+                for reason, count in day_reasons.items():
+                    reasons[reason] = reasons.get(reason, 0) + count
+            if days <= STAT_DEFAULT_DAYS * 2:
+                out = [
+                    'Chats: %s' % ' | '.join(str(x[1]) for x in day_stat),
+                    'Deleted messages: %s' % ' | '.join(
+                        str(x[2]) for x in day_stat
+                    ),
+                ]
+            else:
+                # Too many days to list them in one message
+                out = [
+                    'Days: %d' % days,
+                    'Chats per day (avg): %d' % (
+                        sum(x[1] for x in day_stat) / days
+                    ),
+                    'Deleted messages: %d' % sum(x[2] for x in day_stat),
+                ]
+            output = '\n'.join(out + [
+                'Reasons: %s' % (', '.join(
+                    '%s=%d' % (reason, count) for reason, count in sorted(
+                        reasons.items(), key=lambda x: -x[1]
+                    )
+                ) or '---'),
+            ])
             bot.send_message(
                 chat_id=msg.chat.id,
                 text=output
             )
 
+    def load_chat_policy(self, chat_id):
+        return self.get_policy_cache(chat_id).get(chat_id, STORAGE)
+
     def save_chat_setting(self, chat_id, option, value):
-        OPTION_CACHE[(chat_id, option)] = value
-        self.db.config.find_one_and_update(
-            {'chat_id': chat_id, 'key': option},
-            {'$set': {'value': value}},
-            upsert=True,
-        )
+        owner = self.get_policy_cache(chat_id)
+        owner.get(chat_id, STORAGE).apply(option, value)
+        STORAGE.save_chat_setting(chat_id, option, value)
+        # Other caches of the process could have loaded the chat before
+        for policy_cache, admin_cache in self.iter_caches():
+            if policy_cache is not owner:
+                policy_cache.drop(chat_id)
+        INVALIDATION_CHANNEL.publish('policy', chat_id)
 
     def load_chat_setting(self, chat_id, option, default):
-        try:
-            value = OPTION_CACHE[(chat_id, option)]
-        except KeyError:
-            item = self.db.config.find_one(
-                {'chat_id': chat_id, 'key': option}
-            )
-            if item:
-                value = item['value']
-            else:
-                value = default
-                OPTION_CACHE[(chat_id, option)] = value
-        return value
+        return self.load_chat_policy(chat_id).get(option, default)
 
     def handle_allow(self, bot, update):
         try:
@@ -390,63 +542,426 @@ class WatchdogRobot(TgramRobot):
         except InvalidCommand as ex:
             bot.send_message(msg.chat.id, 'Invalid command')
 
-    def moderate_message(self, bot, msg, msg_type):
+    def edit_chat_list(self, chat_id, key, values, add):
+        old_items = self.load_chat_setting(chat_id, key, None) or []
+        if add:
+            items = list(old_items)
+            for value in values:
+                if value not in items:
+                    items.append(value)
+            if len(items) > MAX_LIST_SIZE:
+                raise InvalidCommand
+        else:
+            items = [x for x in old_items if x not in values]
+        if items != old_items:
+            self.save_chat_setting(chat_id, key, items)
+
+    def handle_list_command(self, bot, update):
         try:
-            bot.delete_message(
-                chat_id=msg.chat.id,
-                message_id=msg.message_id
+            msg = update.effective_message
+            if msg.chat.type == 'private':
+                self.remember_user(msg)
+            if msg.from_user.id not in self.get_chat_admin_ids(bot, msg.chat.id):
+                self.safe_delete_msg(bot, msg)
+            elif msg.chat.type in ('group', 'supergroup'):
+                parts = msg.text.split()
+                command = parts[0][1:].split('@')[0]
+                key, add, normalize = LIST_COMMANDS[command]
+                values = [normalize(x) for x in parts[1:]]
+                if not values or None in values:
+                    raise InvalidCommand
+                if key is None:
+                    keys = [DENIED_DOMAINS, ALLOWED_DOMAINS]
+                else:
+                    keys = [key]
+                for item in keys:
+                    self.edit_chat_list(msg.chat.id, item, values, add)
+                # Domain could be either denied or allowed
+                if add and key in (DENIED_DOMAINS, ALLOWED_DOMAINS):
+                    other = (
+                        ALLOWED_DOMAINS if key == DENIED_DOMAINS
+                        else DENIED_DOMAINS
+                    )
+                    self.edit_chat_list(msg.chat.id, other, values, False)
+                bot.send_message(msg.chat.id, 'Lists have been updated')
+        except InvalidCommand as ex:
+            bot.send_message(msg.chat.id, 'Invalid command')
+
+    def handle_purge(self, bot, update):
+        try:
+            msg = update.effective_message
+            if msg.chat.type == 'private':
+                self.remember_user(msg)
+            if msg.from_user.id not in self.get_chat_admin_ids(bot, msg.chat.id):
+                self.safe_delete_msg(bot, msg)
+            elif msg.chat.type in ('group', 'supergroup'):
+                match = RE_PURGE_COMMAND.match(msg.text)
+                if not match:
+                    raise InvalidCommand
+                minutes = min(PURGE_MAX_MINUTES, int(match.group(1)))
+                msg_type = match.group(2)
+                reply = msg.reply_to_message
+                if msg_type is None and reply is None:
+                    raise InvalidCommand
+                if msg_type in (None, 'all'):
+                    types_mask = None
+                elif msg_type in MSG_TYPES:
+                    types_mask = MSG_TYPE_BITS[msg_type]
+                else:
+                    raise InvalidCommand
+                count = self.purge_recent_messages(
+                    bot, msg.chat.id, minutes * 60,
+                    msg_type if types_mask else 'purge',
+                    types_mask=types_mask,
+                    user_id=reply.from_user.id if reply else None,
+                )
+                bot.send_message(msg.chat.id, 'Deleting %d messages' % count)
+        except InvalidCommand as ex:
+            bot.send_message(msg.chat.id, 'Invalid command')
+
+    def handle_lists(self, bot, update):
+        msg = update.effective_message
+        if msg.chat.type == 'private':
+            self.remember_user(msg)
+        if msg.from_user.id not in self.get_chat_admin_ids(bot, msg.chat.id):
+            self.safe_delete_msg(bot, msg)
+        elif msg.chat.type in ('group', 'supergroup'):
+            out = []
+            for key, title in (
+                    (DENIED_DOMAINS, 'Denied domains'),
+                    (ALLOWED_DOMAINS, 'Allowed domains'),
+                    (BLOCKED_KEYWORDS, 'Blocked words'),
+                ):
+                items = self.load_chat_setting(msg.chat.id, key, None) or []
+                out.append('%s (%d):' % (title, len(items)))
+                for item in sorted(items)[:LIST_DISPLAY_LIMIT]:
+                    out.append(' - %s' % item)
+                if len(items) > LIST_DISPLAY_LIMIT:
+                    out.append(' ... and %d more' % (
+                        len(items) - LIST_DISPLAY_LIMIT
+                    ))
+                out.append('')
+            bot.send_message(
+                chat_id=msg.chat.id, text='\n'.join(out).strip(),
+                disable_web_page_preview=True,
             )
+
+    def handle_log(self, bot, update):
+        try:
+            msg = update.effective_message
+            if msg.chat.type == 'private':
+                self.remember_user(msg)
+            if msg.from_user.id not in self.get_chat_admin_ids(bot, msg.chat.id):
+                self.safe_delete_msg(bot, msg)
+            elif msg.chat.type in ('group', 'supergroup'):
+                match = RE_LOG_COMMAND.match(msg.text)
+                if not match:
+                    raise InvalidCommand
+                days = LOG_DEFAULT_DAYS
+                if match.group(1):
+                    days = max(1, min(AUDIT['max_days'], int(match.group(1))))
+                since = datetime.utcnow() - timedelta(days=days)
+                # Export could take a while, do not block the handler
+                EXPORT_EXECUTOR.submit(
+                    self.export_chat_log, bot, msg.chat.id,
+                    msg.from_user.id, since, match.group(2),
+                )
+                bot.send_message(
+                    msg.chat.id,
+                    'Log of deleted messages will be sent in private message',
+                )
+                if AUDIT['secret'] and AUDIT['url']:
+                    # The link is not for everyone in the chat
+                    self.send_private_message(
+                        bot, msg.from_user.id,
+                        'Log of the chat is available at %s/audit/%d?token=%s'
+                        ' for %d hours'
+                        % (
+                            AUDIT['url'], msg.chat.id,
+                            build_audit_token(
+                                AUDIT['secret'], msg.chat.id,
+                                int(time.time()) + AUDIT['token_ttl'],
+                            ),
+                            AUDIT['token_ttl'] // 3600,
+                        ),
+                    )
+        except InvalidCommand as ex:
+            bot.send_message(msg.chat.id, 'Invalid command')
+
+    def send_private_message(self, bot, user_id, text):
+        try:
+            with track_api_call('sendMessage'):
+                bot.send_message(
+                    user_id, text, disable_web_page_preview=True
+                )
+        except RetryAfter:
+            raise
         except Exception as ex:
-            db.fail.save({
-                'date': datetime.utcnow(),
-                'error': str(ex),
-                'traceback': format_exc(),
-                'msg': msg.to_dict(),
-            })
+            # User has not started private chat with the bot
+            logging.debug('Could not send private message: %s' % ex)
+            return False
+        return True
+
+    def export_chat_log(self, bot, chat_id, user_id, since, reason):
+        # Executed by EXPORT_EXECUTOR, file is sent by action queue
+        try:
+            records = iter_chat_audit(
+                STORAGE, chat_id, since=since, reason=reason
+            )
+            too_large = False
+            with tempfile.NamedTemporaryFile(
+                    suffix='.csv', delete=False
+                ) as out:
+                for chunk in iter_csv(records):
+                    out.write(chunk.encode('utf-8'))
+                    if out.tell() > LOG_MAX_FILE_SIZE:
+                        too_large = True
+                        break
+            if too_large:
+                os.unlink(out.name)
+                ACTION_QUEUE.put(
+                    user_id, self.send_private_message,
+                    args=(
+                        bot, user_id,
+                        'Log is too large, use less days or filter it'
+                        ' by reason',
+                    ),
+                )
+            else:
+                ACTION_QUEUE.put(
+                    user_id, self.send_chat_log,
+                    args=(bot, chat_id, user_id, out.name),
+                )
+        except Exception:
+            logging.error(format_exc())
+
+    def send_chat_log(self, bot, chat_id, user_id, path):
+        # Executed by ACTION_QUEUE worker, RetryAfter is handled there
+        try:
+            with open(path, 'rb') as inp:
+                with track_api_call('sendDocument'):
+                    bot.send_document(
+                        user_id, inp,
+                        filename='watchdog_log_%d.csv' % abs(chat_id),
+                    )
+        except RetryAfter:
+            # File is needed for the next attempt
             raise
+        except Exception as ex:
+            os.unlink(path)
+            logging.debug('Could not send log file: %s' % ex)
+            with track_api_call('sendMessage'):
+                bot.send_message(
+                    chat_id, 'Could not send the log. Start private'
+                    ' chat with the bot and try again.'
+                )
         else:
-            db.log.save({
-                'date': datetime.utcnow(),
-                'text': msg.text,
-                'type': 'delete',
-                'reason': msg_type,
-                'msg': msg.to_dict(),
-            })
-            if self.is_notification_enabled(msg.chat.id):
-                msg_text = 'Message from %s deleted. Reason: %s' % (
-                    self.build_user_name(msg.from_user), msg_type
+            os.unlink(path)
+
+    def log_moderation(self, msg, msg_type):
+        now = datetime.utcnow()
+        record = build_log_record(msg, now, 'delete', msg_type)
+        STORAGE.add_log_event(record)
+        if ARCHIVE:
+            ARCHIVE.write('log', dict(record, msg=msg.to_dict()))
+        STORAGE.record_deletion(now, msg.chat.id, msg_type)
+
+    def log_moderation_failure(self, msg, ex):
+        record = build_fail_record(
+            msg, datetime.utcnow(), str(ex), format_exc()
+        )
+        STORAGE.add_failure(record)
+        if ARCHIVE:
+            ARCHIVE.write('fail', dict(record, msg=msg.to_dict()))
+
+    def build_moderation_notice(self, msg, msg_type):
+        return 'Message from %s deleted. Reason: %s' % (
+            self.build_user_name(msg.from_user), msg_type
+        )
+
+    def moderate_message(self, bot, msg, msg_type):
+        # Executed by ACTION_QUEUE worker, RetryAfter is handled there
+        try:
+            with track_api_call('deleteMessage'):
+                bot.delete_message(
+                    chat_id=msg.chat.id,
+                    message_id=msg.message_id
                 )
-                bot.send_message(
-                    chat_id=msg.chat.id, text=msg_text
+        except RetryAfter:
+            raise
+        except Exception as ex:
+            self.log_moderation_failure(msg, ex)
+            raise
+        else:
+            self.log_moderation(msg, msg_type)
+            if self.is_notification_enabled(msg.chat.id):
+                self.queue_notification(bot, msg, msg_type)
+
+    def queue_notification(self, bot, msg, msg_type):
+        NOTIFICATIONS.add(
+            msg.chat.id, msg.from_user.id, msg_type,
+            self.build_moderation_notice(msg, msg_type),
+            partial(self.flush_notifications, bot),
+        )
+
+    def flush_notifications(self, bot, chat_id, summary):
+        ACTION_QUEUE.put(
+            chat_id, self.send_notification, args=(bot, chat_id, summary)
+        )
+
+    def send_notification(self, bot, chat_id, summary):
+        # Executed by ACTION_QUEUE worker, RetryAfter is handled there
+        rolling = self.load_chat_policy(chat_id).get_setting('notify_rolling')
+        prev = NOTIFICATIONS.get_rolling(chat_id) if rolling else None
+        if prev:
+            prev_message_id, prev_summary = prev
+            summary = prev_summary.merged(summary)
+            try:
+                with track_api_call('editMessageText'):
+                    bot.edit_message_text(
+                        summary.render(), chat_id=chat_id,
+                        message_id=prev_message_id,
+                    )
+            except RetryAfter:
+                raise
+            except Exception as ex:
+                # Summary message could be deleted by chat admin
+                logging.debug('Could not edit summary message: %s' % ex)
+            else:
+                NOTIFICATIONS.set_rolling(chat_id, prev_message_id, summary)
+                return
+        with track_api_call('sendMessage'):
+            sent = bot.send_message(chat_id=chat_id, text=summary.render())
+        if rolling:
+            NOTIFICATIONS.set_rolling(
+                chat_id, sent.message_id, summary, sent_time=time.time()
+            )
+            if prev:
+                # Leave only one summary message in the chat
+                ACTION_QUEUE.put(
+                    chat_id, self.safe_delete_message,
+                    args=(bot, chat_id, prev[0]), chat_limited=False,
                 )
 
+    def remember_recent_message(self, msg, msg_type):
+        # Types are remembered in all chats, a type blocked just now
+        # could be purged right away
+        types_mask = CLASSIFIER.find_mask(msg)
+        if msg_type:
+            types_mask |= MSG_TYPE_BITS.get(msg_type, 0)
+        RECENT_MESSAGES.add(
+            msg.chat.id, msg.message_id, msg.from_user.id, types_mask,
+            int(time.time()),
+        )
+
+    def purge_recent_messages(
+            self, bot, chat_id, seconds, reason, types_mask=None,
+            user_id=None,
+        ):
+        """
+        Queue deletion of recent chat messages, return their number.
+        Messages of admins and messages which have been deleted already
+        are skipped.
+        """
+        admin_ids = self.get_chat_admin_ids(bot, chat_id)
+        items = [
+            (message_id, msg_user_id)
+            for message_id, msg_user_id in RECENT_MESSAGES.find(
+                chat_id, time.time() - seconds, types_mask, user_id
+            )
+            if msg_user_id not in admin_ids
+            and self.claim_moderation(chat_id, message_id)
+        ]
+        for idx in range(0, len(items), PURGE_CHUNK_SIZE):
+            ACTION_QUEUE.put(
+                chat_id, self.delete_messages,
+                args=(
+                    bot, chat_id, items[idx:idx + PURGE_CHUNK_SIZE], reason,
+                ),
+                chat_limited=False,
+            )
+        return len(items)
+
+    def purge_rate_limited(self, bot, msg, msg_type):
+        # Messages posted before the limit was reached are deleted too
+        if msg_type == 'flood':
+            self.purge_recent_messages(
+                bot, msg.chat.id, FLOOD['window'], msg_type,
+                user_id=msg.from_user.id,
+            )
+        elif msg_type == 'join_raid':
+            self.purge_recent_messages(
+                bot, msg.chat.id, JOIN_RAID['window'], msg_type,
+                types_mask=MSG_TYPE_BITS['user_joined_msg'],
+            )
+
+    def delete_messages(self, bot, chat_id, items, reason):
+        """
+        Delete messages given as (message_id, user_id) pairs and log
+        deletions.
+        """
+        # Executed by ACTION_QUEUE worker, RetryAfter is handled there
+        message_ids = [x[0] for x in items]
+        try:
+            with track_api_call('deleteMessages'):
+                if hasattr(bot, 'delete_messages'):
+                    bot.delete_messages(chat_id, message_ids)
+                else:
+                    # python-telegram-bot <= 12 has no deleteMessages
+                    # method, the request object raises RetryAfter and
+                    # other API errors as bot methods do
+                    bot.request.post('%s/deleteMessages' % bot.base_url, {
+                        'chat_id': chat_id, 'message_ids': message_ids,
+                    })
+        except RetryAfter:
+            raise
+        except Exception as ex:
+            logging.debug('Could not delete messages: %s' % ex)
+        else:
+            self.log_purge(chat_id, items, reason)
+
+    def log_purge(self, chat_id, items, reason):
+        now = datetime.utcnow()
+        for message_id, user_id in items:
+            STORAGE.add_log_event(build_purge_record(
+                chat_id, user_id, message_id, now, reason
+            ))
+            STORAGE.record_deletion(now, chat_id, reason)
+
     def handle_any_message(self, bot, update):
-        msg = update.effective_message
+        with PROFILER.track(update.update_id):
+            with METRICS.timer('handler_stage_seconds', stage='total'):
+                self.process_message(bot, update.effective_message)
+
+    def process_message(self, bot, msg):
         if msg.chat.type == 'private':
             self.remember_user(msg)
             return
+        with METRICS.timer('handler_stage_seconds', stage='policy'):
+            policy = self.load_chat_policy(msg.chat.id)
+        with METRICS.timer('handler_stage_seconds', stage='classify'):
+            msg_type = CLASSIFIER.classify(
+                msg, policy.blocked_mask, policy.get_matcher()
+            )
+        self.remember_recent_message(msg, msg_type)
+        if msg_type is None:
+            return
         # Do not block messages from admins
-        if msg.from_user.id in self.get_chat_admin_ids(bot, msg.chat.id):
+        with METRICS.timer('handler_stage_seconds', stage='admin'):
+            admin_ids = self.get_chat_admin_ids(bot, msg.chat.id)
+        if msg.from_user.id in admin_ids:
             return
-        # Handle message from non-admin user
-        types = self.find_msg_types(msg)
-        if types:
-            for msg_type in types:
-                allowed = self.load_chat_setting(
-                    msg.chat.id,
-                    'is_allowed_%s' % msg_type,
-                    DEFAULT_IS_ALLOWED
-                )
-                if not allowed:
-                    self.moderate_message(bot, msg, msg_type)
-                    break
+        if not self.claim_moderation(msg.chat.id, msg.message_id):
+            return
+        ACTION_QUEUE.put(
+            msg.chat.id, self.moderate_message,
+            args=(bot, msg, msg_type), chat_limited=False,
+        )
+        if msg_type in RATE_TYPES:
+            self.purge_rate_limited(bot, msg, msg_type)
 
     def is_notification_enabled(self, chat_id):
-        return self.load_chat_setting(
-            chat_id,
-            'notify_actions',
-            DEFAULT_SETTINGS['notify_actions'],
-        )
+        return self.load_chat_policy(chat_id).get_setting('notify_actions')
 
     #def handle_new_chat_members(self, bot, update):
     #    msg = update.effective_message
@@ -506,6 +1021,15 @@ class WatchdogRobot(TgramRobot):
     #                        )
 
     def register_handlers(self, dispatcher):
+        install_transport(dispatcher.bot, BOT_API)
+        dispatcher.add_handler(
+            TypeHandler(Update, self.handle_duplicate_update), group=-3
+        )
+        if SHARD_POOL:
+            SHARD_POOL.start(dispatcher)
+            dispatcher.add_handler(
+                TypeHandler(Update, SHARD_POOL.route), group=-2
+            )
         dispatcher.add_handler(CommandHandler(
             ['start', 'help'], self.handle_start_help)
         )
@@ -522,6 +1046,18 @@ class WatchdogRobot(TgramRobot):
         dispatcher.add_handler(CommandHandler(
             'watchdog_set', self.handle_set
         ))
+        dispatcher.add_handler(CommandHandler(
+            list(LIST_COMMANDS), self.handle_list_command
+        ))
+        dispatcher.add_handler(CommandHandler(
+            'watchdog_lists', self.handle_lists
+        ))
+        dispatcher.add_handler(CommandHandler(
+            'watchdog_purge', self.handle_purge
+        ))
+        dispatcher.add_handler(CommandHandler(
+            'watchdog_log', self.handle_log
+        ))
         #dispatcher.add_handler(MessageHandler(
         #    Filters.status_update.new_chat_members, self.handle_new_chat_members
         #))
@@ -541,5 +1077,22 @@ class WatchdogRobot(TgramRobot):
         #)
 
 
+def run_async_polling():
+    import asyncio
+
+    robot = WatchdogRobot()
+    engine = robot.build_async_engine()
+    asyncio.get_event_loop().run_until_complete(engine.run_polling())
+
+
 if __name__ == '__main__':
-    run_polling(WatchdogRobot)
+    parser = ArgumentParser()
+    parser.add_argument(
+        '--async', dest='async_mode', action='store_true',
+        help='run asyncio engine instead of threaded dispatcher',
+    )
+    opts, _ = parser.parse_known_args()
+    if opts.async_mode:
+        run_async_polling()
+    else:
+        run_polling(WatchdogRobot)
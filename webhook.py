@@ -1,12 +1,63 @@
+from itertools import chain
+
+from bottle import request, response, abort
 from tgram.webhook import build_wsgi_app
 
-from watchdog_robot import WatchdogRobot
+from project.metrics import METRICS
+from project.audit import (
+    AUDIT_FORMATS, iter_chat_audit, render_audit, parse_audit_date,
+    check_audit_token,
+)
+from project.settings import AUDIT
+from watchdog_robot import WatchdogRobot, STORAGE
 
 robot = WatchdogRobot() 
 robot.set_opts({'mode': 'production'})
+# Each gunicorn worker has own caches, keep them in sync
+robot.warm_up_caches()
+robot.start_cache_invalidation()
 app = build_wsgi_app(robot)
 
 
+@app.route('/metrics')
+def metrics():
+    response.content_type = 'text/plain; version=0.0.4'
+    return METRICS.render()
+
+
+@app.route('/audit/<chat_id:int>')
+def audit(chat_id):
+    """
+    Stream moderation log of the chat. Query parameters: token, format
+    (csv or jsonl), since and until (YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS),
+    reason, after (cursor of the last received record) and limit.
+    """
+    query = request.query
+    if not check_audit_token(AUDIT['secret'], chat_id, query.token):
+        abort(403, 'Invalid or expired token')
+    fmt = query.format or 'csv'
+    if fmt not in AUDIT_FORMATS:
+        abort(400, 'Invalid format')
+    try:
+        since = parse_audit_date(query.since) if query.since else None
+        until = parse_audit_date(query.until) if query.until else None
+        limit = int(query.limit) if query.limit else None
+        records = iter_chat_audit(
+            STORAGE, chat_id, since=since, until=until,
+            reason=query.reason or None, after=query.after or None,
+            limit=limit,
+        )
+        # Fetch first page now to report invalid cursor as bad request
+        first = next(records, None)
+    except ValueError:
+        abort(400, 'Invalid parameters')
+    if first is not None:
+        records = chain([first], records)
+    response.content_type = AUDIT_FORMATS[fmt]
+    # Generator is sent to the client chunk by chunk
+    return render_audit(records, fmt)
+
+
 if __name__ == '__main__':
     from bottle import run
     run(app)